@@ -0,0 +1,244 @@
+"""
+Per-sample glycan abundances: bulk import and glycan x sample matrices.
+
+`ingest(study, path)` loads a long-format table, one row per (sample,
+glycan), into Sample / Measurement. Files are CSV or TSV (optionally .gz /
+.zst compressed) with a header row; columns are matched by name, ignoring
+case, spaces and dashes:
+
+    sample               sample, sample_name, sample_id
+    glycan_id            glycan_id, glycan, lbg_id
+    relative_abundance   relative_abundance, abundance, percent     (optional)
+    gu_observed          gu_observed, gu                            (optional)
+    intensity            intensity, area, peak_area                 (optional)
+
+The file is streamed into a staging table with COPY as raw text, then
+converted and moved over in a few set-based statements, so no Python
+object is built per row. Missing relative abundances are derived from the
+intensities (% of the sample's total). Samples are created as needed,
+re-imported (sample, glycan) pairs overwrite their old values, and the
+measured glycans are linked to the study (Glycan.studies).
+
+`pivot()` returns the glycan x sample matrix of one value column as a
+float64 NumPy array (NaN where a glycan wasn't measured). The server packs
+each sample's column into one bytea of fixed-width binary `(row, value)`
+records (`int4send || float8send`), so a sample costs one result row and
+one `np.frombuffer`, whatever its number of glycans, and no ORM objects
+are built.
+"""
+
+import csv
+import io
+import re
+from dataclasses import dataclass
+
+import numpy as np
+import psycopg
+from django.db import DataError, connection, transaction
+
+from . import glycan_search, table_versions
+from .bulk_load import open_compressed
+from .models import Glycan, Measurement, Sample
+
+COLUMNS = {
+    "sample": ("sample", "sample_name", "sample_id"),
+    "glycan_id": ("glycan_id", "glycan", "lbg_id"),
+    "relative_abundance": ("relative_abundance", "abundance", "percent"),
+    "gu_observed": ("gu_observed", "gu"),
+    "intensity": ("intensity", "area", "peak_area"),
+}
+VALUE_FIELDS = ("relative_abundance", "gu_observed", "intensity")
+
+# One packed (row, value) record of a pivot() column, in network byte order.
+_RECORD = np.dtype([("row", ">i4"), ("value", ">f8")])
+
+
+def _normalise_header(name):
+    return re.sub(r"[\s-]+", "_", name.strip().lower())
+
+
+def _positions(header):
+    """`{column: position}` for the COLUMNS found in a header row."""
+    names = [_normalise_header(name) for name in header]
+    positions = {}
+    for column, aliases in COLUMNS.items():
+        for alias in aliases:
+            if alias in names:
+                positions[column] = names.index(alias)
+                break
+    missing = [column for column in ("sample", "glycan_id") if column not in positions]
+    if missing:
+        raise ValueError(f"Abundance file has no {' or '.join(missing)} column.")
+    return positions
+
+
+def _copy_line(exc):
+    """' line N' of the file a COPY error points at, if it names one."""
+    match = re.search(r"\bline (\d+)", exc.diag.context or "")
+    return f" line {int(match[1]) + 1}" if match else ""  # COPY counts from the row after the header
+
+
+def ingest(study, path):
+    """
+    Load the abundance file at `path` into `study`. Returns
+    `{"rows", "samples", "measurements", "unknown_glycans"}`: rows read,
+    samples created, measurements written, and rows skipped because their
+    glycan ID isn't in the library. Raises ValueError for a malformed file.
+    """
+    q = connection.ops.quote_name
+    samples, measurements = q(Sample._meta.db_table), q(Measurement._meta.db_table)
+    glycans, links = q(Glycan._meta.db_table), q(Glycan.studies.through._meta.db_table)
+    with open_compressed(path) as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as stream:
+        first = stream.readline()
+        delimiter = "\t" if "\t" in first else ","
+        header = next(csv.reader([first], delimiter=delimiter), [])
+        positions = _positions(header)
+        staging = [f"c{i} text" for i in range(len(header))]
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"CREATE TEMPORARY TABLE abundance_staging ({', '.join(staging)}) ON COMMIT DROP")
+            delimiter_sql = "E'\\t'" if delimiter == "\t" else "','"
+            try:
+                with cursor.copy(f"COPY abundance_staging FROM STDIN (FORMAT csv, DELIMITER {delimiter_sql})") as copy:
+                    while chunk := stream.read(1 << 20):
+                        copy.write(chunk)
+            except psycopg.errors.DataError as exc:  # e.g. a row with more or fewer columns than the header
+                raise ValueError(f"Abundance file{_copy_line(exc)}: {exc.diag.message_primary}") from exc
+
+            def column(name, cast="text"):
+                if name not in positions:
+                    return f"NULL::{cast}"
+                value = f"nullif(trim(c{positions[name]}), '')"
+                return value if cast == "text" else f"{value}::{cast}"
+
+            try:
+                cursor.execute(
+                    "CREATE TEMPORARY TABLE abundance_rows ON COMMIT DROP AS "
+                    f"SELECT {column('sample')} AS sample, {column('glycan_id')} AS glycan_id, "
+                    f"{column('relative_abundance', 'float8')} AS relative_abundance, "
+                    f"{column('gu_observed', 'float8')} AS gu_observed, "
+                    f"{column('intensity', 'float8')} AS intensity FROM abundance_staging"
+                )
+            except DataError as exc:  # a value column that isn't a number
+                raise ValueError(f"Abundance file: {exc.__cause__.diag.message_primary}") from exc
+            cursor.execute("SELECT count(*) FROM abundance_rows")
+            rows = cursor.fetchone()[0]
+            cursor.execute(
+                f"SELECT count(*) FROM abundance_rows r WHERE r.sample IS NOT NULL "
+                f"AND NOT EXISTS (SELECT 1 FROM {glycans} g WHERE g.id = r.glycan_id)"
+            )
+            unknown = cursor.fetchone()[0]
+
+            cursor.execute(
+                f"INSERT INTO {samples} (study_id, name) "
+                f"SELECT %s, sample FROM abundance_rows WHERE sample IS NOT NULL "
+                f"GROUP BY sample ORDER BY min(ctid) "  # in file order
+                f"ON CONFLICT (study_id, name) DO NOTHING",
+                [study.pk],
+            )
+            created = cursor.rowcount
+            # Sorted by sample so each sample's rows stay physically together
+            # (what the BRIN index relies on). A (sample, glycan) listed twice
+            # keeps its last row.
+            cursor.execute(
+                f"INSERT INTO {measurements} (sample_id, glycan_id, relative_abundance, gu_observed, intensity) "
+                f"SELECT sample_id, glycan_id, "
+                f"       coalesce(relative_abundance, 100 * intensity / nullif(sum(intensity) OVER (PARTITION BY sample_id), 0)), "
+                f"       gu_observed, intensity "
+                f"FROM (SELECT DISTINCT ON (s.id, r.glycan_id) s.id AS sample_id, r.glycan_id, "
+                f"             r.relative_abundance, r.gu_observed, r.intensity "
+                f"      FROM abundance_rows r JOIN {samples} s ON s.study_id = %s AND s.name = r.sample "
+                f"      JOIN {glycans} g ON g.id = r.glycan_id "
+                f"      ORDER BY s.id, r.glycan_id, r.ctid DESC) m "
+                f"ORDER BY sample_id "
+                f"ON CONFLICT (glycan_id, sample_id) DO UPDATE SET relative_abundance = excluded.relative_abundance, "
+                f"gu_observed = excluded.gu_observed, intensity = excluded.intensity",
+                [study.pk],
+            )
+            written = cursor.rowcount
+            cursor.execute(
+                f"INSERT INTO {links} (glycan_id, study_id) "
+                f"SELECT DISTINCT r.glycan_id, %s FROM abundance_rows r JOIN {glycans} g ON g.id = r.glycan_id "
+                f"ON CONFLICT DO NOTHING RETURNING glycan_id",
+                [study.pk],
+            )
+            linked = [row[0] for row in cursor.fetchall()]
+            # Explicit: ON COMMIT only fires at the outermost commit.
+            cursor.execute("DROP TABLE abundance_staging, abundance_rows")
+
+            table_versions.bump(Sample._meta.db_table, Measurement._meta.db_table)
+            if linked:
+                table_versions.bump(Glycan.studies.through._meta.db_table)
+                glycan_search.refresh(linked)  # study_dois
+    return {"rows": rows, "samples": created, "measurements": written, "unknown_glycans": unknown}
+
+
+@dataclass
+class AbundanceMatrix:
+    """A glycan x sample matrix: `values[i, j]` is glycan `glycans[i]` in sample `samples[j]`."""
+
+    glycans: np.ndarray  # glycan ids
+    samples: np.ndarray  # sample pks
+    sample_names: np.ndarray
+    values: np.ndarray  # float64, NaN where not measured
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def to_arrow(self):
+        """A pyarrow Table: a glycan_id column, then one column per sample name."""
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ValueError("Arrow output needs the optional 'pyarrow' package.")
+        columns = [pa.array(self.glycans.astype(str))]
+        columns += [pa.array(self.values[:, j], from_pandas=True) for j in range(len(self.samples))]
+        return pa.Table.from_arrays(columns, names=["glycan_id", *map(str, self.sample_names)])
+
+
+def pivot(study=None, samples=None, glycans=None, value="relative_abundance"):
+    """
+    The `value` ("relative_abundance", "gu_observed" or "intensity") of
+    every glycan in every sample of `study` (or the Sample pks `samples`,
+    in that order). Rows are `glycans`, or every glycan measured in those
+    samples in ID order.
+    """
+    if value not in VALUE_FIELDS:
+        raise ValueError(f"Unknown value column: {value!r} (choose from {', '.join(VALUE_FIELDS)})")
+    sample_rows = Sample.objects.order_by("pk")
+    sample_rows = sample_rows.filter(study=study) if samples is None else sample_rows.filter(pk__in=samples)
+    names = dict(sample_rows.values_list("pk", "name"))
+    sample_ids = list(names) if samples is None else [pk for pk in samples if pk in names]
+
+    q = connection.ops.quote_name
+    measurements = q(Measurement._meta.db_table)
+    if glycans is None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT DISTINCT glycan_id FROM {measurements} WHERE sample_id = ANY(%s) ORDER BY 1", [sample_ids]
+            )
+            glycans = [row[0] for row in cursor.fetchall()]
+    glycans = list(glycans)
+
+    matrix = np.full((len(glycans), len(sample_ids)), np.nan)
+    if glycans and sample_ids:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT s.ord - 1, "
+                f"       string_agg(int4send(g.ord::int4 - 1) || float8send(coalesce(m.{q(value)}, 'NaN')), ''::bytea) "
+                f"FROM {measurements} m "
+                f"JOIN unnest(%s::bigint[]) WITH ORDINALITY s(id, ord) ON m.sample_id = s.id "
+                f"JOIN unnest(%s::text[]) WITH ORDINALITY g(id, ord) ON m.glycan_id = g.id "
+                f"GROUP BY s.ord",
+                [sample_ids, glycans],
+            )
+            for column, packed in cursor.fetchall():
+                records = np.frombuffer(packed, dtype=_RECORD)
+                matrix[records["row"], column] = records["value"]
+    return AbundanceMatrix(
+        glycans=np.array(glycans, dtype=object),
+        samples=np.array(sample_ids, dtype=np.int64),
+        sample_names=np.array([names[pk] for pk in sample_ids], dtype=object),
+        values=matrix,
+    )
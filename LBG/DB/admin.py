@@ -1,5 +1,12 @@
+import functools
+
+from django.conf import settings
 from django.contrib import admin
+from django.db.models import OuterRef, StringAgg, Subquery, Value
+from django.urls import reverse
+from django.utils.encoding import filepath_to_uri
 from django.utils.html import format_html
+from . import composition_query, facets, motif_index, text_search, thumbnails
 from .models import (
     Tissue,
     OntogenicStage,
@@ -8,19 +15,37 @@ from .models import (
     Study,
     LastAuthor,
     Glycan,
+    Sample,
 )
 
 
+# Admin search as set operations on the primary key (see text_search.py):
+# each word is a UNION of single-column matches that the trigram indexes can
+# answer, words are INTERSECTed, and the changelist filters on `pk IN (...)`,
+# so related search fields never need a JOIN + DISTINCT.
+class IndexedSearchMixin:
+    search_vector_field = None  # optional full-text column searched with the whole term
+
+    def get_search_results(self, request, queryset, search_term):
+        search_fields = self.get_search_fields(request)
+        if not search_fields or any(field.startswith(("^", "=", "@")) for field in search_fields):
+            return super().get_search_results(request, queryset, search_term)
+        ids = text_search.matching_ids(self.model, search_fields, search_term, self.search_vector_field)
+        if ids is None:
+            return queryset, False
+        return queryset.filter(pk__in=ids), False
+
+
 # Admin configuration for Tissue model (was Sublocation)
 @admin.register(Tissue)
-class TissueAdmin(admin.ModelAdmin):
+class TissueAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ("id", "organ", "structure", "uberon_id")
     search_fields = ("organ", "structure", "uberon_id")
 
 
 # Admin configuration for OntogenicStage model (was StageOfLife)
 @admin.register(OntogenicStage)
-class OntogenicStageAdmin(admin.ModelAdmin):
+class OntogenicStageAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ("id", "stage", "age")
     search_fields = ("stage", "age")
 
@@ -28,7 +53,7 @@ class OntogenicStageAdmin(admin.ModelAdmin):
 # Admin configuration for ModelSpecies model
 # (the old standalone Species model is now merged into this one)
 @admin.register(ModelSpecies)
-class ModelSpeciesAdmin(admin.ModelAdmin):
+class ModelSpeciesAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ("id", "species_name", "species_taxid", "tissue", "stage")
     search_fields = (
         "species_name",
@@ -38,11 +63,31 @@ class ModelSpeciesAdmin(admin.ModelAdmin):
         "stage__stage",
     )
     list_filter = ("species_name", "stage")
+    list_select_related = ("tissue", "stage")  # both are shown via __str__
+
+
+# A search that parses as a composition query ("H5N4F*S1-2", see
+# composition_query.py) becomes range filters on the indexed count columns,
+# plus any exact text matches in the other search fields (an ID such as
+# "G00031" also parses). Anything else is an ordinary indexed search.
+class CompositionSearchMixin(IndexedSearchMixin):
+    composition_prefix = ""  # lookup path from the admin's model to the counts
+
+    def get_search_results(self, request, queryset, search_term):
+        try:
+            condition = composition_query.compile_query(search_term, prefix=self.composition_prefix)
+        except ValueError:
+            return super().get_search_results(request, queryset, search_term)
+        ids = queryset.filter(condition).values("pk")
+        other_fields = [f for f in self.get_search_fields(request) if not f.endswith("composition_string")]
+        if other_fields:
+            ids = ids.union(text_search.matching_ids(self.model, other_fields, search_term))
+        return queryset.filter(pk__in=ids), False
 
 
 # Admin configuration for MonosaccharideComposition model
 @admin.register(MonosaccharideComposition)
-class MonosaccharideCompositionAdmin(admin.ModelAdmin):
+class MonosaccharideCompositionAdmin(CompositionSearchMixin, admin.ModelAdmin):
     list_display = (
         "id",
         "H_num",
@@ -61,111 +106,122 @@ class MonosaccharideCompositionAdmin(admin.ModelAdmin):
 
 # Admin configuration for LastAuthor model
 @admin.register(LastAuthor)
-class LastAuthorAdmin(admin.ModelAdmin):
+class LastAuthorAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ("id", "full_name", "affiliation")
     search_fields = ("full_name", "affiliation")
 
 
 # Admin configuration for Study model
 @admin.register(Study)
-class StudyAdmin(admin.ModelAdmin):
+class StudyAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ("id", "title", "journal", "year", "doi", "authors_list")
     search_fields = ("title", "journal", "doi", "last_authors__full_name")
+    search_vector_field = "search_vector"
     list_filter = ("year", "journal")
     autocomplete_fields = ["last_authors"]
 
+    def get_queryset(self, request):
+        # Aggregate the author names in a correlated subquery rather than a
+        # JOIN + GROUP BY, so the search filter on last_authors__full_name
+        # can't duplicate names in the list.
+        links = Study.last_authors.through.objects.filter(study_id=OuterRef("pk"))
+        authors = (
+            links.values("study_id")
+            .annotate(names=StringAgg("lastauthor__full_name", Value(", "), order_by="lastauthor__full_name"))
+            .values("names")
+        )
+        return super().get_queryset(request).annotate(authors=Subquery(authors))
+
     def authors_list(self, obj):
         """Displays a comma-separated list of authors for the study."""
-        return ", ".join(author.full_name for author in obj.last_authors.all())
+        return obj.authors or ""
 
     authors_list.short_description = "Authors"
+    authors_list.admin_order_field = "authors"
 
 
-# Custom filter for filtering Glycan records based on associated species.
-# Species name now lives on ModelSpecies, so we list the distinct names there.
-class SpeciesFilter(admin.SimpleListFilter):
-    title = "Species"
-    parameter_name = "species"
-
-    def lookups(self, request, model_admin):
-        names = (
-            ModelSpecies.objects.order_by("species_name")
-            .values_list("species_name", flat=True)
-            .distinct()
-        )
-        return [(name, name) for name in names]
-
-    def queryset(self, request, queryset):
-        if self.value():
-            return queryset.filter(model_species__species_name=self.value()).distinct()
-        return queryset
+# Admin configuration for Sample model. Measurements are bulk data loaded
+# with `manage.py abundance_import` and are not edited here.
+@admin.register(Sample)
+class SampleAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    list_display = ("id", "name", "study", "tissue")
+    list_select_related = ("study", "tissue")
+    search_fields = ("name", "study__title", "study__doi")
+    autocomplete_fields = ["study", "tissue"]
 
 
-# Custom filter for filtering Glycan records by Glycan Unit (GU) range
-class GURangeFilter(admin.SimpleListFilter):
-    title = "GU Range"
-    parameter_name = "gu_range"
+# Glycan changelist filters. Options and their glycan counts come from the
+# cached facet query in facets.py (one grouped query, not one per filter), and
+# filtering uses EXISTS subqueries instead of joining the M2M + DISTINCT.
+class FacetFilter(admin.SimpleListFilter):
+    facet = None
 
     def lookups(self, request, model_admin):
         return [
-            ("0-2", "0.0 - 2.0"),
-            ("2-5", "2.0 - 5.0"),
-            ("5-7", "5.0 - 7.0"),
-            ("7-10", "7.0 - 10.0"),
-            ("10+", "> 10.0"),
+            (value, f"{label} ({count})")
+            for value, (label, count) in facets.counts()[self.facet].items()
         ]
 
     def queryset(self, request, queryset):
         if self.value():
-            min_val, max_val = {
-                "0-2": (0.0, 2.0),
-                "2-5": (2.0, 5.0),
-                "5-7": (5.0, 7.0),
-                "7-10": (7.0, 10.0),
-                "10+": (10.0, None),
-            }.get(self.value(), (None, None))
-
-            if min_val is not None and max_val is not None:
-                return queryset.filter(gu_mean__gte=min_val, gu_mean__lt=max_val)
-            elif min_val is not None:
-                return queryset.filter(gu_mean__gte=min_val)
+            condition = facets.filter_q(self.facet, self.value())
+            if condition is not None:
+                return queryset.filter(condition)
         return queryset
 
 
-# Custom filter for filtering Glycan records by mass range
-class MassRangeFilter(admin.SimpleListFilter):
+# Filter Glycan records by associated species.
+# Species name now lives on ModelSpecies, so we list the distinct names there.
+class SpeciesFilter(FacetFilter):
+    title = "Species"
+    parameter_name = "species"
+    facet = "species"
+
+
+class TissueFilter(FacetFilter):
+    title = "Tissue"
+    parameter_name = "tissue"
+    facet = "tissue"
+
+
+class OntogenicStageFilter(FacetFilter):
+    title = "Ontogenic stage"
+    parameter_name = "stage"
+    facet = "stage"
+
+
+# Filter Glycan records by Glycan Unit (GU) range (buckets in facets.GU_BUCKETS)
+class GURangeFilter(FacetFilter):
+    title = "GU Range"
+    parameter_name = "gu_range"
+    facet = "gu"
+
+
+# Filter Glycan records by mass range (buckets in facets.MASS_BUCKETS)
+class MassRangeFilter(FacetFilter):
     title = "Mass Range"
     parameter_name = "mass_range"
+    facet = "mass"
+
+
+# Filter Glycan records by structural motif (named motifs in motif_index.MOTIFS)
+class MotifFilter(admin.SimpleListFilter):
+    title = "Motif"
+    parameter_name = "motif"
 
     def lookups(self, request, model_admin):
-        return [
-            ("0-500", "0 - 500"),
-            ("500-1000", "500 - 1000"),
-            ("1000-1500", "1000 - 1500"),
-            ("1500-2000", "1500 - 2000"),
-            ("2000+", "> 2000"),
-        ]
+        return [(name, name.replace("_", " ").capitalize()) for name in motif_index.MOTIFS]
 
     def queryset(self, request, queryset):
-        if self.value():
-            min_val, max_val = {
-                "0-500": (0, 500),
-                "500-1000": (500, 1000),
-                "1000-1500": (1000, 1500),
-                "1500-2000": (1500, 2000),
-                "2000+": (2000, None),
-            }.get(self.value(), (None, None))
-
-            if min_val is not None and max_val is not None:
-                return queryset.filter(mass__gte=min_val, mass__lt=max_val)
-            elif min_val is not None:
-                return queryset.filter(mass__gte=min_val)
+        if self.value() in motif_index.MOTIFS:
+            ids, _ = motif_index.get_index().search(self.value())
+            return queryset.filter(pk__in=ids)
         return queryset
 
 
 # Admin configuration for Glycan model
 @admin.register(Glycan)
-class GlycanAdmin(admin.ModelAdmin):
+class GlycanAdmin(CompositionSearchMixin, admin.ModelAdmin):
     list_display = (
         "id",
         "monosaccharide_composition_display",
@@ -188,23 +244,52 @@ class GlycanAdmin(admin.ModelAdmin):
         "brain_specific",
         "sialic_acid_derivatization",
         SpeciesFilter,
+        TissueFilter,
+        OntogenicStageFilter,
         GURangeFilter,
         MassRangeFilter,
+        MotifFilter,
     )
     filter_horizontal = ("model_species", "studies")  # diagnostic_fragments removed
+    # One JOIN instead of a composition query per row.
+    list_select_related = ("monosaccharide_comp",)
+    composition_prefix = "monosaccharide_comp__"
 
     def monosaccharide_composition_display(self, obj):
         """Displays the composition string of the associated MonosaccharideComposition."""
         return str(obj.monosaccharide_comp)
 
     monosaccharide_composition_display.short_description = "Monosaccharide Composition"
+    monosaccharide_composition_display.admin_order_field = "monosaccharide_comp__composition_string"
 
     def display_image(self, obj):
         """Displays a thumbnail of the glycan's graphical (SNFG) structure image."""
+        if obj.image_digest:
+            # Content-hashed thumbnails (thumbnails.py): WebP where supported,
+            # PNG otherwise, with a 2x version for high-DPI screens.
+            url = functools.partial(thumbnails.thumbnail_url, obj.image_digest)
+            return format_html(
+                '<picture><source type="image/webp" srcset="{} 1x, {} 2x">'
+                '<img src="{}" srcset="{} 2x" width="100" height="100" loading="lazy" style="object-fit:contain;"/>'
+                "</picture>",
+                url(100, "webp"),
+                url(200, "webp"),
+                url(100, "png"),
+                url(200, "png"),
+            )
         if obj.graphical_structure:
+            # Not thumbnailed (yet): build the URL from the stored name instead of
+            # asking the storage backend per row (remote backends may do a request per call).
+            return format_html(
+                '<img src="{}{}" width="100" height="100" loading="lazy" style="object-fit:contain;"/>',
+                settings.MEDIA_URL,
+                filepath_to_uri(obj.graphical_structure.name),
+            )
+        if obj.wurcs:
+            # No uploaded image: draw it from the WURCS (snfg.py, cached on disk).
             return format_html(
-                '<img src="{}" width="100" height="100" style="object-fit:contain;"/>',
-                obj.graphical_structure.url,
+                '<img src="{}" width="100" height="100" loading="lazy" style="object-fit:contain;"/>',
+                reverse("DB:glycan-snfg", kwargs={"pk": obj.pk, "fmt": "svg"}),
             )
         return "No Image"
 
@@ -0,0 +1,283 @@
+"""
+Batch annotation of MS peak lists against the glycan library.
+
+A peak list (one LC-MS run, typically 5-20k peaks) is matched in a single
+vectorised pass: every peak is expanded into its candidate neutral masses for
+each allowed charge state / adduct, and all of those are merge-joined against
+the sorted library masses from `mass_index` with `searchsorted`.
+
+Library masses are treated as neutral masses, so a peak at m/z `mz` observed
+as [M + z·A]^z+ is matched on `z * (mz - A)`.
+"""
+
+import csv
+from dataclasses import dataclass
+
+import numpy as np
+
+from .mass_index import tolerance_window
+
+# Charge-carrier masses (cation mass, i.e. with the electron removed).
+ADDUCTS = {
+    "H": 1.007276467,
+    "Na": 22.989220702,
+    "NH4": 18.033825570,
+}
+DEFAULT_CHARGES = (1, 2, 3)
+DEFAULT_ADDUCTS = ("H",)
+
+# Accepted header spellings for each peak-list column.
+PEAK_COLUMNS = {
+    "mz": ("mz", "m/z", "mass_to_charge", "precursor_mz"),
+    "charge": ("charge", "z"),
+    "intensity": ("intensity", "int", "abundance"),
+    "gu": ("gu", "glucose_units"),
+}
+
+OUTPUT_HEADER = (
+    "peak",
+    "mz",
+    "charge",
+    "intensity",
+    "gu",
+    "adduct",
+    "neutral_mass",
+    "glycan_id",
+    "library_mass",
+    "error_ppm",
+    "gu_error",
+    "score",
+    "isotope",
+    "envelope_score",
+)
+
+
+@dataclass
+class PeakList:
+    """Column arrays for one run. `charge` is 0 where the charge is unknown."""
+
+    mz: np.ndarray
+    charge: np.ndarray
+    intensity: np.ndarray
+    gu: np.ndarray
+
+    def __len__(self):
+        return len(self.mz)
+
+
+@dataclass
+class Annotation:
+    """
+    One entry per (peak, charge/adduct state, library glycan) match.
+
+    `peak` indexes into the PeakList, `library` into the library arrays, and
+    `charge` / `adduct` give the state the peak was interpreted in. `gu_error`
+    and `score` are only filled in by combined GU + mass matching
+    (see `gu_index`); lower scores are better. `isotope` (the peak was taken
+    as M+isotope) and `envelope_score` (cosine, higher is better) are only
+    filled in by isotope-aware matching (see `isotopes`).
+    """
+
+    peak: np.ndarray
+    charge: np.ndarray
+    adduct: np.ndarray
+    neutral_mass: np.ndarray
+    library: np.ndarray
+    error_ppm: np.ndarray
+    gu_error: np.ndarray = None
+    score: np.ndarray = None
+    isotope: np.ndarray = None
+    envelope_score: np.ndarray = None
+
+    def __len__(self):
+        return len(self.peak)
+
+
+def _column(fieldnames, key):
+    lookup = {name.strip().lower(): name for name in fieldnames or ()}
+    for alias in PEAK_COLUMNS[key]:
+        if alias in lookup:
+            return lookup[alias]
+    return None
+
+
+def _charge(value):
+    # Accept "2", "2+", "+2" and "-2" alike; polarity is not tracked.
+    return float(value.strip().strip("+-"))
+
+
+def adduct_label(charge, adduct):
+    """Ion notation for a charge state, e.g. "[M+H]+" or "[M+2Na]2+"."""
+    n = charge if charge > 1 else ""
+    return f"[M+{n}{adduct}]{n}+"
+
+
+def parse_charges(value):
+    """Parse a comma-separated charge list such as "1,2,3"."""
+    try:
+        charges = tuple(int(c) for c in str(value).split(",") if c.strip())
+    except ValueError:
+        raise ValueError(f"Invalid charge list: {value!r}")
+    if not charges or min(charges) < 1:
+        raise ValueError(f"Invalid charge list: {value!r}")
+    return charges
+
+
+def check_tolerances(**tolerances):
+    """Raise ValueError unless each given tolerance (None = not given) is positive."""
+    for name, value in tolerances.items():
+        if value is not None and not value > 0:  # also rejects NaN
+            raise ValueError(f"'{name}' must be positive.")
+
+
+def parse_adducts(value):
+    """Parse a comma-separated adduct list such as "H,Na,NH4"."""
+    adducts = tuple(a.strip() for a in str(value).split(",") if a.strip())
+    unknown = sorted(set(adducts) - set(ADDUCTS))
+    if not adducts or unknown:
+        raise ValueError(
+            f"Invalid adduct list: {value!r} (choose from {', '.join(ADDUCTS)})"
+        )
+    return adducts
+
+
+def read_peak_list(stream):
+    """
+    Parse a CSV peak list (e.g. exported from an mzML run) into a PeakList.
+
+    Only the m/z column is required; charge, intensity and GU are optional.
+    """
+    reader = csv.DictReader(stream)
+    mz_col = _column(reader.fieldnames, "mz")
+    if mz_col is None:
+        raise ValueError("Peak list has no m/z column.")
+    charge_col = _column(reader.fieldnames, "charge")
+    intensity_col = _column(reader.fieldnames, "intensity")
+    gu_col = _column(reader.fieldnames, "gu")
+
+    def number(row, col, cast, missing):
+        value = row.get(col) if col else None
+        return cast(value) if value not in (None, "") else missing
+
+    mz, charge, intensity, gu = [], [], [], []
+    for line, row in enumerate(reader, start=2):
+        try:
+            mz.append(float(row[mz_col]))
+            charge.append(abs(int(number(row, charge_col, _charge, 0))))
+            intensity.append(number(row, intensity_col, float, np.nan))
+            gu.append(number(row, gu_col, float, np.nan))
+        except (TypeError, ValueError):
+            raise ValueError(f"Malformed peak on line {line}: {row}")
+    return PeakList(
+        mz=np.asarray(mz, dtype=np.float64),
+        charge=np.asarray(charge, dtype=np.int64),
+        intensity=np.asarray(intensity, dtype=np.float64),
+        gu=np.asarray(gu, dtype=np.float64),
+    )
+
+
+def expand_matches(queries, library_masses, ppm):
+    """
+    Merge-join sorted `library_masses` against a flat array of query masses.
+
+    Returns `(query_idx, library_idx)` for every pair within ±ppm.
+    """
+    low, high = tolerance_window(queries, ppm=ppm)
+    start = np.searchsorted(library_masses, low, side="left")
+    stop = np.searchsorted(library_masses, high, side="right")
+    counts = stop - start
+    query_idx = np.repeat(np.arange(len(queries)), counts)
+    # Offset of each pair within its query's [start, stop) run.
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return query_idx, np.repeat(start, counts) + offsets
+
+
+def expand_states(peaks, charges=DEFAULT_CHARGES, adducts=DEFAULT_ADDUCTS):
+    """
+    Expand every peak into its candidate neutral masses, one per allowed
+    charge/adduct state.
+
+    Peaks with a known charge are only tried at that charge; peaks with
+    charge 0 are tried at every charge in `charges`. Returns flat arrays
+    `(peak_idx, charge, adduct, neutral_mass)`.
+    """
+    unknown = sorted(set(adducts) - set(ADDUCTS))
+    if unknown:
+        raise ValueError(f"Unknown adduct(s): {', '.join(unknown)}")
+    states_z = np.repeat(np.asarray(charges, dtype=np.int64), len(adducts))
+    states_a = np.tile(np.asarray(adducts, dtype=object), len(charges))
+    adduct_mass = np.array([ADDUCTS[a] for a in states_a], dtype=np.float64)
+
+    # (peaks x states) neutral masses, masked to the states each peak allows.
+    neutral = states_z[None, :] * (peaks.mz[:, None] - adduct_mass[None, :])
+    allowed = (peaks.charge[:, None] == 0) | (peaks.charge[:, None] == states_z[None, :])
+    peak_idx, state_idx = np.nonzero(allowed)
+    return peak_idx, states_z[state_idx], states_a[state_idx], neutral[peak_idx, state_idx]
+
+
+def annotate(peaks, library_masses, charges=DEFAULT_CHARGES, adducts=DEFAULT_ADDUCTS, ppm=10.0):
+    """
+    Match every peak in every allowed charge/adduct state against the sorted
+    `library_masses` in one pass.
+    """
+    peak_idx, charge, adduct, queries = expand_states(peaks, charges, adducts)
+    query_idx, library_idx = expand_matches(queries, library_masses, ppm)
+    matched = queries[query_idx]
+    return Annotation(
+        peak=peak_idx[query_idx],
+        charge=charge[query_idx],
+        adduct=adduct[query_idx],
+        neutral_mass=matched,
+        library=library_idx,
+        error_ppm=(matched - library_masses[library_idx]) / library_masses[library_idx] * 1e6,
+    )
+
+
+def iter_rows(peaks, annotation, library_masses, library_ids, include_unmatched=True):
+    """
+    Yield the annotated table (OUTPUT_HEADER first), one row per match and,
+    optionally, one empty row for every peak with no match, in peak order.
+    """
+    yield OUTPUT_HEADER
+    scored = annotation.score is not None
+    enveloped = annotation.envelope_score is not None
+    if scored:
+        rank = annotation.score
+    elif enveloped:
+        rank = -np.nan_to_num(annotation.envelope_score, nan=-1.0)
+    else:
+        rank = np.abs(annotation.error_ppm)
+    order = np.lexsort((rank, annotation.peak))
+
+    def blank(value):
+        return "" if np.isnan(value) else value
+
+    def envelope_cells(i):
+        if not enveloped:
+            return ("", "")
+        score = annotation.envelope_score[i]
+        return (int(annotation.isotope[i]), "" if np.isnan(score) else round(float(score), 4))
+
+    def peak_cells(p):
+        return (p, peaks.mz[p], peaks.charge[p] or "", blank(peaks.intensity[p]), blank(peaks.gu[p]))
+
+    next_peak = 0
+    for i in order:
+        p = annotation.peak[i]
+        if include_unmatched:
+            for q in range(next_peak, p):
+                yield peak_cells(q) + ("",) * 9
+        next_peak = p + 1
+        lib = annotation.library[i]
+        yield (p, peaks.mz[p], annotation.charge[i], blank(peaks.intensity[p]), blank(peaks.gu[p])) + (
+            adduct_label(annotation.charge[i], annotation.adduct[i]),
+            round(float(annotation.neutral_mass[i]), 6),
+            library_ids[lib],
+            library_masses[lib],
+            round(float(annotation.error_ppm[i]), 3),
+            round(float(annotation.gu_error[i]), 3) if scored else "",
+            round(float(annotation.score[i]), 4) if scored else "",
+        ) + envelope_cells(i)
+    if include_unmatched:
+        for q in range(next_peak, len(peaks)):
+            yield peak_cells(q) + ("",) * 9
@@ -0,0 +1,314 @@
+"""
+Read-only JSON API for glycans, compositions, species and studies.
+
+    GET /api/<resource>/?after=<pk>&limit=100   one page, ordered by pk
+    GET /api/<resource>/<pk>/                   one record
+
+Pages use keyset (seek) pagination: `WHERE pk > after ORDER BY pk LIMIT n`
+is an index range scan however deep the client pages, unlike OFFSET. The
+response's `next` URL carries the last pk of the page. Related rows are
+loaded with a fixed `select_related` / `prefetch_related` plan, so a page
+costs the same number of queries whatever its size.
+
+`GET /api/abundance/?study=<pk>` returns one study's glycan x sample
+abundance matrix (see abundance.py), as JSON or, with `format=arrow`, as an
+Arrow IPC stream. `GET /api/profiles/?by=tissue` compares the glycan
+profiles of tissues (or species, stages, contexts; see profiles.py).
+
+Responses carry an ETag and Last-Modified derived from the versions of
+every table they are built from (see `table_versions`), so clients and
+proxies get a 304 until one of those tables changes.
+"""
+
+from dataclasses import dataclass
+from hashlib import sha1
+
+import numpy as np
+from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
+from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
+from django.views.decorators.http import condition, require_GET
+
+from . import abundance, profiles, table_versions, thumbnails
+from .models import (
+    COMPOSITION_FIELDS,
+    Glycan,
+    LastAuthor,
+    Measurement,
+    ModelSpecies,
+    MonosaccharideComposition,
+    OntogenicStage,
+    Sample,
+    Study,
+    Tissue,
+)
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def _tables(*models):
+    return tuple(model._meta.db_table for model in models)
+
+
+# ---------------------------------------------------------------------------
+# Serialisation
+# ---------------------------------------------------------------------------
+def composition_json(comp):
+    return {
+        "id": comp.pk,
+        "composition_string": comp.composition_string,
+        **{field: getattr(comp, field) for field in COMPOSITION_FIELDS},
+    }
+
+
+def species_json(species):
+    tissue, stage = species.tissue, species.stage
+    return {
+        "id": species.pk,
+        "species_name": species.species_name,
+        "species_taxid": species.species_taxid,
+        "taxid": species.taxid,
+        "tissue": tissue and {
+            "id": tissue.pk,
+            "organ": tissue.organ,
+            "structure": tissue.structure,
+            "uberon_id": tissue.uberon_id,
+        },
+        "stage": stage and {"id": stage.pk, "stage": stage.stage, "age": stage.age},
+    }
+
+
+def study_json(study):
+    return {
+        "id": study.pk,
+        "title": study.title,
+        "journal": study.journal,
+        "year": study.year,
+        "doi": study.doi,
+        "last_authors": [
+            {"id": a.pk, "full_name": a.full_name, "affiliation": a.affiliation}
+            for a in study.last_authors.all()
+        ],
+    }
+
+
+def glycan_json(glycan):
+    comp = glycan.monosaccharide_comp
+    return {
+        "id": glycan.pk,
+        "glytoucan_id": glycan.glytoucan_id,
+        "glycosmos_id": glycan.glycosmos_id,
+        "glyconnect_id": glycan.glyconnect_id,
+        "wurcs": glycan.wurcs,
+        "brain_specific": glycan.brain_specific,
+        "graphical_structure": glycan.graphical_structure.url if glycan.graphical_structure else None,
+        "thumbnails": thumbnails.thumbnail_urls(glycan.image_digest),
+        "snfg": reverse("DB:glycan-snfg", kwargs={"pk": glycan.pk, "fmt": "svg"}) if glycan.wurcs else None,
+        "mass": glycan.mass,
+        "theoretical_mass": glycan.theoretical_mass,
+        "sialic_acid_derivatization": glycan.sialic_acid_derivatization,
+        "gu_mean": glycan.gu_mean,
+        "gu_min": glycan.gu_min,
+        "gu_max": glycan.gu_max,
+        "composition": comp and composition_json(comp),
+        "model_species": [species_json(s) for s in glycan.model_species.all()],
+        "studies": [
+            {"id": s.pk, "title": s.title, "year": s.year, "doi": s.doi}
+            for s in glycan.studies.all()
+        ],
+    }
+
+
+@dataclass(frozen=True)
+class Resource:
+    """One API resource: its query plan, serialiser and source tables."""
+
+    queryset: callable
+    serialize: callable
+    tables: tuple
+
+
+RESOURCES = {
+    "glycans": Resource(
+        queryset=lambda: Glycan.objects.select_related("monosaccharide_comp").prefetch_related(
+            Prefetch("model_species", queryset=ModelSpecies.objects.select_related("tissue", "stage")),
+            "studies",
+        ),
+        serialize=glycan_json,
+        tables=_tables(
+            Glycan,
+            MonosaccharideComposition,
+            ModelSpecies,
+            Tissue,
+            OntogenicStage,
+            Study,
+            Glycan.model_species.through,
+            Glycan.studies.through,
+        ),
+    ),
+    "compositions": Resource(
+        queryset=MonosaccharideComposition.objects.all,
+        serialize=composition_json,
+        tables=_tables(MonosaccharideComposition),
+    ),
+    "species": Resource(
+        queryset=lambda: ModelSpecies.objects.select_related("tissue", "stage"),
+        serialize=species_json,
+        tables=_tables(ModelSpecies, Tissue, OntogenicStage),
+    ),
+    "studies": Resource(
+        queryset=lambda: Study.objects.prefetch_related("last_authors"),
+        serialize=study_json,
+        tables=_tables(Study, LastAuthor, Study.last_authors.through),
+    ),
+}
+
+
+# ---------------------------------------------------------------------------
+# Conditional-request validators
+# ---------------------------------------------------------------------------
+def _versioned(tables, prefix):
+    """
+    `condition()` with an ETag and Last-Modified from the versions of
+    `tables` (read once per request). The ETag also covers `prefix` and the
+    request's path and query string. `tables` may instead be a function of
+    the view's URL kwargs.
+    """
+
+    def versions(request, kwargs):
+        if not hasattr(request, "_table_versions"):
+            request._table_versions = table_versions.snapshot(tables(**kwargs) if callable(tables) else tables)
+        return request._table_versions
+
+    def etag(request, **kwargs):
+        current, _ = versions(request, kwargs)
+        return sha1(f"{prefix}:{current}:{request.get_full_path()}".encode()).hexdigest()
+
+    def last_modified(request, **kwargs):
+        return versions(request, kwargs)[1]
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def _resource_tables(resource, pk=None):
+    return RESOURCES[resource].tables
+
+
+def _error(message, status=400):
+    return JsonResponse({"error": message}, status=status)
+
+
+# ---------------------------------------------------------------------------
+# Views
+# ---------------------------------------------------------------------------
+@require_GET
+@_versioned(_resource_tables, "resources")
+def resource_list(request, resource):
+    """One keyset-paginated page of `resource`."""
+    spec = RESOURCES[resource]
+    pk_field = spec.queryset().model._meta.pk
+    try:
+        limit = int(request.GET.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        return _error("'limit' must be an integer.")
+    if not 1 <= limit <= MAX_LIMIT:
+        return _error(f"'limit' must be between 1 and {MAX_LIMIT}.")
+
+    rows = spec.queryset().order_by("pk")
+    after = request.GET.get("after")
+    if after not in (None, ""):
+        try:
+            rows = rows.filter(pk__gt=pk_field.to_python(after))
+        except ValidationError:
+            return _error("'after' is not a valid id.")
+
+    page = list(rows[: limit + 1])
+    more = len(page) > limit
+    page = page[:limit]
+    next_url = None
+    if more:
+        query = request.GET.copy()
+        query["after"] = page[-1].pk
+        query["limit"] = limit
+        next_url = request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+    return JsonResponse({"results": [spec.serialize(obj) for obj in page], "next": next_url})
+
+
+@require_GET
+@_versioned(_resource_tables, "resources")
+def resource_detail(request, resource, pk):
+    """A single `resource` record by primary key."""
+    spec = RESOURCES[resource]
+    try:
+        obj = spec.queryset().get(pk=pk)
+    except (ValueError, ValidationError, spec.queryset().model.DoesNotExist):
+        return _error("Not found.", status=404)
+    return JsonResponse(spec.serialize(obj))
+
+
+# ---------------------------------------------------------------------------
+# Abundance matrices
+# ---------------------------------------------------------------------------
+ABUNDANCE_TABLES = _tables(Sample, Measurement)
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+
+@require_GET
+@_versioned(ABUNDANCE_TABLES, "abundance")
+def abundance_matrix(request):
+    """
+    The glycan x sample matrix of one study. `value` picks the measurement
+    column (default relative_abundance); `format=arrow` returns an Arrow IPC
+    stream instead of JSON.
+    """
+    try:
+        study = Study.objects.get(pk=int(request.GET.get("study", "")))
+    except (ValueError, Study.DoesNotExist):
+        return _error("'study' must be the id of a study.")
+    fmt = request.GET.get("format", "json")
+    if fmt not in ("json", "arrow"):
+        return _error("'format' must be json or arrow.")
+    try:
+        matrix = abundance.pivot(study=study, value=request.GET.get("value", "relative_abundance"))
+        if fmt == "arrow":
+            table = matrix.to_arrow()  # ValueError without pyarrow
+            import pyarrow as pa
+
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return HttpResponse(sink.getvalue().to_pybytes(), content_type=ARROW_STREAM)
+    except ValueError as exc:
+        return _error(str(exc))
+    values = matrix.values.astype(object)
+    values[np.isnan(matrix.values)] = None
+    return JsonResponse(
+        {
+            "study": study.pk,
+            "glycans": list(matrix.glycans),
+            "samples": [{"id": int(pk), "name": name} for pk, name in zip(matrix.samples, matrix.sample_names)],
+            "values": values.tolist(),
+        }
+    )
+
+
+# ---------------------------------------------------------------------------
+# Profile comparison
+# ---------------------------------------------------------------------------
+@require_GET
+@_versioned(profiles.TABLES, "profiles")
+def profile_comparison(request):
+    """
+    Compare the glycan profiles along `by` (species, tissue, stage or
+    context). `groups` is a comma-separated list of group keys (default all);
+    `ids=1` also lists the shared and unique glycan ids.
+    """
+    groups = request.GET.get("groups")
+    groups = [key.strip() for key in (groups or "").split(",") if key.strip()] or None
+    try:
+        result = profiles.compare(request.GET.get("by", "species"), groups, request.GET.get("ids") == "1")
+    except ValueError as exc:
+        return _error(str(exc))
+    return JsonResponse(result)
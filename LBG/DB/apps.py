@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DbConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'DB'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (registers signal handlers)
@@ -0,0 +1,363 @@
+"""
+Batch annotation of many LC-MS runs (used by `manage.py annotate_runs`).
+
+The library is read from the database once, in the parent process, and
+copied into `multiprocessing.shared_memory` blocks (SharedLibrary):
+
+    ids           fixed-width strings, in mass order
+    mass          float64
+    gu            float64 (n x 3): low, high and mean GU, NaN when unknown
+    composition   fixed-width composition strings ("" when unknown)
+    envelopes     float32 (n x isotopes.PEAKS), only for isotope matching
+
+Worker processes attach to those blocks instead of loading their own copy,
+so a pool of N workers costs one library's worth of memory. Each task reads
+one peak list, annotates it with the same matchers `annotate_peaks` uses
+(annotation, gu_index or isotopes) and sends back that run's rows; the
+parent appends them to a single CSV or Parquet file as runs finish, so
+neither side ever holds more than one run at a time. Workers are also
+recycled after `max_tasks_per_child` runs, so per-worker memory stays flat
+however many runs a cohort has.
+
+Output rows are `annotate_peaks` rows prefixed with the run name and
+followed by the matched glycan's composition (BATCH_HEADER).
+"""
+
+import csv
+import io
+import multiprocessing
+import os
+import resource
+import time
+import warnings
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import annotation, gu_index, isotopes, mass_index
+from .bulk_load import open_compressed
+from .models import COMPOSITION_FIELDS, Glycan, format_composition
+
+PEAK_LIST_SUFFIXES = (".csv", ".csv.gz", ".csv.zst")
+BATCH_HEADER = ("run",) + annotation.OUTPUT_HEADER + ("composition",)
+# Arrow types of the BATCH_HEADER columns, for Parquet output.
+_PARQUET_TYPES = {
+    "run": "string",
+    "peak": "int64",
+    "mz": "float64",
+    "charge": "int64",
+    "intensity": "float64",
+    "gu": "float64",
+    "adduct": "string",
+    "neutral_mass": "float64",
+    "glycan_id": "string",
+    "library_mass": "float64",
+    "error_ppm": "float64",
+    "gu_error": "float64",
+    "score": "float64",
+    "isotope": "int64",
+    "envelope_score": "float64",
+    "composition": "string",
+}
+
+
+class SharedLibrary:
+    """Named numpy arrays backed by shared memory blocks."""
+
+    def __init__(self, blocks, arrays):
+        self._blocks = blocks
+        self.arrays = arrays
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["arrays"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __len__(self):
+        return len(self.arrays["mass"])
+
+    @classmethod
+    def create(cls, arrays):
+        """Copy `{name: array}` into new shared memory blocks."""
+        blocks, views = {}, {}
+        try:
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                blocks[name] = block
+                views[name] = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+                views[name][...] = array
+        except BaseException:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+            raise
+        return cls(blocks, views)
+
+    @property
+    def spec(self):
+        """What a worker needs to `attach()`: `{name: (block name, dtype, shape)}`."""
+        return {
+            name: (self._blocks[name].name, array.dtype.str, array.shape)
+            for name, array in self.arrays.items()
+        }
+
+    @classmethod
+    def attach(cls, spec):
+        blocks, views = {}, {}
+        for name, (block_name, dtype, shape) in spec.items():
+            blocks[name] = shared_memory.SharedMemory(name=block_name)
+            views[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=blocks[name].buf)
+        return cls(blocks, views)
+
+    def close(self, unlink=False):
+        self.arrays = {}  # views must go before their buffers
+        for block in self._blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+        self._blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close(unlink=True)
+
+
+def library_arrays(field="mass", isotope=False, tag="free", derivatization="none"):
+    """The library as mass-sorted arrays for SharedLibrary.create()."""
+    masses, ids, composition_ids = mass_index.get_index(field).library()
+    by_id = {
+        row[0]: row[1:]
+        for row in Glycan.objects.filter(**{f"{field}__isnull": False}).values_list(
+            "pk", "gu_mean", "gu_min", "gu_max", *(f"monosaccharide_comp__{f}" for f in COMPOSITION_FIELDS)
+        )
+    }
+    blank = (None,) * (3 + len(COMPOSITION_FIELDS))
+    rows = [by_id.get(glycan_id, blank) for glycan_id in ids]
+    gu = np.array([[np.nan if v is None else v for v in row[:3]] for row in rows], dtype=np.float64).reshape(-1, 3)
+    # Same interval rule as GuMassIndex.load(): whichever of mean/min/max exist.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN rows: no GU at all
+        low, high = np.nanmin(gu, axis=1), np.nanmax(gu, axis=1)
+    mean = np.where(np.isnan(gu[:, 0]), (low + high) / 2, gu[:, 0])
+    compositions = ["" if row[3] is None else format_composition(row[3:]) for row in rows]
+    arrays = {
+        "ids": np.array([str(glycan_id) for glycan_id in ids], dtype=str).reshape(-1),
+        "mass": np.asarray(masses, dtype=np.float64),
+        "gu": np.stack([low, high, mean], axis=1) if len(ids) else np.empty((0, 3)),
+        "composition": np.array(compositions, dtype=str).reshape(-1),
+    }
+    if isotope:
+        arrays["envelopes"] = isotopes.library_envelopes(composition_ids, masses, tag, derivatization).astype(np.float32)
+    return arrays
+
+
+def annotate_run(library, peaks, charges=annotation.DEFAULT_CHARGES, adducts=annotation.DEFAULT_ADDUCTS,
+                 ppm=10.0, gu_tolerance=None, isotope_errors=None):
+    """Annotate one PeakList against a SharedLibrary; library indices index its arrays."""
+    if isotope_errors:
+        return isotopes.annotate(
+            peaks, library.mass, library.envelopes, charges=charges, adducts=adducts,
+            ppm=ppm, isotope_errors=isotope_errors,
+        )
+    if gu_tolerance is not None:
+        # Glycans without GU have NaN bounds, which never pass the GU check.
+        index = gu_index.GuMassIndex()
+        index.ids, index.mass = library.ids, library.mass
+        index.gu_low, index.gu_high, index.gu_mean = library.gu[:, 0], library.gu[:, 1], library.gu[:, 2]
+        return index.annotate(peaks, charges=charges, adducts=adducts, ppm=ppm, delta_gu=gu_tolerance)
+    return annotation.annotate(peaks, library.mass, charges=charges, adducts=adducts, ppm=ppm)
+
+
+def run_name(path):
+    name = os.path.basename(path)
+    for suffix in sorted(PEAK_LIST_SUFFIXES, key=len, reverse=True):
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+
+def find_runs(directory):
+    """Peak list files (CSV, optionally .gz / .zst compressed) directly in `directory`."""
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.endswith(PEAK_LIST_SUFFIXES) and os.path.isfile(os.path.join(directory, name))
+    )
+
+
+@dataclass
+class RunResult:
+    """One finished run, as sent back by a worker."""
+
+    path: str
+    rows: list = field(default_factory=list)
+    peaks: int = 0
+    matches: int = 0
+    seconds: float = 0.0
+    worker_rss: int = 0  # peak resident set of the worker, in bytes
+    error: str = ""
+
+    @property
+    def run(self):
+        return run_name(self.path)
+
+
+# ---------------------------------------------------------------------------
+# Worker side
+# ---------------------------------------------------------------------------
+_worker = {}
+
+
+def _init_worker(spec, options):
+    _worker["library"] = SharedLibrary.attach(spec)
+    _worker["options"] = options
+
+
+def _annotate_file(path):
+    library, options = _worker["library"], dict(_worker["options"])
+    include_unmatched = options.pop("include_unmatched", True)
+    started = time.perf_counter()
+    try:
+        with open_compressed(path) as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as stream:
+            peaks = annotation.read_peak_list(stream)
+        result = annotate_run(library, peaks, **options)
+    except (OSError, ValueError) as exc:
+        return RunResult(path, error=str(exc))
+
+    # iter_rows is given library indices as "ids"; swap them for the real
+    # ids and add the composition.
+    run, ids, compositions = run_name(path), library.ids, library.composition
+    rows = []
+    rows_iter = annotation.iter_rows(
+        peaks, result, library.mass, range(len(library)), include_unmatched=include_unmatched
+    )
+    next(rows_iter)  # header
+    for row in rows_iter:
+        lib = row[7]
+        if lib == "":
+            rows.append((run,) + row + ("",))
+        else:
+            rows.append((run,) + row[:7] + (str(ids[lib]),) + row[8:] + (str(compositions[lib]),))
+    return RunResult(
+        path,
+        rows=rows,
+        peaks=len(peaks),
+        matches=len(result),
+        seconds=time.perf_counter() - started,
+        worker_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Output
+# ---------------------------------------------------------------------------
+class CsvOutput:
+    def __init__(self, path):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(BATCH_HEADER)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetOutput:
+    """Appends each run as one row group (needs pyarrow)."""
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet output needs the optional 'pyarrow' package.")
+        self.pa = pa
+        self.schema = pa.schema([(name, getattr(pa, _PARQUET_TYPES[name])()) for name in BATCH_HEADER])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows):
+        if not rows:
+            return
+        columns = [
+            self.pa.array([None if value == "" else value for value in column], type=self.schema.field(i).type)
+            for i, column in enumerate(zip(*rows))
+        ]
+        self.writer.write_table(self.pa.Table.from_arrays(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def open_output(path):
+    """A CsvOutput, or a ParquetOutput for paths ending in .parquet."""
+    return ParquetOutput(path) if path.endswith(".parquet") else CsvOutput(path)
+
+
+# ---------------------------------------------------------------------------
+# Driver
+# ---------------------------------------------------------------------------
+@dataclass
+class BatchSummary:
+    runs: int = 0
+    peaks: int = 0
+    matches: int = 0
+    seconds: float = 0.0
+    failed: dict = field(default_factory=dict)  # path -> error
+
+
+def annotate_runs(
+    paths,
+    output,
+    field="mass",
+    jobs=None,
+    max_tasks_per_child=50,
+    tag="free",
+    derivatization="none",
+    progress=None,
+    **options,
+):
+    """
+    Annotate every peak list in `paths` into the single file `output` using
+    `jobs` worker processes (default: one per CPU). `options` are the
+    `annotate_run()` keywords plus `include_unmatched`. `progress(result,
+    summary)` is called in the parent after every run. Returns a BatchSummary;
+    runs that can't be read are skipped and listed in `summary.failed`.
+    """
+    paths = list(paths)
+    arrays = library_arrays(field, bool(options.get("isotope_errors")), tag, derivatization)
+    summary = BatchSummary()
+    started = time.perf_counter()
+    # fork: workers inherit the configured Django app without re-importing
+    # settings; the library itself is shared explicitly, not copy-on-write.
+    context = multiprocessing.get_context("fork")
+    with SharedLibrary.create(arrays) as library:
+        del arrays
+        out = open_output(output)
+        try:
+            with context.Pool(
+                processes=max(1, min(jobs or os.cpu_count() or 1, len(paths) or 1)),
+                initializer=_init_worker,
+                initargs=(library.spec, options),
+                maxtasksperchild=max_tasks_per_child,
+            ) as pool:
+                for result in pool.imap_unordered(_annotate_file, paths):
+                    if result.error:
+                        summary.failed[result.path] = result.error
+                    else:
+                        out.write(result.rows)
+                        summary.runs += 1
+                        summary.peaks += result.peaks
+                        summary.matches += result.matches
+                    summary.seconds = time.perf_counter() - started
+                    if progress:
+                        progress(result, summary)
+        finally:
+            out.close()
+    return summary
@@ -0,0 +1,259 @@
+"""
+Parallel, snapshot-consistent table export (used by `manage.py lbg_export`).
+
+Replaces `exportDB.py`, which exported one table after another outside any
+transaction, so a dump taken while curators were editing could mix states.
+
+A coordinator connection opens a REPEATABLE READ transaction and publishes
+its snapshot with `pg_export_snapshot()`. Every worker connection imports
+that snapshot with `SET TRANSACTION SNAPSHOT` before running `COPY ... TO
+STDOUT`, so all tables are read as of the same instant even though they
+are exported in parallel.
+
+Each table is streamed to `<table>.csv`, `<table>.csv.gz` or
+`<table>.csv.zst` (or, from a row count counted in the snapshot, `<table>.parquet`).
+A `manifest.json` records each file's row count, size and SHA-256
+checksum (of the bytes on disk, so `sha256sum` can verify it).
+The CSV outputs are in the format `lbg_load` reads.
+"""
+
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from psycopg import sql
+
+from .bulk_load import ConnectionPool, _zstandard, connect
+
+COMPRESSIONS = {"none": ".csv", "gzip": ".csv.gz", "zstd": ".csv.zst"}
+
+# Postgres data types that map onto a typed Arrow column; anything else is
+# exported to Parquet as a string.
+_ARROW_TYPES = {
+    "smallint": "int16",
+    "integer": "int32",
+    "bigint": "int64",
+    "real": "float32",
+    "double precision": "float64",
+    "boolean": "bool_",
+}
+
+
+class _HashingWriter:
+    """Write-through file wrapper that counts and hashes the bytes written to disk."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.raw.write(data)
+
+    def flush(self):
+        self.raw.flush()
+
+
+def _compressor(out, compression):
+    """A writable stream that compresses into `out` (which stays open)."""
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=out, mode="wb", compresslevel=6)
+    if compression == "zstd":
+        return _zstandard().ZstdCompressor(level=3).stream_writer(out, closefd=False)
+    return contextlib.nullcontext(out)
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_tables(conn, schema="public"):
+    """Names of the base tables in `schema`."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT c.relname
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+            ORDER BY c.relname
+            """,
+            (schema,),
+        )
+        return [row[0] for row in cur.fetchall()]
+
+
+def count_rows(conn, tables, schema="public"):
+    """
+    `{table: count(*)}`, in the transaction open on `conn`. Planner estimates
+    (`pg_class.reltuples`) are -1 or stale until a table is analysed, which
+    would make the chosen format depend on autovacuum timing.
+    """
+    counts = {}
+    with conn.cursor() as cur:
+        for table in tables:
+            cur.execute(sql.SQL("SELECT count(*) FROM {}.{}").format(sql.Identifier(schema), sql.Identifier(table)))
+            counts[table] = cur.fetchone()[0]
+    return counts
+
+
+def _begin_snapshot(conn, snapshot):
+    with conn.cursor() as cur:
+        cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        cur.execute(sql.SQL("SET TRANSACTION SNAPSHOT {}").format(sql.Literal(snapshot)))
+
+
+def _copy_to(schema, table):
+    return sql.SQL("COPY {}.{} TO STDOUT WITH (FORMAT csv, HEADER true)").format(
+        sql.Identifier(schema), sql.Identifier(table)
+    )
+
+
+def export_csv(conn, snapshot, table, path, compression, schema="public"):
+    """COPY one table to a (compressed) CSV file under the shared snapshot."""
+    _begin_snapshot(conn, snapshot)
+    try:
+        with open(path, "wb") as raw, conn.cursor() as cur:
+            out = _HashingWriter(raw)
+            with _compressor(out, compression) as stream, cur.copy(_copy_to(schema, table)) as copy:
+                for data in copy:
+                    stream.write(data)
+            rows = cur.rowcount
+    finally:
+        conn.execute("ROLLBACK")
+    return {"rows": rows, "bytes": out.size, "sha256": out.sha256.hexdigest()}
+
+
+class _CopyReader(io.RawIOBase):
+    """Readable binary stream over the data blocks of a COPY TO STDOUT."""
+
+    def __init__(self, copy):
+        self._blocks = iter(copy)
+        self._pending = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._pending:
+            self._pending = memoryview(bytes(next(self._blocks, b"")))
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+def export_parquet(conn, snapshot, table, path, schema="public"):
+    """Stream one table into a Parquet file under the shared snapshot (needs pyarrow)."""
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet output needs the optional 'pyarrow' package.")
+
+    _begin_snapshot(conn, snapshot)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT column_name, data_type FROM information_schema.columns
+                WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position
+                """,
+                (schema, table),
+            )
+            column_types = {
+                name: getattr(pa, _ARROW_TYPES.get(data_type, "string"))()
+                for name, data_type in cur.fetchall()
+            }
+            rows = 0
+            with cur.copy(_copy_to(schema, table)) as copy:
+                reader = pa_csv.open_csv(
+                    io.BufferedReader(_CopyReader(copy), 1 << 20),
+                    convert_options=pa_csv.ConvertOptions(
+                        column_types=column_types,
+                        strings_can_be_null=True,
+                        true_values=["t"],
+                        false_values=["f"],
+                    ),
+                )
+                with pq.ParquetWriter(path, reader.schema, compression="zstd") as writer:
+                    for batch in reader:
+                        writer.write_batch(batch)
+                        rows += batch.num_rows
+    finally:
+        conn.execute("ROLLBACK")
+    return {"rows": rows, "bytes": os.path.getsize(path), "sha256": _file_sha256(path)}
+
+
+def export(output_dir, tables=None, jobs=4, compression="gzip", parquet_rows=None, schema="public", report=print):
+    """
+    Export `tables` (default: every table in `schema`) from one snapshot into
+    `output_dir` and write `manifest.json`. Tables with at least
+    `parquet_rows` rows are written as Parquet.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression: {compression!r}")
+    if compression == "zstd":
+        _zstandard()
+    os.makedirs(output_dir, exist_ok=True)
+
+    coordinator = connect()
+    try:
+        with coordinator.cursor() as cur:
+            cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            cur.execute("SELECT pg_export_snapshot(), now()")
+            snapshot, taken_at = cur.fetchone()
+            existing = list_tables(coordinator, schema)
+
+        selected = sorted(tables or existing)
+        missing = sorted(set(selected) - set(existing))
+        if missing:
+            raise ValueError(f"No such table(s) in {schema}: {', '.join(missing)}")
+        # Counted in the exported snapshot, so the format follows the data.
+        counts = count_rows(coordinator, selected, schema) if parquet_rows is not None else {}
+
+        def work(conn, table):
+            if parquet_rows is not None and counts[table] >= parquet_rows:
+                name = f"{table}.parquet"
+                entry = export_parquet(conn, snapshot, table, os.path.join(output_dir, name), schema)
+                entry["format"] = "parquet"
+            else:
+                name = table + COMPRESSIONS[compression]
+                entry = export_csv(conn, snapshot, table, os.path.join(output_dir, name), compression, schema)
+                entry["format"] = "csv"
+                entry["compression"] = compression
+            entry["file"] = name
+            return entry
+
+        size = max(1, min(jobs, len(selected)))
+        with ConnectionPool(size) as pool, ThreadPoolExecutor(size) as executor:
+            futures = [(table, executor.submit(pool.run, work, table)) for table in selected]
+            results = {}
+            for table, future in futures:
+                results[table] = future.result()
+                entry = results[table]
+                report(f"{table}: {entry['rows']} rows -> {entry['file']}")
+    finally:
+        coordinator.close()
+
+    manifest = {
+        "snapshot_taken_at": taken_at.astimezone(timezone.utc).isoformat(),
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+        "schema": schema,
+        "tables": results,
+    }
+    with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
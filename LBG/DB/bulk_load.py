@@ -0,0 +1,441 @@
+"""
+Streaming, parallel, resumable CSV loader (used by `manage.py lbg_load`).
+
+Replaces the old `import_all.py` / `import_DB.py` scripts:
+
+- CSV files are streamed into Postgres with psycopg 3's `copy()` API in
+  fixed-size chunks, so multi-GB files never sit in memory.
+- Tables are ordered from the Django model graph: every table is loaded
+  after the tables its foreign keys point to. Tables with no dependency on
+  each other form a "level" and are loaded in parallel, one connection
+  per worker from a small pool.
+- Empty tables are COPY'd into directly. Non-empty tables are COPY'd into a
+  temporary staging table first and merged with
+  `INSERT ... ON CONFLICT (pk) DO UPDATE`.
+- Tables with a natural key (a unique constraint besides the pk, e.g. the
+  nine composition counts) always go through staging. Duplicates are
+  dropped with `ON CONFLICT DO NOTHING`, and every dropped row's pk is
+  remapped to the surviving row's pk. Tables loaded later rewrite their
+  foreign keys through that remap before merging.
+- Each table loads in its own transaction. Once it commits, the table is
+  recorded in a JSON checkpoint (with the CSV's size and mtime), so an
+  interrupted run picks up where it stopped. Remaps are checkpointed too.
+"""
+
+import csv
+import gzip
+import io
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import psycopg
+from psycopg import sql
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+CHUNK_SIZE = 1 << 20  # bytes per COPY write
+
+# CSV files may be plain or compressed (as written by `lbg_export`).
+CSV_SUFFIXES = (".csv", ".csv.gz", ".csv.zst")
+
+
+def csv_stem(name):
+    """Table part of a CSV file name, or None if it isn't a (compressed) CSV."""
+    for suffix in CSV_SUFFIXES:
+        if name.lower().endswith(suffix):
+            return name[: -len(suffix)]
+    return None
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd files need the optional 'zstandard' package.")
+    return zstandard
+
+
+def open_compressed(path, mode="rb"):
+    """Open a binary file, (de)compressing by suffix: .gz (gzip), .zst (zstd) or plain."""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    if path.endswith(".zst"):
+        handle = _zstandard().open(path, mode)
+        return io.BufferedReader(handle) if "r" in mode else handle
+    return open(path, mode)
+
+
+@dataclass
+class TableLoad:
+    """One CSV file to load into one table."""
+
+    table: str
+    model: type
+    path: str
+    depends_on: set = field(default_factory=set)
+    notes: list = field(default_factory=list)
+    remap: dict = field(default_factory=dict)  # dropped duplicate pk -> surviving pk
+
+    def signature(self):
+        stat = os.stat(self.path)
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+# ---------------------------------------------------------------------------
+# Planning
+# ---------------------------------------------------------------------------
+def table_models(app_labels=None):
+    """Map db_table -> model for concrete models (incl. auto-created M2M tables)."""
+    models = {}
+    for model in apps.get_models(include_auto_created=True):
+        meta = model._meta
+        if meta.proxy or not meta.managed:
+            continue
+        if app_labels and meta.app_label not in app_labels:
+            continue
+        models[meta.db_table] = model
+    return models
+
+
+def model_dependencies(model):
+    """db_tables this model's foreign keys point to (self-references excluded)."""
+    return {
+        f.related_model._meta.db_table
+        for f in model._meta.concrete_fields
+        if f.is_relation and f.related_model is not None and f.related_model is not model
+    }
+
+
+def natural_key(model):
+    """Columns of the model's unconditional unique constraint (besides the pk), if any."""
+    for constraint in model._meta.total_unique_constraints:
+        return [model._meta.get_field(name).column for name in constraint.fields]
+    return None
+
+
+def foreign_keys(model):
+    """`{fk column: (referenced db_table, SQL type)}` for the model's foreign keys."""
+    connection = connections[DEFAULT_DB_ALIAS]
+    return {
+        f.column: (f.related_model._meta.db_table, f.target_field.rel_db_type(connection))
+        for f in model._meta.concrete_fields
+        if f.is_relation and f.related_model is not None
+    }
+
+
+def resolve_table(stem, tables):
+    """Match a CSV file stem to a table name (exact, then case-insensitive)."""
+    if stem in tables:
+        return stem
+    return {t.lower(): t for t in tables}.get(stem.lower())
+
+
+def plan(csv_dir, app_labels=None, only=None):
+    """
+    Build the load plan for every CSV (optionally .gz / .zst compressed) in
+    `csv_dir` that matches a model table.
+
+    Returns `(levels, skipped)`: `levels` is a list of lists of TableLoad in
+    topological order (tables within a level are independent); `skipped`
+    lists CSV files with no matching table.
+    """
+    models = table_models(app_labels)
+    loads, skipped = {}, []
+    for name in sorted(os.listdir(csv_dir)):
+        stem = csv_stem(name)
+        if stem is None:
+            continue
+        table = resolve_table(stem, models)
+        if table is None or (only and table not in only):
+            skipped.append(name)
+            continue
+        if table in loads:
+            raise ValueError(
+                f"Both {os.path.basename(loads[table].path)} and {name} map to {table}."
+            )
+        loads[table] = TableLoad(table, models[table], os.path.join(csv_dir, name))
+
+    # Only dependencies that are part of this load constrain the order;
+    # anything else must already be in the database.
+    for load in loads.values():
+        load.depends_on = model_dependencies(load.model) & set(loads)
+
+    levels, done = [], set()
+    while len(done) < len(loads):
+        ready = sorted(
+            t for t, load in loads.items() if t not in done and load.depends_on <= done
+        )
+        if not ready:
+            raise ValueError(
+                "Foreign-key cycle between: " + ", ".join(sorted(set(loads) - done))
+            )
+        levels.append([loads[t] for t in ready])
+        done.update(ready)
+    return levels, skipped
+
+
+# ---------------------------------------------------------------------------
+# Checkpointing
+# ---------------------------------------------------------------------------
+class Checkpoint:
+    """Tables that finished loading, persisted as JSON after every table."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.done = json.load(f)
+
+    def is_done(self, load):
+        entry = self.done.get(load.table, {})
+        return {k: entry.get(k) for k in ("size", "mtime")} == load.signature()
+
+    def remap(self, load):
+        """The pk remap recorded for a finished table."""
+        return {old: new for old, new in self.done[load.table].get("remap", [])}
+
+    def mark_done(self, load):
+        with self._lock:
+            self.done[load.table] = {**load.signature(), "remap": list(load.remap.items())}
+            if not self.path:
+                return
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.done, f, indent=2)
+            os.replace(tmp, self.path)
+
+    def clear(self):
+        self.done = {}
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# ---------------------------------------------------------------------------
+# Loading
+# ---------------------------------------------------------------------------
+def connect(alias=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Open a new psycopg 3 connection (autocommit) with the same settings
+    Django uses; transactions are opened explicitly with `conn.transaction()`.
+    """
+    params = connections[alias].get_connection_params()
+    # Django-specific adapters/cursor classes don't apply to raw connections.
+    params.pop("cursor_factory", None)
+    params.pop("context", None)
+    params.pop("prepare_threshold", None)
+    return psycopg.connect(autocommit=True, **params, **kwargs)
+
+
+class ConnectionPool:
+    """A fixed set of connections handed out to worker threads."""
+
+    def __init__(self, size, alias=DEFAULT_DB_ALIAS):
+        self._idle = queue.Queue()
+        self._all = [connect(alias) for _ in range(size)]
+        for conn in self._all:
+            self._idle.put(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for conn in self._all:
+            conn.close()
+
+    def run(self, func, *args):
+        conn = self._idle.get()
+        try:
+            return func(conn, *args)
+        finally:
+            self._idle.put(conn)
+
+
+def read_header(stream):
+    """Consume and parse the header line of a binary CSV stream."""
+    line = stream.readline().decode("utf-8-sig")
+    return next(csv.reader(io.StringIO(line)))
+
+
+def copy_stream(cursor, target, columns, chunks):
+    """COPY an iterable of CSV data chunks (bytes) into `target` (an sql.Composable)."""
+    statement = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+        target, sql.SQL(", ").join(map(sql.Identifier, columns))
+    )
+    with cursor.copy(statement) as copy:
+        for chunk in chunks:
+            copy.write(chunk)
+    return cursor.rowcount
+
+
+def merge_statement(load, columns, staging):
+    """INSERT ... SELECT from the staging table, upserting on the primary key."""
+    pk = load.model._meta.pk.column
+    cols = sql.SQL(", ").join(map(sql.Identifier, columns))
+    updates = [c for c in columns if c != pk]
+    if pk in columns and updates:
+        conflict = sql.SQL("ON CONFLICT ({}) DO UPDATE SET {}").format(
+            sql.Identifier(pk),
+            sql.SQL(", ").join(
+                sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(c)) for c in updates
+            ),
+        )
+    else:
+        conflict = sql.SQL("ON CONFLICT DO NOTHING")
+    return sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} {}").format(
+        sql.Identifier(load.table), cols, cols, staging, conflict
+    )
+
+
+def dedupe_statement(load, columns, staging, key):
+    """INSERT one row per natural key from the staging table, skipping existing ones."""
+    pk = load.model._meta.pk.column
+    cols = sql.SQL(", ").join(map(sql.Identifier, columns))
+    return sql.SQL(
+        "INSERT INTO {} ({}) SELECT DISTINCT ON ({}) {} FROM {} ORDER BY {}, {} ON CONFLICT DO NOTHING"
+    ).format(
+        sql.Identifier(load.table),
+        cols,
+        sql.SQL(", ").join(map(sql.Identifier, key)),
+        cols,
+        staging,
+        sql.SQL(", ").join(map(sql.Identifier, key)),
+        sql.Identifier(pk),
+    )
+
+
+def remap_statement(load, staging, key):
+    """Pairs (staged pk, stored pk) for staged rows whose natural key is stored under another pk."""
+    pk = sql.Identifier(load.model._meta.pk.column)
+    return sql.SQL("SELECT s.{0}, t.{0} FROM {1} s JOIN {2} t ON {3} WHERE s.{0} <> t.{0}").format(
+        pk,
+        staging,
+        sql.Identifier(load.table),
+        sql.SQL(" AND ").join(sql.SQL("s.{0} = t.{0}").format(sql.Identifier(c)) for c in key),
+    )
+
+
+def load_table(conn, load, columns_for=None, remaps=None):
+    """
+    Load one CSV into its table inside a single transaction.
+
+    `columns_for(load, header, chunks, stream)` may return a different column
+    list to COPY and a replacement iterable of data chunks (see
+    `csv_schema.columns_for`); by default the CSV header and the raw file
+    bytes are used as-is. `remaps` maps already-loaded tables to their
+    `{old pk: new pk}` remaps, which are applied to this table's foreign
+    keys. Returns `(rows, mode)` where mode is "copy", "upsert" or "dedupe";
+    for "dedupe", `load.remap` is filled in.
+    """
+    target = sql.Identifier(load.table)
+    pk = load.model._meta.pk.column
+    with conn.transaction(), conn.cursor() as cur, open_compressed(load.path) as stream:
+        columns = read_header(stream)
+        chunks = iter(lambda: stream.read(CHUNK_SIZE), b"")
+        if columns_for:
+            columns, chunks = columns_for(load, columns, chunks, stream)
+
+        key = natural_key(load.model)
+        if not (key and pk in columns and set(key) <= set(columns)):
+            key = None
+        remapped = [
+            (column, sql_type, remaps[table])
+            for column, (table, sql_type) in foreign_keys(load.model).items()
+            if column in columns and remaps and remaps.get(table)
+        ]
+
+        cur.execute(sql.SQL("SELECT EXISTS (SELECT 1 FROM {})").format(target))
+        if not cur.fetchone()[0] and not key and not remapped:
+            return copy_stream(cur, target, columns, chunks), "copy"
+
+        staging = sql.Identifier(f"_lbg_stage_{load.table}".lower()[:63])
+        cur.execute(
+            sql.SQL(
+                "CREATE TEMP TABLE {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DROP"
+            ).format(staging, target)
+        )
+        copy_stream(cur, staging, columns, chunks)
+        for column, sql_type, remap in remapped:
+            cur.execute(
+                sql.SQL(
+                    "UPDATE {0} s SET {1} = m.new::{2} FROM unnest(%s::text[], %s::text[]) AS m(old, new) "
+                    "WHERE s.{1}::text = m.old"
+                ).format(staging, sql.Identifier(column), sql.SQL(sql_type)),
+                ([str(old) for old in remap], [str(new) for new in remap.values()]),
+            )
+        if key:
+            cur.execute(dedupe_statement(load, columns, staging, key))
+            rows = cur.rowcount
+            cur.execute(remap_statement(load, staging, key))
+            load.remap = dict(cur.fetchall())
+            if load.remap:
+                load.notes.append(f"merged {len(load.remap)} duplicate rows")
+            return rows, "dedupe"
+        cur.execute(merge_statement(load, columns, staging))
+        return cur.rowcount, "upsert"
+
+
+def reset_sequence(conn, load):
+    """Move the table's PK sequence (if any) past the highest loaded id."""
+    pk = load.model._meta.pk.column
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute("SELECT pg_get_serial_sequence(%s, %s)", (f'"{load.table}"', pk))
+        sequence = cur.fetchone()[0]
+        if sequence:
+            cur.execute(
+                sql.SQL(
+                    "SELECT setval(%s, COALESCE(MAX({0}), 1), MAX({0}) IS NOT NULL) FROM {1}"
+                ).format(sql.Identifier(pk), sql.Identifier(load.table)),
+                (sequence,),
+            )
+
+
+def run(levels, checkpoint, jobs=4, columns_for=None, report=print):
+    """
+    Load every level in order, the tables within a level in parallel.
+
+    Stops after the first level with a failure (later levels may depend on
+    it); completed tables stay checkpointed. Returns the list of failures.
+    """
+    failures = []
+    remaps = {}
+    size = max(1, min(jobs, max((len(level) for level in levels), default=1)))
+
+    def work(conn, load):
+        rows, mode = load_table(conn, load, columns_for, remaps)
+        reset_sequence(conn, load)
+        checkpoint.mark_done(load)
+        return rows, mode
+
+    with ConnectionPool(size) as pool, ThreadPoolExecutor(size) as executor:
+        for level in levels:
+            pending = []
+            for load in level:
+                if checkpoint.is_done(load):
+                    report(f"{load.table}: already loaded (checkpoint), skipping.")
+                    remaps[load.table] = checkpoint.remap(load)
+                    continue
+                pending.append((load, executor.submit(pool.run, work, load)))
+            for load, future in pending:
+                try:
+                    rows, mode = future.result()
+                    remaps[load.table] = load.remap
+                    report(f"{load.table}: {mode} {rows} rows from {os.path.basename(load.path)}.")
+                    for note in load.notes:
+                        report(f"{load.table}: {note}")
+                except Exception as exc:
+                    failures.append((load, exc))
+                    report(f"{load.table}: FAILED - {exc}")
+            if failures:
+                break
+    return failures
+
+
+def default_checkpoint_path():
+    return os.path.join(settings.CACHE_DIR, "lbg_load_checkpoint.json")
@@ -0,0 +1,116 @@
+"""
+Theoretical masses for monosaccharide compositions.
+
+Each composition letter (see `models.COMPOSITION_LETTERS`) is mapped to the
+elemental formula of its dehydrated residue, so a batch of compositions is a
+count matrix (n x 9) and its elemental formulas are one matrix product with
+the residue-formula matrix (9 x 6). Masses follow from a second product with
+the element-mass vector:
+
+    formulas = counts @ RESIDUE_FORMULAS + reducing_end
+    masses   = formulas @ ELEMENT_MASSES[kind]
+
+The reducing end (free, reduced, or a fluorescent label) and any
+derivatization are expressed as formula deltas on top of the residues.
+"""
+
+import numpy as np
+
+from .models import COMPOSITION_FIELDS, COMPOSITION_LETTERS
+
+ELEMENTS = ("C", "H", "N", "O", "P", "S")
+
+ELEMENT_MASSES = {
+    "monoisotopic": np.array(
+        [12.0, 1.00782503207, 14.0030740048, 15.99491461956, 30.97376163, 31.97207100]
+    ),
+    "average": np.array([12.0107, 1.00794, 14.0067, 15.9994, 30.973762, 32.065]),
+}
+
+
+def formula(**atoms):
+    """Element-count vector in ELEMENTS order, e.g. formula(C=6, H=10, O=5)."""
+    unknown = set(atoms) - set(ELEMENTS)
+    if unknown:
+        raise ValueError(f"Unknown element(s): {', '.join(sorted(unknown))}")
+    return np.array([atoms.get(element, 0) for element in ELEMENTS], dtype=np.int64)
+
+
+# Dehydrated residue formulas, one per composition letter.
+RESIDUES = {
+    "H": formula(C=6, H=10, O=5),          # Hexose
+    "N": formula(C=8, H=13, N=1, O=5),     # HexNAc
+    "F": formula(C=6, H=10, O=4),          # Deoxyhexose (Fuc)
+    "P": formula(H=1, O=3, P=1),           # Phosphate (HPO3)
+    "T": formula(O=3, S=1),                # Sulphate (SO3)
+    "G": formula(C=11, H=17, N=1, O=9),    # Neu5Gc
+    "S": formula(C=11, H=17, N=1, O=8),    # Neu5Ac
+    "E": formula(C=13, H=21, N=1, O=8),    # Neu5Ac ethyl ester (+C2H4)
+    "M": formula(C=12, H=20, N=2, O=7),    # Neu5Ac methyl amide (-O +NCH3)
+}
+RESIDUE_FORMULAS = np.stack([RESIDUES[letter] for letter in COMPOSITION_LETTERS])
+
+# Reducing-end groups: the whole non-residue part of the molecule.
+REDUCING_END_TAGS = {
+    "free": formula(H=2, O=1),                      # + H2O
+    "reduced": formula(H=4, O=1),                   # alditol, + H2O + H2
+    "2-AB": formula(C=7, H=10, N=2, O=1),           # reductive amination, +120.069
+    "procainamide": formula(C=13, H=23, N=3, O=1),  # reductive amination, +219.174
+    "RapiFluor-MS": formula(C=17, H=23, N=5, O=2),  # carbamate labelling, +311.175
+}
+
+# Derivatizations as (per-residue formula deltas, reducing-end delta).
+# Sialic acid esterification/amidation is not listed here: it is already
+# captured by the E and M letters of the composition.
+DERIVATIZATIONS = {
+    "none": ({}, formula()),
+    "permethylated": (
+        {
+            "H": formula(C=3, H=6),
+            "N": formula(C=3, H=6),
+            "F": formula(C=2, H=4),
+            "G": formula(C=6, H=12),
+            "S": formula(C=5, H=10),
+            "E": formula(C=4, H=8),
+            "M": formula(C=4, H=8),
+        },
+        formula(C=2, H=4),
+    ),
+}
+
+
+def counts_matrix(compositions):
+    """
+    Build an (n x 9) count matrix from an iterable of count tuples or
+    MonosaccharideComposition instances / querysets.
+    """
+    if hasattr(compositions, "values_list"):
+        compositions = compositions.values_list(*COMPOSITION_FIELDS)
+    rows = [c.counts() if hasattr(c, "counts") else c for c in compositions]
+    return np.asarray(rows, dtype=np.int64).reshape(-1, len(COMPOSITION_LETTERS))
+
+
+def composition_formulas(counts, tag="free", derivatization="none"):
+    """Elemental formulas (n x len(ELEMENTS)) for a count matrix."""
+    if tag not in REDUCING_END_TAGS:
+        raise ValueError(f"Unknown reducing-end tag: {tag!r}")
+    if derivatization not in DERIVATIZATIONS:
+        raise ValueError(f"Unknown derivatization: {derivatization!r}")
+    residue_delta, end_delta = DERIVATIZATIONS[derivatization]
+    residues = RESIDUE_FORMULAS + np.stack(
+        [residue_delta.get(letter, formula()) for letter in COMPOSITION_LETTERS]
+    )
+    counts = np.asarray(counts, dtype=np.int64).reshape(-1, len(COMPOSITION_LETTERS))
+    return counts @ residues + REDUCING_END_TAGS[tag] + end_delta
+
+
+def composition_masses(counts, tag="free", derivatization="none", average=False, delta=0.0):
+    """
+    Neutral masses for a count matrix.
+
+    `average=True` gives average instead of monoisotopic masses; `delta` is an
+    extra mass shift added to every composition (e.g. a custom label).
+    """
+    kind = "average" if average else "monoisotopic"
+    formulas = composition_formulas(counts, tag=tag, derivatization=derivatization)
+    return formulas @ ELEMENT_MASSES[kind] + delta
@@ -0,0 +1,99 @@
+"""
+A small query language for monosaccharide compositions.
+
+A query is a sequence of letter terms (spaces and commas are ignored):
+
+    H5      exactly 5 hexoses
+    H3-5    3 to 5
+    F>=1    at least 1 (also written F1+)
+    S<=2    at most 2
+    S*      any number, including none
+
+Letters that are not mentioned must be 0, as in composition strings:
+"H5N4" matches only H5N4. Use "H5N4F*S*" to also match the fucosylated
+and sialylated variants.
+
+`compile_query()` turns a query into range predicates on the integer
+`<letter>_num` columns. Postgres evaluates those against the composite
+unique index over the nine counts (`unique_composition_counts`), with
+equality and range bounds on its columns, so the search is an index scan
+rather than a LIKE over `composition_string`.
+"""
+
+import re
+
+from django.db.models import Q
+
+from .models import COMPOSITION_FIELDS, COMPOSITION_LETTERS
+
+_TERM = re.compile(
+    r"""
+    \s*,?\s*
+    (?P<letter>[A-Za-z])\s*
+    (?:
+        (?P<any>\*)
+      | >=\s*(?P<at_least>\d+)
+      | <=\s*(?P<at_most>\d+)
+      | (?P<low>\d+)\s*-\s*(?P<high>\d+)
+      | (?P<count>\d+)\s*(?P<plus>\+)?
+    )
+    \s*,?\s*
+    """,
+    re.VERBOSE,
+)
+
+
+def parse(text):
+    """
+    Parse a composition query into `{letter: (low, high)}` for every letter;
+    `high` is None when unbounded. Raises ValueError on malformed input.
+    """
+    bounds = {}
+    position = 0
+    text = text.strip()
+    if not text:
+        raise ValueError("Empty composition query.")
+    while position < len(text):
+        match = _TERM.match(text, position)
+        if not match:
+            raise ValueError(f"Invalid composition query at position {position + 1}: {text[position:]!r}")
+        letter = match["letter"].upper()
+        if letter not in COMPOSITION_LETTERS:
+            raise ValueError(f"Unknown composition letter: {letter!r}")
+        if letter in bounds:
+            raise ValueError(f"{letter} appears more than once.")
+        if match["any"]:
+            low, high = 0, None
+        elif match["at_least"] is not None:
+            low, high = int(match["at_least"]), None
+        elif match["at_most"] is not None:
+            low, high = 0, int(match["at_most"])
+        elif match["low"] is not None:
+            low, high = int(match["low"]), int(match["high"])
+            if low > high:
+                raise ValueError(f"Invalid range for {letter}: {low}-{high}")
+        else:
+            low = int(match["count"])
+            high = None if match["plus"] else low
+        bounds[letter] = (low, high)
+        position = match.end()
+    return {letter: bounds.get(letter, (0, 0)) for letter in COMPOSITION_LETTERS}
+
+
+def compile_query(text, prefix=""):
+    """
+    A Q matching `text` against the count fields, e.g. prefix
+    "monosaccharide_comp__" to filter glycans. Raises ValueError.
+    """
+    bounds = parse(text)
+    q = Q()
+    for letter, field in zip(COMPOSITION_LETTERS, COMPOSITION_FIELDS):
+        low, high = bounds[letter]
+        if low == high:
+            q &= Q(**{f"{prefix}{field}": low})
+            continue
+        if low > 0:
+            q &= Q(**{f"{prefix}{field}__gte": low})
+        if high is not None:
+            q &= Q(**{f"{prefix}{field}__lte": high})
+    return q
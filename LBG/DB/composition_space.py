@@ -0,0 +1,179 @@
+"""
+Combinatorial composition space with a precomputed, memory-mapped mass table.
+
+For untargeted searches every composition within per-letter bounds (e.g.
+H0-12, N0-8, F0-4, S0-4) is a candidate. The space is a dense grid over
+`models.COMPOSITION_LETTERS`, so each composition is identified by its flat
+grid index ("code"); counts are recovered with `np.unravel_index` and never
+need to be stored.
+
+`build_space()` enumerates the grid in chunks, computes masses with
+`composition_mass`, and writes two arrays sorted by mass:
+
+    masses.npy  float64   neutral mass
+    codes.npy   int64     flat grid index of the composition
+
+plus `space.json` with the bounds and mass settings. `CompositionSpace.open()`
+memory-maps the arrays, so startup costs nothing and a query is a binary
+search. `/api/composition-mass-search/` answers from the space built under
+CACHE_DIR (`get_space()`).
+"""
+
+import json
+import os
+
+import numpy as np
+from django.conf import settings
+
+from . import composition_mass
+from .mass_index import tolerance_window
+from .models import COMPOSITION_LETTERS, format_composition
+
+DEFAULT_BOUNDS = {"H": (0, 12), "N": (0, 8), "F": (0, 4), "S": (0, 4)}
+CHUNK_SIZE = 1_000_000
+
+_MASSES = "masses.npy"
+_CODES = "codes.npy"
+_META = "space.json"
+
+
+def default_path():
+    return os.path.join(settings.CACHE_DIR, "composition_space")
+
+
+def parse_bounds(text):
+    """Parse "H0-12,N0-8,F0-4" (or "S2" for an exact count) into a bounds dict."""
+    bounds = {}
+    for part in (p.strip() for p in text.split(",")):
+        if not part:
+            continue
+        letter, spec = part[0], part[1:]
+        if letter not in COMPOSITION_LETTERS:
+            raise ValueError(f"Unknown composition letter: {letter!r}")
+        try:
+            low, _, high = spec.partition("-")
+            low, high = int(low), int(high or low)
+        except ValueError:
+            raise ValueError(f"Invalid bounds for {letter}: {spec!r}")
+        if not 0 <= low <= high:
+            raise ValueError(f"Invalid bounds for {letter}: {spec!r}")
+        bounds[letter] = (low, high)
+    return bounds
+
+
+def grid(bounds):
+    """Per-letter (low, size) arrays for a bounds dict; missing letters are fixed at 0."""
+    low = np.array([bounds.get(letter, (0, 0))[0] for letter in COMPOSITION_LETTERS])
+    high = np.array([bounds.get(letter, (0, 0))[1] for letter in COMPOSITION_LETTERS])
+    return low, high - low + 1
+
+
+def decode(codes, bounds):
+    """Count matrix (n x 9) for an array of flat grid codes."""
+    low, shape = grid(bounds)
+    return np.stack(np.unravel_index(np.asarray(codes), tuple(shape)), axis=1) + low
+
+
+def iter_chunks(bounds, chunk_size=CHUNK_SIZE):
+    """Lazily enumerate the space as (codes, counts) chunks."""
+    _, shape = grid(bounds)
+    total = int(np.prod(shape))
+    for start in range(0, total, chunk_size):
+        codes = np.arange(start, min(start + chunk_size, total), dtype=np.int64)
+        yield codes, decode(codes, bounds)
+
+
+def iter_compositions(bounds):
+    """Lazily enumerate every composition in the space as a count tuple."""
+    for _, counts in iter_chunks(bounds):
+        yield from map(tuple, counts.tolist())
+
+
+def build_space(path, bounds=None, tag="free", derivatization="none", chunk_size=CHUNK_SIZE):
+    """Enumerate the space and write its mass-sorted lookup table under `path`."""
+    bounds = dict(bounds or DEFAULT_BOUNDS)
+    _, shape = grid(bounds)
+    total = int(np.prod(shape))
+    os.makedirs(path, exist_ok=True)
+
+    masses = np.empty(total, dtype=np.float64)
+    for codes, counts in iter_chunks(bounds, chunk_size):
+        masses[codes] = composition_mass.composition_masses(
+            counts, tag=tag, derivatization=derivatization
+        )
+    order = np.argsort(masses, kind="stable")
+
+    # Write to temporary names first so readers never see a half-built table.
+    for name, data in ((_MASSES, masses[order]), (_CODES, order.astype(np.int64))):
+        out = np.lib.format.open_memmap(
+            os.path.join(path, name + ".tmp"), mode="w+", dtype=data.dtype, shape=data.shape
+        )
+        out[:] = data
+        out.flush()
+        del out
+    meta = {
+        "bounds": {letter: list(bounds[letter]) for letter in COMPOSITION_LETTERS if letter in bounds},
+        "tag": tag,
+        "derivatization": derivatization,
+        "size": total,
+    }
+    with open(os.path.join(path, _META + ".tmp"), "w") as f:
+        json.dump(meta, f, indent=2)
+    for name in (_MASSES, _CODES, _META):
+        os.replace(os.path.join(path, name + ".tmp"), os.path.join(path, name))
+    return CompositionSpace.open(path)
+
+
+class CompositionSpace:
+    """Read-only view of a built composition space."""
+
+    def __init__(self, masses, codes, meta):
+        self.masses = masses
+        self.codes = codes
+        self.meta = meta
+        self.bounds = {letter: tuple(b) for letter, b in meta["bounds"].items()}
+
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, _META)) as f:
+            meta = json.load(f)
+        return cls(
+            np.load(os.path.join(path, _MASSES), mmap_mode="r"),
+            np.load(os.path.join(path, _CODES), mmap_mode="r"),
+            meta,
+        )
+
+    def __len__(self):
+        return len(self.masses)
+
+    def search(self, mass, ppm=None, da=None):
+        """
+        Every composition within tolerance of a neutral `mass`, nearest first,
+        as `(composition_string, counts, mass, error_ppm)` tuples.
+        """
+        low, high = tolerance_window(mass, ppm=ppm, da=da)
+        start = np.searchsorted(self.masses, low, side="left")
+        stop = np.searchsorted(self.masses, high, side="right")
+        hits = np.asarray(self.masses[start:stop])
+        counts = decode(self.codes[start:stop], self.bounds)
+        errors = (mass - hits) / hits * 1e6
+        return [
+            (format_composition(counts[i]), tuple(counts[i].tolist()), float(hits[i]), float(errors[i]))
+            for i in np.argsort(np.abs(errors), kind="stable")
+        ]
+
+
+_space = None  # (space.json mtime, CompositionSpace)
+
+
+def get_space():
+    """
+    The composition space under `default_path()`, memory-mapped once per
+    process and reopened when `build_composition_space` replaces it.
+    Raises FileNotFoundError if it hasn't been built.
+    """
+    global _space
+    stamp = os.stat(os.path.join(default_path(), _META)).st_mtime_ns
+    if _space is None or _space[0] != stamp:
+        _space = (stamp, CompositionSpace.open(default_path()))
+    return _space[1]
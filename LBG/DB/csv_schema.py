@@ -0,0 +1,191 @@
+"""
+Map CSV exports from older schema versions onto the current models.
+
+Old dumps (e.g. the shipped `csv_exports/`) still use column names from
+before migration 0008: `structural_resolution`, `sialic_derivatization`,
+`A_num`, ... `legacy_renames()` replays every RenameField / RenameModel in the
+migration graph to learn what each old name is called today, and
+`plan_columns()` uses that to translate a CSV header:
+
+- renamed columns are mapped to their current name,
+- columns that no longer exist (removed fields) are dropped,
+- current NOT NULL columns missing from the CSV are filled with the model
+  field's default.
+
+If the header already matches the table, the file is streamed to COPY
+untouched. Otherwise rows are rewritten on the fly (`transform_rows()`)
+and fed straight into COPY, with no temporary files.
+"""
+
+import csv
+import io
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from django.db.migrations import operations
+from django.db.migrations.loader import MigrationLoader
+
+CHUNK_ROWS = 10_000
+
+
+@lru_cache(maxsize=None)
+def legacy_renames():
+    """
+    `{(app_label, current_model_name): {old_field_name: current_field_name}}`
+    for every field renamed anywhere in the migration history.
+    """
+    loader = MigrationLoader(None, ignore_no_migrations=True, load=True)
+    graph = loader.graph
+    plan = []
+    for leaf in graph.leaf_nodes():
+        for node in graph.forwards_plan(leaf):
+            if node not in plan:
+                plan.append(node)
+
+    # Per model, track old -> current field names, following rename chains.
+    renames = {}
+    model_names = {}  # (app_label, historical name) -> current name
+    for app_label, name in plan:
+        for op in loader.graph.nodes[(app_label, name)].operations:
+            if isinstance(op, operations.RenameModel):
+                old, new = op.old_name_lower, op.new_name_lower
+                for key, current in list(model_names.items()):
+                    if current == old:
+                        model_names[key] = new
+                model_names.setdefault((app_label, old), new)
+                model_names[(app_label, new)] = new
+                if (app_label, old) in renames:
+                    renames[(app_label, new)] = renames.pop((app_label, old))
+            elif isinstance(op, operations.RenameField):
+                model = model_names.get((app_label, op.model_name_lower), op.model_name_lower)
+                fields = renames.setdefault((app_label, model), {})
+                for old, current in list(fields.items()):
+                    if current == op.old_name:
+                        fields[old] = op.new_name
+                fields[op.old_name] = op.new_name
+    return renames
+
+
+def _column_default(model_field):
+    """The value written for a column that is missing from the CSV."""
+    value = model_field.get_default()
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return None if value is None else str(value)
+
+
+@dataclass
+class ColumnPlan:
+    """How to turn one CSV header into the current table's columns."""
+
+    columns: list            # target columns, in COPY order
+    sources: list            # CSV index per target column, or None to use the default
+    defaults: list           # fill value per target column (when source is None)
+    empty_is_null: list      # per target column: treat "" as NULL?
+    renamed: dict = field(default_factory=dict)
+    dropped: list = field(default_factory=list)
+    filled: list = field(default_factory=list)
+
+    @property
+    def is_identity(self):
+        """True if the CSV can be streamed to COPY unchanged."""
+        return not (self.renamed or self.dropped or self.filled)
+
+    def notes(self):
+        parts = []
+        if self.renamed:
+            parts.append("renamed " + ", ".join(f"{o} -> {n}" for o, n in self.renamed.items()))
+        if self.dropped:
+            parts.append("dropped " + ", ".join(self.dropped))
+        if self.filled:
+            parts.append("defaulted " + ", ".join(self.filled))
+        return "; ".join(parts)
+
+
+def insertable_fields(model):
+    """Concrete fields that accept values on insert (generated columns excluded)."""
+    return [
+        f
+        for f in model._meta.concrete_fields
+        if not getattr(f, "generated", False)
+    ]
+
+
+def plan_columns(model, header):
+    """Work out the ColumnPlan for loading a CSV with `header` into `model`."""
+    fields = insertable_fields(model)
+    by_column = {f.column: f for f in fields}
+    by_name = {f.name: f for f in fields}
+    renames = legacy_renames().get((model._meta.app_label, model._meta.model_name), {})
+
+    mapped, renamed, dropped = {}, {}, []
+    for index, column in enumerate(header):
+        target = by_column.get(column)
+        if target is None:
+            # Legacy name: apply the migration renames to the field name
+            # (FK columns carry an "_id" suffix on top of the field name).
+            name = column[:-3] if column.endswith("_id") and column[:-3] in renames else column
+            current = by_name.get(renames.get(name, name))
+            if current is not None and current.column not in header:
+                target = current
+                renamed[column] = current.column
+        if target is None or target.column in mapped:
+            dropped.append(column)
+        else:
+            mapped[target.column] = index
+
+    columns, sources, defaults, empty_is_null, filled = [], [], [], [], []
+    for f in fields:
+        if f.column in mapped:
+            source, default = mapped[f.column], None
+        elif f.primary_key or f.has_db_default():
+            continue  # generated by the database
+        elif f.has_default() or (f.empty_strings_allowed and not f.null):
+            source, default = None, _column_default(f)
+            filled.append(f.column)
+        else:
+            continue  # nullable: left NULL
+        columns.append(f.column)
+        sources.append(source)
+        defaults.append(default)
+        empty_is_null.append(f.null or not f.empty_strings_allowed)
+    return ColumnPlan(columns, sources, defaults, empty_is_null, renamed, dropped, filled)
+
+
+def transform_rows(plan, text_stream):
+    """
+    Re-encode the data rows of a CSV (header already consumed) in `plan`'s
+    column order, yielding UTF-8 chunks ready for COPY.
+
+    Python's csv reader cannot tell `""` from an empty field, so empty values
+    become NULL for nullable / non-string columns and '' otherwise, following
+    the Django field definitions.
+    """
+    reader = csv.reader(text_stream)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NOTNULL, lineterminator="\n")
+    pick = list(zip(plan.sources, plan.defaults, plan.empty_is_null))
+    for n, row in enumerate(reader, start=1):
+        writer.writerow(
+            [
+                default if source is None
+                else (None if row[source] == "" and null else row[source])
+                for source, default, null in pick
+            ]
+        )
+        if n % CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def columns_for(load, header, chunks, stream):
+    """`bulk_load.load_table` hook: remap legacy headers, pass current ones through."""
+    plan = plan_columns(load.model, header)
+    if plan.is_identity:
+        return header, chunks
+    load.notes.append(plan.notes())
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    return plan.columns, transform_rows(plan, text)
@@ -0,0 +1,108 @@
+"""
+Size-bounded, least-recently-used cache of byte strings on disk.
+
+Entries are files at `<directory>/<key[:2]>/<key>`, so any process that
+points at the same directory shares the cache. A hit bumps the file's
+mtime, which therefore records last use. When the cache grows past
+`max_bytes`, the least recently used files are deleted until it is back
+under 90% of the limit.
+
+Each process keeps a running estimate of the total size: one directory
+scan at startup, then the size of every write added on. A full rescan only
+happens when that estimate crosses the limit. Writes go to a temporary
+file and are renamed into place, so readers never see a partial entry,
+and two processes writing the same key just race to an identical result.
+"""
+
+import os
+import tempfile
+import time
+
+LOW_WATER = 0.9  # evict down to this fraction of max_bytes
+
+
+class DiskCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None  # running estimate; None until the first scan
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """The cached bytes for `key`, or None."""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass  # evicted meanwhile; the data we read is still valid
+        return data
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += len(data)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def get_or_create(self, key, create):
+        """Cached bytes for `key`; on a miss, store and return `create()`."""
+        data = self.get(key)
+        if data is None:
+            data = create()
+            self.put(key, data)
+        return data
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.startswith(".tmp-") and stat.st_mtime > time.time() - 3600:
+                    continue  # another process is still writing it
+                yield stat.st_mtime, stat.st_size, path
+
+    def size(self):
+        """Bytes currently on disk."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Delete least recently used entries until under the low-water mark."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * LOW_WATER
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+    def clear(self):
+        for _, _, path in list(self._entries()):
+            os.unlink(path)
+        self._size = 0
@@ -0,0 +1,156 @@
+"""
+Precomputed facet counts for the Glycan changelist filters.
+
+`counts()` returns, per facet, `{value: (label, number_of_glycans)}` for
+species, tissue, ontogenic stage, GU bucket and mass bucket. All five come
+from one `GROUP BY GROUPING SETS` query over Glycan and its species links
+(`COUNT(DISTINCT glycan)`, so the M2M fan-out doesn't inflate counts).
+
+The result is cached with Django's cache framework under a key that
+includes the versions (table_versions.py) of every table it counts, like
+profiles.py. Any write to those tables, from any process, moves the key, so
+no invalidation is needed and stale counts are never served; the timeout
+only bounds memory.
+
+`filter_q()` builds the matching filter for a facet value. Species, tissue
+and stage use an `EXISTS` subquery on the link table, so filtering never
+needs a JOIN + DISTINCT.
+"""
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q
+
+from . import table_versions
+from .models import Glycan, ModelSpecies, OntogenicStage, Tissue
+
+TABLES = tuple(
+    model._meta.db_table for model in (Glycan, Glycan.model_species.through, ModelSpecies, Tissue, OntogenicStage)
+)
+CACHE_PREFIX = "DB:glycan_facets"
+CACHE_TIMEOUT = 24 * 3600  # keys change with the data; this only bounds memory
+
+# (value, label, low, high): glycans with low <= x < high (high None = open).
+GU_BUCKETS = (
+    ("0-2", "0.0 - 2.0", 0.0, 2.0),
+    ("2-5", "2.0 - 5.0", 2.0, 5.0),
+    ("5-7", "5.0 - 7.0", 5.0, 7.0),
+    ("7-10", "7.0 - 10.0", 7.0, 10.0),
+    ("10+", "> 10.0", 10.0, None),
+)
+MASS_BUCKETS = (
+    ("0-500", "0 - 500", 0, 500),
+    ("500-1000", "500 - 1000", 500, 1000),
+    ("1000-1500", "1000 - 1500", 1000, 1500),
+    ("1500-2000", "1500 - 2000", 1500, 2000),
+    ("2000+", "> 2000", 2000, None),
+)
+
+# facet -> (bucketed Glycan field, buckets)
+BUCKETED = {"gu": ("gu_mean", GU_BUCKETS), "mass": ("mass", MASS_BUCKETS)}
+FACETS = ("species", "tissue", "stage", "gu", "mass")
+
+
+def _bucket_case(column, buckets):
+    """SQL CASE mapping `column` to its bucket value (NULL if in none)."""
+    whens = []
+    for value, _, low, high in buckets:
+        condition = f"{column} >= {float(low)!r}"
+        if high is not None:
+            condition += f" AND {column} < {float(high)!r}"
+        whens.append(f"WHEN {condition} THEN '{value}'")
+    return f"CASE {' '.join(whens)} END"
+
+
+def _facet_sql():
+    q = connection.ops.quote_name
+
+    def table(model):
+        return q(model._meta.db_table)
+
+    links = q(Glycan.model_species.through._meta.db_table)
+    gu = _bucket_case("g.gu_mean", GU_BUCKETS)
+    mass = _bucket_case("g.mass", MASS_BUCKETS)
+    return f"""
+        SELECT
+            GROUPING(species_name), GROUPING(tissue_id), GROUPING(stage_id),
+            GROUPING(gu_bucket), GROUPING(mass_bucket),
+            species_name, tissue_id, organ, structure, stage_id, stage, age,
+            gu_bucket, mass_bucket,
+            COUNT(DISTINCT glycan_id)
+        FROM (
+            SELECT g.id AS glycan_id, ms.species_name,
+                   t.id AS tissue_id, t.organ, t.structure,
+                   st.id AS stage_id, st.stage, st.age,
+                   {gu} AS gu_bucket, {mass} AS mass_bucket
+            FROM {table(Glycan)} g
+            LEFT JOIN {links} gm ON gm.glycan_id = g.id
+            LEFT JOIN {table(ModelSpecies)} ms ON ms.id = gm.modelspecies_id
+            LEFT JOIN {table(Tissue)} t ON t.id = ms.tissue_id
+            LEFT JOIN {table(OntogenicStage)} st ON st.id = ms.stage_id
+        ) AS linked
+        GROUP BY GROUPING SETS (
+            (species_name), (tissue_id, organ, structure), (stage_id, stage, age),
+            (gu_bucket), (mass_bucket)
+        )
+    """
+
+
+def compute():
+    """Run the grouped facet query (uncached)."""
+    facets = {facet: {} for facet in FACETS}
+    with connection.cursor() as cursor:
+        cursor.execute(_facet_sql())
+        for row in cursor.fetchall():
+            grouping, values, count = row[:5], row[5:14], row[14]
+            species, tissue, organ, structure, stage_id, stage, age, gu, mass = values
+            facet = FACETS[grouping.index(0)]
+            if facet == "species" and species:
+                facets["species"][species] = (species, count)
+            elif facet == "tissue" and tissue is not None:
+                facets["tissue"][str(tissue)] = (str(Tissue(organ=organ, structure=structure)), count)
+            elif facet == "stage" and stage_id is not None:
+                facets["stage"][str(stage_id)] = (str(OntogenicStage(stage=stage, age=age)), count)
+            elif facet in BUCKETED:
+                bucket = gu if facet == "gu" else mass
+                if bucket is not None:
+                    facets[facet][bucket] = count
+
+    for facet, (_, buckets) in BUCKETED.items():
+        found = facets[facet]
+        facets[facet] = {value: (label, found.get(value, 0)) for value, label, _, _ in buckets}
+    for facet in ("species", "tissue", "stage"):
+        facets[facet] = dict(sorted(facets[facet].items(), key=lambda item: item[1][0].lower()))
+    return facets
+
+
+def counts():
+    """Facet counts, from the cache when the counted tables haven't changed."""
+    versions, _ = table_versions.snapshot(TABLES)
+    key = f"{CACHE_PREFIX}:{'.'.join(map(str, versions))}"
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute()
+        cache.set(key, facets, CACHE_TIMEOUT)
+    return facets
+
+
+def filter_q(facet, value):
+    """A Q selecting the glycans in `facet` == `value` (None for an unknown value)."""
+    if facet in BUCKETED:
+        field, buckets = BUCKETED[facet]
+        for key, _, low, high in buckets:
+            if key == value:
+                q = Q(**{f"{field}__gte": low})
+                return q if high is None else q & Q(**{f"{field}__lt": high})
+        return None
+
+    if facet in ("tissue", "stage") and not value.isdigit():
+        return None
+    lookup = {
+        "species": "modelspecies__species_name",
+        "tissue": "modelspecies__tissue_id",
+        "stage": "modelspecies__stage_id",
+    }[facet]
+    links = Glycan.model_species.through.objects.filter(glycan_id=OuterRef("pk"), **{lookup: value})
+    return Q(Exists(links))
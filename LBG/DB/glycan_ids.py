@@ -0,0 +1,63 @@
+"""
+Glycan ID allocation: `LBG-` + 5 base-36 characters, never reused.
+
+IDs come from the Postgres sequence `lbg_glycan_id_seq`. Each sequence
+value n is pushed through a fixed permutation of [0, 36^5), so consecutive
+glycans get unrelated-looking codes. The permutation is three affine steps
+`x -> a*x + b (mod 36^5)`, with a base-36 digit rotation between them.
+The result is then spelled with A-Z then 0-9, the same alphabet as the old
+random IDs. Because it is a bijection, two sequence values can never map
+to the same code.
+
+The SQL functions live in migration 0011:
+- `lbg_encode_glycan_id(n)` performs the mapping.
+- `lbg_next_glycan_id()` draws the next value. It skips the rare code that
+  a legacy random ID already holds.
+
+`Glycan.id` uses `lbg_next_glycan_id()` as its database default, so an
+insert gets its ID in the same statement (returned with RETURNING), with no
+lookup round trip and no race between concurrent saves. `encode()` mirrors
+the SQL in Python for tests and offline tools.
+"""
+
+from django.db import connection
+
+ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+WIDTH = 5
+SPACE = len(ALPHABET) ** WIDTH  # 60,466,176 IDs
+PREFIX = "LBG-"
+
+# (a, b) per affine round; every a is coprime with 36, so each round is a bijection.
+ROUNDS = ((44696359, 39110241), (24047633, 34053435), (22671683, 5767821))
+
+
+def _rotate(x):
+    """Move the lowest base-36 digit to the top (a bijection on [0, SPACE))."""
+    return (x % 36) * (SPACE // 36) + x // 36
+
+
+def encode(n):
+    """The 5-character code for sequence value `n` (same result as the SQL function)."""
+    x = n
+    for i, (a, b) in enumerate(ROUNDS):
+        x = (a * x + b) % SPACE
+        if i < len(ROUNDS) - 1:
+            x = _rotate(x)
+    code = ""
+    for _ in range(WIDTH):
+        code = ALPHABET[x % 36] + code
+        x //= 36
+    return code
+
+
+def reserve_glycan_ids(count):
+    """
+    Allocate `count` fresh glycan IDs in one query, e.g. to assign IDs
+    before a bulk import. They are consumed from the sequence whether or
+    not they end up being used.
+    """
+    if count <= 0:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT lbg_next_glycan_id() FROM generate_series(1, %s)", [count])
+        return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,117 @@
+"""
+Maintenance of the denormalised `GlycanSearch` table.
+
+Every row is derived by one set-based `INSERT ... SELECT` over Glycan,
+MonosaccharideComposition, the two M2M tables, ModelSpecies, Tissue,
+OntogenicStage and Study. The species, tissue, stage and DOI lists are
+collected with `ARRAY(SELECT DISTINCT ...)` sub-queries, so the only
+grouping happens per glycan. `refresh(ids)` re-derives only the given
+glycans and upserts them. `rebuild()` empties the table and derives every
+row again. It uses DELETE rather than TRUNCATE, so readers keep seeing the
+old rows until it commits.
+
+`DEPENDENCIES` maps each source model to the Glycan lookup that finds the
+glycans a change to it affects. The signal handlers in signals.py use it
+to refresh exactly those rows.
+"""
+
+from django.db import connection, transaction
+
+from .models import (
+    COMPOSITION_FIELDS,
+    Glycan,
+    GlycanSearch,
+    ModelSpecies,
+    MonosaccharideComposition,
+    OntogenicStage,
+    Study,
+    Tissue,
+)
+
+# Source model -> Glycan lookup to its affected glycans.
+DEPENDENCIES = {
+    Glycan: "pk",
+    MonosaccharideComposition: "monosaccharide_comp",
+    ModelSpecies: "model_species",
+    Tissue: "model_species__tissue",
+    OntogenicStage: "model_species__stage",
+    Study: "studies",
+}
+
+
+def affected_glycans(model, pks):
+    """Ids of the glycans whose search rows depend on `model` rows `pks`."""
+    lookup = DEPENDENCIES[model]
+    return list(
+        Glycan.objects.filter(**{f"{lookup}__in": pks}).values_list("pk", flat=True).distinct()
+    )
+
+
+def _select_sql():
+    q = connection.ops.quote_name
+    t = {
+        model: q(model._meta.db_table)
+        for model in (Glycan, MonosaccharideComposition, ModelSpecies, Tissue, OntogenicStage, Study)
+    }
+    species_m2m = q(Glycan.model_species.through._meta.db_table)
+    studies_m2m = q(Glycan.studies.through._meta.db_table)
+    species_join = (
+        f"FROM {species_m2m} gm JOIN {t[ModelSpecies]} ms ON ms.id = gm.modelspecies_id "
+    )
+
+    def species_array(expression, joins=""):
+        return (
+            f"ARRAY(SELECT DISTINCT {expression} {species_join}{joins}"
+            f"WHERE gm.glycan_id = g.id AND {expression} <> '' ORDER BY 1)"
+        )
+
+    counts = ", ".join(f"c.{q(field)}" for field in COMPOSITION_FIELDS)
+    return f"""
+        SELECT
+            g.id,
+            COALESCE(c.composition_string, ''),
+            {counts},
+            g.mass, g.theoretical_mass, g.gu_mean, g.gu_min, g.gu_max, g.brain_specific,
+            {species_array("ms.species_name")},
+            {species_array("COALESCE(NULLIF(ms.species_taxid, ''), ms.taxid)")},
+            {species_array("concat_ws(' - ', NULLIF(ti.organ, ''), NULLIF(ti.structure, ''))",
+                           f"JOIN {t[Tissue]} ti ON ti.id = ms.tissue_id ")},
+            {species_array("st.stage", f"JOIN {t[OntogenicStage]} st ON st.id = ms.stage_id ")},
+            ARRAY(
+                SELECT DISTINCT s.doi FROM {studies_m2m} gs JOIN {t[Study]} s ON s.id = gs.study_id
+                WHERE gs.glycan_id = g.id AND s.doi IS NOT NULL AND s.doi <> '' ORDER BY 1
+            )
+        FROM {t[Glycan]} g
+        LEFT JOIN {t[MonosaccharideComposition]} c ON c.id = g.monosaccharide_comp_id
+    """
+
+
+def _insert_sql(where="WHERE true"):
+    q = connection.ops.quote_name
+    # Model field order matches the SELECT list above.
+    columns = [f.column for f in GlycanSearch._meta.concrete_fields]
+    pk = GlycanSearch._meta.pk.column
+    updates = ", ".join(f"{q(c)} = EXCLUDED.{q(c)}" for c in columns if c != pk)
+    return (
+        f"INSERT INTO {q(GlycanSearch._meta.db_table)} ({', '.join(map(q, columns))}) "
+        f"{_select_sql()} {where} "
+        f"ON CONFLICT ({q(pk)}) DO UPDATE SET {updates}"
+    )
+
+
+def refresh(glycan_ids):
+    """Re-derive the search rows of `glycan_ids` (deleted glycans are skipped)."""
+    glycan_ids = list(glycan_ids)
+    if not glycan_ids:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(_insert_sql("WHERE g.id = ANY(%s)"), [glycan_ids])
+        return cursor.rowcount
+
+
+def rebuild():
+    """Empty the search table and derive every row again, in one transaction."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {connection.ops.quote_name(GlycanSearch._meta.db_table)}")
+        cursor.execute(_insert_sql())
+        return cursor.rowcount
@@ -0,0 +1,178 @@
+"""
+Combined GU + mass matching for HILIC-FLR-MS identification.
+
+Every glycan with both a mass and a GU value is held in a grid sorted by
+mass, with its retention treated as the interval [gu_min, gu_max] (falling
+back to gu_mean when either bound is missing). A query is answered in two
+vectorised steps:
+
+1. the ±ppm mass window is cut out of the sorted mass axis with
+   `searchsorted` (the same merge-join the peak annotator uses);
+2. the few surviving candidates are checked against the GU interval and
+   scored.
+
+A ppm window is orders of magnitude narrower than any useful ΔGU window, so
+the mass axis alone cuts the candidate set down to a handful of rows; a
+KD-tree would not prune further and would need SciPy.
+
+Candidates are ranked by the combined normalised distance
+
+    score = sqrt((error_ppm / ppm) ** 2 + (gu_error / delta_gu) ** 2)
+
+where `gu_error` is the distance from the observed GU to the glycan's GU
+interval (0 when inside it). Scores range from 0 (exact) to sqrt(2).
+
+Like mass_index.py, `get_index()` keeps one grid per process and reloads it
+when the `Glycan` table version changes.
+"""
+
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+from .annotation import DEFAULT_ADDUCTS, DEFAULT_CHARGES, Annotation, expand_matches, expand_states
+from . import table_versions
+from .models import Glycan
+
+
+@dataclass
+class GuMassMatches:
+    """Flat match arrays for a batch of (mass, GU) queries, best first per query."""
+
+    query: np.ndarray
+    library: np.ndarray
+    error_ppm: np.ndarray
+    gu_error: np.ndarray
+    score: np.ndarray
+
+    def __len__(self):
+        return len(self.query)
+
+
+class GuMassIndex:
+    """Mass-sorted grid of glycans with GU intervals."""
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=object)
+        self.mass = np.empty(0, dtype=np.float64)
+        self.gu_mean = np.empty(0, dtype=np.float64)
+        self.gu_low = np.empty(0, dtype=np.float64)
+        self.gu_high = np.empty(0, dtype=np.float64)
+        self.version = None  # Glycan table version loaded, set by get_index()
+
+    def __len__(self):
+        return len(self.mass)
+
+    def load(self, rows=None, field="mass"):
+        """
+        Build from `(id, mass, gu_mean, gu_min, gu_max)` rows, or from the DB
+        using `field` ("mass" or "theoretical_mass") as the mass axis.
+        """
+        if rows is None:
+            rows = (
+                Glycan.objects.filter(**{f"{field}__isnull": False})
+                .exclude(gu_mean__isnull=True, gu_min__isnull=True, gu_max__isnull=True)
+                .values_list("id", field, "gu_mean", "gu_min", "gu_max")
+            )
+        rows = [r for r in rows if r[1] is not None and any(v is not None for v in r[2:])]
+        ids = np.array([r[0] for r in rows], dtype=object)
+        data = np.array([r[1:] for r in rows], dtype=np.float64).reshape(-1, 4)
+        mass, gu_mean = data[:, 0], data[:, 1]
+        # The interval spans whichever of mean/min/max are present; a missing
+        # mean is taken as the interval midpoint.
+        gu_low = np.nanmin(data[:, 1:], axis=1)
+        gu_high = np.nanmax(data[:, 1:], axis=1)
+        gu_mean = np.where(np.isnan(gu_mean), (gu_low + gu_high) / 2, gu_mean)
+
+        order = np.argsort(mass, kind="stable")
+        self.ids = ids[order]
+        self.mass = mass[order]
+        self.gu_mean = gu_mean[order]
+        self.gu_low = gu_low[order]
+        self.gu_high = gu_high[order]
+        return self
+
+    def gu_distance(self, library_idx, gu):
+        """Distance from observed GU values to the matching glycans' GU intervals."""
+        below = self.gu_low[library_idx] - gu
+        above = gu - self.gu_high[library_idx]
+        return np.maximum(np.maximum(below, above), 0.0)
+
+    def match(self, masses, gus, ppm=10.0, delta_gu=0.2):
+        """
+        Batch query: every library glycan within ±ppm of `masses[i]` and within
+        `delta_gu` of `gus[i]`, ranked by combined score within each query.
+        Both tolerances must be positive (they divide the score); raises
+        ValueError otherwise.
+        """
+        if not (ppm > 0 and delta_gu > 0):
+            raise ValueError("ppm and gu_tolerance must be positive.")
+        masses = np.asarray(masses, dtype=np.float64)
+        gus = np.asarray(gus, dtype=np.float64)
+        query_idx, library_idx = expand_matches(masses, self.mass, ppm)
+
+        gu_error = self.gu_distance(library_idx, gus[query_idx])
+        keep = gu_error <= delta_gu  # NaN (no observed GU) never passes
+        query_idx, library_idx, gu_error = query_idx[keep], library_idx[keep], gu_error[keep]
+
+        library_mass = self.mass[library_idx]
+        error_ppm = (masses[query_idx] - library_mass) / library_mass * 1e6
+        score = np.hypot(error_ppm / ppm, gu_error / delta_gu)
+
+        order = np.lexsort((score, query_idx))
+        return GuMassMatches(
+            query=query_idx[order],
+            library=library_idx[order],
+            error_ppm=error_ppm[order],
+            gu_error=gu_error[order],
+            score=score[order],
+        )
+
+    def annotate(self, peaks, charges=DEFAULT_CHARGES, adducts=DEFAULT_ADDUCTS, ppm=10.0, delta_gu=0.2):
+        """
+        Annotate a whole chromatogram's PeakList (which must carry GU values),
+        returning an `annotation.Annotation` with `gu_error` and `score` set.
+        """
+        peak_idx, charge, adduct, queries = expand_states(peaks, charges, adducts)
+        matches = self.match(queries, peaks.gu[peak_idx], ppm=ppm, delta_gu=delta_gu)
+        return Annotation(
+            peak=peak_idx[matches.query],
+            charge=charge[matches.query],
+            adduct=adduct[matches.query],
+            neutral_mass=queries[matches.query],
+            library=matches.library,
+            error_ppm=matches.error_ppm,
+            gu_error=matches.gu_error,
+            score=matches.score,
+        )
+
+
+# ---------------------------------------------------------------------------
+# Per-process registry
+# ---------------------------------------------------------------------------
+_indexes = {}
+_registry_lock = threading.Lock()
+
+
+def get_index(field="mass"):
+    """
+    Return the process-wide GU + mass index, loading it on first use and
+    reloading it whenever the Glycan table version has moved on.
+    """
+    version = table_versions.recent_version(Glycan._meta.db_table)
+    index = _indexes.get(field)
+    if index is None or index.version != version:
+        with _registry_lock:
+            index = _indexes.get(field)
+            if index is None or index.version != version:
+                index = GuMassIndex().load(field=field)
+                index.version = version
+                _indexes[field] = index
+    return index
+
+
+def reset_indexes():
+    """Drop the loaded indexes; they are rebuilt from the table on next use."""
+    with _registry_lock:
+        _indexes.clear()
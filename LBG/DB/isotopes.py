@@ -0,0 +1,310 @@
+"""
+Isotope envelopes for compositions, and envelope-scored peak matching.
+
+An envelope is the relative abundance of the M, M+1, M+2, ... peaks
+(isotopologues grouped by nominal mass shift). For one element with
+isotope shift distribution p, n atoms give the n-fold convolution p^n, so
+a whole formula's distribution is a product of polynomial powers. In the
+Fourier domain that product is a sum of logarithms:
+
+    spectrum(formula) = exp(formula @ LOG_SPECTRA)     (n x FFT_SIZE)
+    envelope          = real(ifft(spectrum))[:PEAKS]
+
+so a batch of formulas from `composition_mass.composition_formulas()` is
+one matrix product and one batched inverse FFT.
+
+`build_table()` precomputes the envelope of every MonosaccharideComposition
+into a memory-mapped table under CACHE_DIR/isotopes/<tag>-<derivatization> (one float32 row per
+composition id), like composition_space.py does for masses. The table
+records the MonosaccharideComposition table version (table_versions.py) it
+was built from and `get_table()` rebuilds it once that moves on.
+`library_envelopes()` aligns its rows with the mass-sorted library, using
+the composition ids the mass index holds. Compositions added since the
+build are computed on the fly, and glycans without a composition get an
+"averagine" estimate from their mass.
+
+`annotate()` extends `annotation.annotate()`. Each peak is also tried as
+the M+1, M+2, ... peak of a lighter glycan (`isotope_errors`), since
+instruments sometimes pick those. Every match is then scored by the cosine
+similarity between the predicted envelope and the intensities observed at
+the expected isotope m/z values in the same peak list.
+"""
+
+import json
+import os
+
+import numpy as np
+from django.conf import settings
+
+from . import composition_mass, table_versions
+from .annotation import ADDUCTS, DEFAULT_ADDUCTS, DEFAULT_CHARGES, Annotation, expand_matches, expand_states
+from .mass_index import tolerance_window
+from .models import COMPOSITION_FIELDS, MonosaccharideComposition
+
+# (nominal mass shift, natural abundance) per element, in composition_mass.ELEMENTS order.
+ISOTOPES = {
+    "C": ((0, 0.9893), (1, 0.0107)),
+    "H": ((0, 0.999885), (1, 0.000115)),
+    "N": ((0, 0.99636), (1, 0.00364)),
+    "O": ((0, 0.99757), (1, 0.00038), (2, 0.00205)),
+    "P": ((0, 1.0),),
+    "S": ((0, 0.9499), (1, 0.0075), (2, 0.0425), (4, 0.0001)),
+}
+ISOTOPE_SPACING = 1.0033548  # 13C - 12C, the dominant spacing in glycan envelopes
+FFT_SIZE = 64  # longer than any envelope with a non-negligible tail
+PEAKS = 6  # envelope peaks kept (M .. M+5)
+DEFAULT_ISOTOPE_ERRORS = (0, 1, 2)
+
+
+def _log_spectra():
+    rows = []
+    for element in composition_mass.ELEMENTS:
+        polynomial = np.zeros(FFT_SIZE)
+        for shift, abundance in ISOTOPES[element]:
+            polynomial[shift] = abundance
+        rows.append(np.log(np.fft.fft(polynomial)))
+    return np.stack(rows)
+
+
+LOG_SPECTRA = _log_spectra()  # (elements x FFT_SIZE), complex
+
+
+def envelopes(formulas, peaks=PEAKS):
+    """Isotope envelopes (n x peaks, float32) for a formula matrix (n x ELEMENTS)."""
+    formulas = np.asarray(formulas, dtype=np.float64).reshape(-1, len(composition_mass.ELEMENTS))
+    spectra = np.exp(formulas @ LOG_SPECTRA)
+    distribution = np.fft.ifft(spectra, axis=1).real[:, :peaks]
+    return np.clip(distribution, 0.0, None).astype(np.float32)
+
+
+def composition_envelopes(counts, tag="free", derivatization="none"):
+    """Isotope envelopes for a composition count matrix (n x 9)."""
+    return envelopes(composition_mass.composition_formulas(counts, tag=tag, derivatization=derivatization))
+
+
+# An average N-glycan residue, for glycans with only a mass.
+_AVERAGINE_COUNTS = (5, 4, 1, 0, 0, 0, 1, 0, 0)  # H5N4F1S1
+
+
+def averagine_envelopes(masses, tag="free", derivatization="none"):
+    """Envelopes for neutral `masses` of unknown composition, scaling an average glycan."""
+    masses = np.asarray(masses, dtype=np.float64)
+    end = composition_mass.composition_formulas(np.zeros((1, len(COMPOSITION_FIELDS))), tag, derivatization)[0]
+    whole = composition_mass.composition_formulas([_AVERAGINE_COUNTS], tag, derivatization)[0]
+    residues = whole - end
+    element_masses = composition_mass.ELEMENT_MASSES["monoisotopic"]
+    scale = (masses - end @ element_masses) / (residues @ element_masses)
+    formulas = np.rint(np.clip(scale, 0, None)[:, None] * residues[None, :]) + end
+    return envelopes(formulas)
+
+
+# ---------------------------------------------------------------------------
+# Precomputed table
+# ---------------------------------------------------------------------------
+_ENVELOPES = "envelopes.npy"
+_IDS = "compositions.npy"
+_META = "envelopes.json"
+
+
+def table_path(tag="free", derivatization="none"):
+    return os.path.join(settings.CACHE_DIR, "isotopes", f"{tag}-{derivatization}")
+
+
+def build_table(tag="free", derivatization="none", path=None):
+    """Compute the envelope of every composition and write the table under `path`."""
+    path = path or table_path(tag, derivatization)
+    # Read first: a composition added meanwhile makes the table stale, never wrongly current.
+    version = table_versions.version(MonosaccharideComposition._meta.db_table)
+    rows = list(MonosaccharideComposition.objects.order_by("pk").values_list("pk", *COMPOSITION_FIELDS))
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    counts = np.array([row[1:] for row in rows], dtype=np.int64).reshape(-1, len(COMPOSITION_FIELDS))
+    table = composition_envelopes(counts, tag=tag, derivatization=derivatization)
+    os.makedirs(path, exist_ok=True)
+    # Write to temporary names first so readers never see a half-built table
+    # (per process: workers may rebuild a stale table at the same time).
+    tmp = f".{os.getpid()}.tmp"
+    for name, data in ((_ENVELOPES, table), (_IDS, ids)):
+        with open(os.path.join(path, name + tmp), "wb") as f:
+            np.save(f, data)
+    with open(os.path.join(path, _META + tmp), "w") as f:
+        json.dump(
+            {"tag": tag, "derivatization": derivatization, "peaks": PEAKS, "size": len(ids), "version": version},
+            f,
+            indent=2,
+        )
+    for name in (_ENVELOPES, _IDS, _META):
+        os.replace(os.path.join(path, name + tmp), os.path.join(path, name))
+    return EnvelopeTable.open(path)
+
+
+class EnvelopeTable:
+    """Read-only view of a built envelope table, rows sorted by composition id."""
+
+    def __init__(self, envelopes, ids, meta):
+        self.envelopes = envelopes
+        self.ids = ids
+        self.meta = meta
+
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, _META)) as f:
+            meta = json.load(f)
+        mmap_mode = "r" if meta["size"] else None  # an empty file can't be mapped
+        return cls(
+            np.load(os.path.join(path, _ENVELOPES), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, _IDS), mmap_mode=mmap_mode),
+            meta,
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, composition_ids):
+        """`(envelopes, found)` for an array of composition ids; rows not in the table are zero."""
+        composition_ids = np.asarray(composition_ids, dtype=np.int64)
+        result = np.zeros((len(composition_ids), self.meta["peaks"]), dtype=np.float32)
+        if not len(self.ids):
+            return result, np.zeros(len(composition_ids), dtype=bool)
+        position = np.minimum(np.searchsorted(self.ids, composition_ids), len(self.ids) - 1)
+        found = self.ids[position] == composition_ids
+        result[found] = self.envelopes[position[found]]
+        return result, found
+
+
+_tables = {}
+
+
+def _current(table, version):
+    return table.meta.get("peaks") == PEAKS and table.meta.get("version") == version
+
+
+def get_table(tag="free", derivatization="none"):
+    """
+    The table for `tag` / `derivatization`, opened once per process and
+    reopened, or rebuilt if missing or stale, when the compositions change.
+    """
+    key = (tag, derivatization)
+    version = table_versions.recent_version(MonosaccharideComposition._meta.db_table)
+    table = _tables.get(key)
+    if table is None or table.meta.get("version") != version:
+        try:
+            table = EnvelopeTable.open(table_path(tag, derivatization))  # another process may have rebuilt it
+            if not _current(table, version):
+                raise ValueError("stale table")
+        except (OSError, ValueError, KeyError):
+            table = build_table(tag, derivatization)
+        _tables[key] = table
+    return table
+
+
+def reset_tables():
+    _tables.clear()
+
+
+def library_envelopes(composition_ids, masses, tag="free", derivatization="none"):
+    """
+    Predicted envelopes (n x PEAKS) for library glycans with `composition_ids`
+    (-1 for none, as `MassIndex.library()` gives them) and neutral `masses`,
+    from the table, else their composition, else their mass.
+    """
+    composition_ids = np.asarray(composition_ids, dtype=np.int64)
+    result, found = get_table(tag, derivatization).lookup(composition_ids)
+    missing = ~found & (composition_ids >= 0)  # compositions added since the table was built
+    if missing.any():
+        by_id = {
+            row[0]: row[1:]
+            for row in MonosaccharideComposition.objects.filter(
+                pk__in=np.unique(composition_ids[missing]).tolist()
+            ).values_list("pk", *COMPOSITION_FIELDS)
+        }
+        known = missing & np.isin(composition_ids, list(by_id))
+        counts = [by_id[i] for i in composition_ids[known].tolist()]
+        result[known] = composition_envelopes(counts, tag=tag, derivatization=derivatization)
+        composition_ids = np.where(missing & ~known, -1, composition_ids)  # deleted meanwhile
+    unknown = composition_ids < 0
+    if unknown.any():
+        result[unknown] = averagine_envelopes(np.asarray(masses, dtype=np.float64)[unknown], tag, derivatization)
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Envelope-scored matching
+# ---------------------------------------------------------------------------
+def parse_isotope_errors(value):
+    """Parse a comma-separated list of isotope offsets such as "0,1,2"."""
+    try:
+        offsets = tuple(int(k) for k in str(value).split(",") if k.strip())
+    except ValueError:
+        raise ValueError(f"Invalid isotope error list: {value!r}")
+    if not offsets or min(offsets) < 0 or max(offsets) >= PEAKS:
+        raise ValueError(f"Invalid isotope error list: {value!r} (use offsets 0-{PEAKS - 1})")
+    return offsets
+
+
+def observed_envelopes(peaks, charge, adduct, monoisotopic, n_peaks=PEAKS, ppm=10.0):
+    """
+    Intensities (m x n_peaks) found in `peaks` at the m/z of each isotope
+    peak of matches with neutral `monoisotopic` mass in the given states.
+    A missing isotope peak counts as 0.
+    """
+    order = np.argsort(peaks.mz, kind="stable")
+    mz, intensity = peaks.mz[order], np.nan_to_num(peaks.intensity[order])
+    if len(mz) == 0:
+        return np.zeros((len(monoisotopic), n_peaks))
+    adduct_mass = np.array([ADDUCTS[a] for a in adduct], dtype=np.float64)
+    shifts = np.arange(n_peaks) * ISOTOPE_SPACING
+    targets = (monoisotopic[:, None] + shifts[None, :]) / charge[:, None] + adduct_mass[:, None]
+    # Nearest peak to each target m/z, kept if it lies within tolerance.
+    right = np.clip(np.searchsorted(mz, targets), 0, len(mz) - 1)
+    left = np.clip(right - 1, 0, len(mz) - 1)
+    nearest = np.where(np.abs(mz[left] - targets) < np.abs(mz[right] - targets), left, right)
+    low, high = tolerance_window(targets, ppm=ppm)
+    inside = (mz[nearest] >= low) & (mz[nearest] <= high)
+    return np.where(inside, intensity[nearest], 0.0)
+
+
+def cosine(observed, predicted):
+    """Row-wise cosine similarity; NaN where either row is all zero."""
+    dot = np.einsum("ij,ij->i", observed, predicted)
+    norms = np.linalg.norm(observed, axis=1) * np.linalg.norm(predicted, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(norms > 0, dot / norms, np.nan)
+
+
+def annotate(
+    peaks,
+    library_masses,
+    library_envelopes,
+    charges=DEFAULT_CHARGES,
+    adducts=DEFAULT_ADDUCTS,
+    ppm=10.0,
+    isotope_errors=DEFAULT_ISOTOPE_ERRORS,
+):
+    """
+    `annotation.annotate()` plus isotope handling: every peak is also tried
+    as the M+k peak for each k in `isotope_errors`, and each match gets an
+    `envelope_score` (cosine, 1 = perfect) against `library_envelopes`, the
+    predicted envelopes aligned with `library_masses`.
+    """
+    peak_idx, charge, adduct, queries = expand_states(peaks, charges, adducts)
+    offsets = np.asarray(isotope_errors, dtype=np.int64)
+    k = np.repeat(offsets[None, :], len(queries), axis=0).ravel()
+    peak_idx, charge, adduct = (np.repeat(a, len(offsets)) for a in (peak_idx, charge, adduct))
+    queries = np.repeat(queries, len(offsets)) - k * ISOTOPE_SPACING
+
+    query_idx, library_idx = expand_matches(queries, library_masses, ppm)
+    matched = queries[query_idx]
+    charge, adduct, peak = charge[query_idx], adduct[query_idx], peak_idx[query_idx]
+    n_peaks = library_envelopes.shape[1] if len(library_envelopes) else PEAKS
+    observed = observed_envelopes(peaks, charge, adduct, matched, n_peaks=n_peaks, ppm=ppm)
+    predicted = np.asarray(library_envelopes, dtype=np.float64).reshape(-1, n_peaks)[library_idx]
+    return Annotation(
+        peak=peak,
+        charge=charge,
+        adduct=adduct,
+        neutral_mass=matched,
+        library=library_idx,
+        error_ppm=(matched - library_masses[library_idx]) / library_masses[library_idx] * 1e6,
+        isotope=k[query_idx],
+        envelope_score=cosine(observed, predicted),
+    )
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from DB import abundance
+from DB.models import Study
+
+
+class Command(BaseCommand):
+    help = (
+        "Load a long-format glycan abundance table (one row per sample and glycan; "
+        "CSV/TSV, optionally .gz/.zst) into the samples and measurements of a study. "
+        "See DB/abundance.py for the columns."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("study", help="Study id or DOI.")
+        parser.add_argument("path", help="Abundance file with a header row.")
+
+    def handle(self, *args, **options):
+        key = options["study"]
+        study = Study.objects.filter(pk=int(key)).first() if key.isdigit() else Study.objects.filter(doi=key).first()
+        if study is None:
+            raise CommandError(f"No study {key!r}.")
+        try:
+            result = abundance.ingest(study, options["path"])
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Read {result['rows']} rows: {result['measurements']} measurements written, "
+                f"{result['samples']} new samples."
+            )
+        )
+        if result["unknown_glycans"]:
+            self.stderr.write(f"Skipped {result['unknown_glycans']} rows with glycan IDs not in the library.")
@@ -0,0 +1,101 @@
+import csv
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from DB import annotation, composition_mass, gu_index, isotopes, mass_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Annotate a CSV peak list (m/z, charge, intensity, optional GU) against "
+        "the glycan library in one vectorised pass."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("peak_list", help="CSV peak list, or '-' for stdin.")
+        parser.add_argument("-o", "--output", help="Write the annotated CSV here (default: stdout).")
+        parser.add_argument("--ppm", type=float, default=10.0, help="Mass tolerance in ppm (default: 10).")
+        parser.add_argument("--charges", default="1,2,3", help="Charge states to try (default: 1,2,3).")
+        parser.add_argument("--adducts", default="H", help="Adducts to try, e.g. H,Na,NH4 (default: H).")
+        parser.add_argument(
+            "--field",
+            choices=mass_index.MASS_FIELDS,
+            default="mass",
+            help="Library mass field to match against (default: mass).",
+        )
+        parser.add_argument(
+            "--gu-tolerance",
+            type=float,
+            help="Also require the peak's GU to lie within this distance of the glycan's "
+            "GU range, and rank candidates by combined GU + mass score.",
+        )
+        parser.add_argument(
+            "--isotope-errors",
+            help="Also try each peak as the M+k isotope peak for these k, e.g. 0,1,2, and "
+            "score every match by how well the observed isotope envelope fits the predicted one.",
+        )
+        parser.add_argument(
+            "--tag",
+            choices=composition_mass.REDUCING_END_TAGS,
+            default="free",
+            help="Reducing-end group used to predict isotope envelopes (default: free).",
+        )
+        parser.add_argument("--matched-only", action="store_true", help="Leave out peaks with no match.")
+
+    def handle(self, *args, **options):
+        try:
+            annotation.check_tolerances(ppm=options["ppm"], gu_tolerance=options["gu_tolerance"])
+            charges = annotation.parse_charges(options["charges"])
+            adducts = annotation.parse_adducts(options["adducts"])
+            isotope_errors = options["isotope_errors"] and isotopes.parse_isotope_errors(options["isotope_errors"])
+            if options["peak_list"] == "-":
+                peaks = annotation.read_peak_list(sys.stdin)
+            else:
+                with open(options["peak_list"], newline="", encoding="utf-8") as f:
+                    peaks = annotation.read_peak_list(f)
+        except (OSError, ValueError) as exc:
+            raise CommandError(exc)
+        if isotope_errors and options["gu_tolerance"] is not None:
+            raise CommandError("--isotope-errors can't be combined with --gu-tolerance.")
+
+        if isotope_errors:
+            library_masses, library_ids, composition_ids = mass_index.get_index(options["field"]).library()
+            envelopes = isotopes.library_envelopes(composition_ids, library_masses, tag=options["tag"])
+            started = time.perf_counter()
+            result = isotopes.annotate(
+                peaks, library_masses, envelopes, charges=charges, adducts=adducts,
+                ppm=options["ppm"], isotope_errors=isotope_errors,
+            )
+        elif options["gu_tolerance"] is not None:
+            index = gu_index.get_index(options["field"])
+            library_masses, library_ids = index.mass, index.ids
+            started = time.perf_counter()
+            result = index.annotate(
+                peaks, charges=charges, adducts=adducts,
+                ppm=options["ppm"], delta_gu=options["gu_tolerance"],
+            )
+        else:
+            library_masses, library_ids = mass_index.get_index(options["field"]).snapshot()
+            started = time.perf_counter()
+            result = annotation.annotate(
+                peaks, library_masses, charges=charges, adducts=adducts, ppm=options["ppm"]
+            )
+        rows = annotation.iter_rows(
+            peaks, result, library_masses, library_ids,
+            include_unmatched=not options["matched_only"],
+        )
+
+        out = open(options["output"], "w", newline="", encoding="utf-8") if options["output"] else self.stdout
+        try:
+            csv.writer(out).writerows(rows)
+        finally:
+            if options["output"]:
+                out.close()
+
+        elapsed = time.perf_counter() - started
+        self.stderr.write(
+            f"Annotated {len(peaks)} peaks against {len(library_masses)} glycans: "
+            f"{len(result)} matches in {elapsed * 1000:.1f} ms."
+        )
@@ -0,0 +1,101 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from DB import annotation, batch_annotation, composition_mass, isotopes, mass_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Annotate every peak list (*.csv, *.csv.gz, *.csv.zst) in a directory against "
+        "the glycan library with a pool of worker processes sharing one in-memory copy "
+        "of the library, writing all runs into one CSV or Parquet file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="Directory of peak lists, one LC-MS run per file.")
+        parser.add_argument(
+            "-o", "--output", required=True, help="Combined output; .parquet writes Parquet, anything else CSV."
+        )
+        parser.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes (default: one per CPU).")
+        parser.add_argument(
+            "--max-tasks-per-child",
+            type=int,
+            default=50,
+            help="Runs a worker annotates before it is replaced, to keep its memory flat (default: 50).",
+        )
+        parser.add_argument("--ppm", type=float, default=10.0, help="Mass tolerance in ppm (default: 10).")
+        parser.add_argument("--charges", default="1,2,3", help="Charge states to try (default: 1,2,3).")
+        parser.add_argument("--adducts", default="H", help="Adducts to try, e.g. H,Na,NH4 (default: H).")
+        parser.add_argument(
+            "--field",
+            choices=mass_index.MASS_FIELDS,
+            default="mass",
+            help="Library mass field to match against (default: mass).",
+        )
+        parser.add_argument("--gu-tolerance", type=float, help="As for annotate_peaks.")
+        parser.add_argument("--isotope-errors", help="As for annotate_peaks, e.g. 0,1,2.")
+        parser.add_argument(
+            "--tag",
+            choices=composition_mass.REDUCING_END_TAGS,
+            default="free",
+            help="Reducing-end group used to predict isotope envelopes (default: free).",
+        )
+        parser.add_argument("--matched-only", action="store_true", help="Leave out peaks with no match.")
+
+    def handle(self, *args, **options):
+        try:
+            annotation.check_tolerances(ppm=options["ppm"], gu_tolerance=options["gu_tolerance"])
+            charges = annotation.parse_charges(options["charges"])
+            adducts = annotation.parse_adducts(options["adducts"])
+            isotope_errors = options["isotope_errors"] and isotopes.parse_isotope_errors(options["isotope_errors"])
+            paths = batch_annotation.find_runs(options["directory"])
+        except (OSError, ValueError) as exc:
+            raise CommandError(exc)
+        if isotope_errors and options["gu_tolerance"] is not None:
+            raise CommandError("--isotope-errors can't be combined with --gu-tolerance.")
+        if options["jobs"] is not None and options["jobs"] < 1:
+            raise CommandError("--jobs must be at least 1.")
+        if options["max_tasks_per_child"] < 1:
+            raise CommandError("--max-tasks-per-child must be at least 1.")
+        if not paths:
+            raise CommandError(f"No peak lists in {options['directory']}.")
+
+        def progress(result, summary):
+            done = summary.runs + len(summary.failed)
+            if result.error:
+                self.stderr.write(f"[{done}/{len(paths)}] {result.run}: skipped ({result.error})")
+                return
+            seconds = summary.seconds or 1e-9
+            self.stderr.write(
+                f"[{done}/{len(paths)}] {result.run}: {result.peaks} peaks, {result.matches} matches "
+                f"in {result.seconds:.2f} s | {summary.runs / seconds:.1f} runs/s, "
+                f"{summary.peaks / seconds:,.0f} peaks/s, worker peak RSS {result.worker_rss / 2**20:.0f} MiB"
+            )
+
+        try:
+            summary = batch_annotation.annotate_runs(
+                paths,
+                options["output"],
+                field=options["field"],
+                jobs=options["jobs"],
+                max_tasks_per_child=options["max_tasks_per_child"],
+                tag=options["tag"],
+                progress=progress,
+                charges=charges,
+                adducts=adducts,
+                ppm=options["ppm"],
+                gu_tolerance=options["gu_tolerance"],
+                isotope_errors=isotope_errors or None,
+                include_unmatched=not options["matched_only"],
+            )
+        except (OSError, ValueError) as exc:
+            raise CommandError(exc)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Annotated {summary.runs} runs ({summary.peaks} peaks, {summary.matches} matches) "
+                f"in {summary.seconds:.1f} s into {os.path.abspath(options['output'])}"
+                + (f"; {len(summary.failed)} skipped." if summary.failed else ".")
+            )
+        )
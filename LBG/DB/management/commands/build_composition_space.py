@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from DB import composition_mass, composition_space
+
+
+class Command(BaseCommand):
+    help = (
+        "Enumerate every composition within the given bounds and store their "
+        "masses as a sorted, memory-mappable lookup table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--bounds",
+            default="H0-12,N0-8,F0-4,S0-4",
+            help="Per-letter count ranges; letters not listed are fixed at 0 "
+            "(default: H0-12,N0-8,F0-4,S0-4).",
+        )
+        parser.add_argument(
+            "--tag",
+            choices=composition_mass.REDUCING_END_TAGS,
+            default="free",
+            help="Reducing-end group / label (default: free).",
+        )
+        parser.add_argument(
+            "--derivatization",
+            choices=composition_mass.DERIVATIZATIONS,
+            default="none",
+            help="Derivatization applied to the residues (default: none).",
+        )
+        parser.add_argument(
+            "-o",
+            "--output",
+            help="Directory to write the table to (default: CACHE_DIR/composition_space).",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            bounds = composition_space.parse_bounds(options["bounds"])
+        except ValueError as exc:
+            raise CommandError(exc)
+        path = options["output"] or composition_space.default_path()
+
+        started = time.perf_counter()
+        space = composition_space.build_space(
+            path, bounds, tag=options["tag"], derivatization=options["derivatization"]
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(f"Wrote {len(space)} compositions to {path} in {elapsed:.2f} s.")
+        )
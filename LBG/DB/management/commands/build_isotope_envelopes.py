@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from DB import composition_mass, isotopes
+
+
+class Command(BaseCommand):
+    help = (
+        "Precompute the isotope envelope of every monosaccharide composition into "
+        "a memory-mappable table (CACHE_DIR/isotopes) used by isotope-aware peak "
+        "annotation. Run again after editing composition counts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--tag",
+            choices=composition_mass.REDUCING_END_TAGS,
+            default="free",
+            help="Reducing-end group / label (default: free).",
+        )
+        parser.add_argument(
+            "--derivatization",
+            choices=composition_mass.DERIVATIZATIONS,
+            default="none",
+            help="Derivatization applied to the residues (default: none).",
+        )
+
+    def handle(self, *args, **options):
+        table = isotopes.build_table(options["tag"], options["derivatization"])
+        isotopes.reset_tables()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Stored {len(table)} envelopes ({isotopes.PEAKS} peaks each) in "
+                f"{isotopes.table_path(options['tag'], options['derivatization'])}."
+            )
+        )
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from DB import motif_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Store the substructure fingerprint of every glycan WURCS that has none "
+        "yet (saved glycans get theirs automatically; bulk loads don't). Use "
+        "--force after changing the fingerprint features."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Recompute fingerprints that are already stored.")
+
+    def handle(self, *args, **options):
+        stored, unparsable = motif_index.backfill(force=options["force"])
+        self.stdout.write(self.style.SUCCESS(f"Stored {stored} fingerprints ({unparsable} unparsable WURCS)."))
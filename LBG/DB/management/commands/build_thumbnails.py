@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from DB import thumbnails
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the WebP/PNG thumbnails for glycan images that don't have them "
+        "yet (new uploads get theirs automatically). Use --force to re-check "
+        "every image, e.g. after changing thumbnails.SIZES."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("-j", "--jobs", type=int, default=4, help="Images rendered in parallel (default 4).")
+        parser.add_argument("--force", action="store_true", help="Re-check images that already have a digest.")
+
+    def handle(self, *args, **options):
+        def progress(name, digest):
+            if digest is None:
+                self.stderr.write(f"Skipped {name}: missing or not a raster image.")
+            elif options["verbosity"] > 1:
+                self.stdout.write(f"{name} -> {digest[:12]}")
+
+        rendered, skipped = thumbnails.backfill(jobs=options["jobs"], force=options["force"], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Thumbnailed {rendered} images ({skipped} skipped)."))
@@ -0,0 +1,93 @@
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from DB import composition_mass, glycan_search, table_versions
+from DB.models import COMPOSITION_FIELDS, Glycan
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute Glycan.theoretical_mass from each glycan's monosaccharide "
+        "composition, in bulk. Fills in missing values by default."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--tag",
+            choices=composition_mass.REDUCING_END_TAGS,
+            default="free",
+            help="Reducing-end group / label (default: free).",
+        )
+        parser.add_argument(
+            "--derivatization",
+            choices=composition_mass.DERIVATIZATIONS,
+            default="none",
+            help="Derivatization applied to the residues (default: none).",
+        )
+        parser.add_argument("--average", action="store_true", help="Use average instead of monoisotopic masses.")
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report glycans whose stored theoretical_mass disagrees; write nothing.",
+        )
+        parser.add_argument("--overwrite", action="store_true", help="Replace existing values too.")
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=10.0,
+            help="Agreement tolerance in ppm for --check / --overwrite (default: 10).",
+        )
+
+    def handle(self, *args, **options):
+        rows = list(
+            Glycan.objects.filter(monosaccharide_comp__isnull=False)
+            .order_by("id")
+            .values_list(
+                "id",
+                "theoretical_mass",
+                *(f"monosaccharide_comp__{field}" for field in COMPOSITION_FIELDS),
+            )
+        )
+        if not rows:
+            self.stdout.write("No glycans with a monosaccharide composition.")
+            return
+
+        ids = [row[0] for row in rows]
+        stored = np.array([np.nan if row[1] is None else row[1] for row in rows])
+        computed = composition_mass.composition_masses(
+            [row[2:] for row in rows],
+            tag=options["tag"],
+            derivatization=options["derivatization"],
+            average=options["average"],
+        )
+        with np.errstate(invalid="ignore"):
+            disagree = np.abs(stored - computed) / computed * 1e6 > options["tolerance"]
+        missing = np.isnan(stored)
+
+        if options["check"]:
+            for i in np.flatnonzero(disagree):
+                self.stdout.write(
+                    f"{ids[i]}: stored {stored[i]:.4f}, computed {computed[i]:.4f} "
+                    f"({(stored[i] - computed[i]) / computed[i] * 1e6:+.1f} ppm)"
+                )
+            self.stdout.write(
+                f"{len(ids)} glycans checked: {int(disagree.sum())} disagree, "
+                f"{int(missing.sum())} have no theoretical mass."
+            )
+            return
+
+        update = missing | (disagree if options["overwrite"] else False)
+        glycans = [
+            Glycan(id=ids[i], theoretical_mass=round(float(computed[i]), 6))
+            for i in np.flatnonzero(update)
+        ]
+        with transaction.atomic():
+            Glycan.objects.bulk_update(glycans, ["theoretical_mass"], batch_size=1000)
+            # bulk_update bypasses the save signals that maintain the search
+            # table and the table versions; the in-memory indexes of every
+            # process reload once they see the new Glycan version.
+            glycan_search.refresh(glycan.pk for glycan in glycans)
+            if glycans:
+                table_versions.bump(Glycan._meta.db_table)
+        self.stdout.write(self.style.SUCCESS(f"Updated theoretical_mass for {len(glycans)} glycans."))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from DB import text_search
+
+
+class Command(BaseCommand):
+    help = (
+        "Install pg_trgm and create the trigram indexes behind the admin search "
+        "boxes. Migration 0014 does this automatically; run it if the extension "
+        "was only installed on the server afterwards."
+    )
+
+    def handle(self, *args, **options):
+        names = text_search.create_trigram_indexes(connection)
+        if names is None:
+            raise CommandError("This PostgreSQL server does not provide the pg_trgm extension.")
+        self.stdout.write(self.style.SUCCESS(f"{len(names)} trigram indexes in place."))
@@ -0,0 +1,54 @@
+import os
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from DB import bulk_export
+
+
+class Command(BaseCommand):
+    help = (
+        "Export every table in the database from one consistent snapshot: "
+        "tables are COPY'd in parallel on connections that share a REPEATABLE "
+        "READ snapshot, streamed to compressed CSV (or Parquet for large "
+        "tables), and listed in a manifest.json with row counts and checksums."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "output_dir",
+            nargs="?",
+            help="Output directory (default: ./exports/<timestamp>).",
+        )
+        parser.add_argument("--table", action="append", dest="tables", help="Only export this table (repeatable).")
+        parser.add_argument("-j", "--jobs", type=int, default=4, help="Parallel connections (default: 4).")
+        parser.add_argument(
+            "--compression",
+            choices=bulk_export.COMPRESSIONS,
+            default="gzip",
+            help="CSV compression (default: gzip; zstd needs the 'zstandard' package).",
+        )
+        parser.add_argument(
+            "--parquet-rows",
+            type=int,
+            help="Write tables with at least this many rows as Parquet (needs 'pyarrow').",
+        )
+
+    def handle(self, *args, **options):
+        output_dir = options["output_dir"] or os.path.join(
+            "exports", datetime.now().strftime("%Y%m%d-%H%M%S")
+        )
+        try:
+            manifest = bulk_export.export(
+                output_dir,
+                tables=options["tables"],
+                jobs=options["jobs"],
+                compression=options["compression"],
+                parquet_rows=options["parquet_rows"],
+                report=self.stdout.write,
+            )
+        except ValueError as exc:
+            raise CommandError(exc)
+        self.stdout.write(
+            self.style.SUCCESS(f"Exported {len(manifest['tables'])} tables to {os.path.abspath(output_dir)}.")
+        )
@@ -0,0 +1,82 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from DB import bulk_load, csv_schema, glycan_search, motif_index, table_versions
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream CSV exports into the database with COPY: FK-ordered, parallel "
+        "across independent tables, upserting into non-empty tables, and "
+        "resumable from a per-table checkpoint. CSVs exported from older "
+        "schema versions are remapped to the current columns on the fly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "csv_dir",
+            nargs="?",
+            default="csv_exports",
+            help="Directory of <table>.csv files (default: ./csv_exports).",
+        )
+        parser.add_argument(
+            "--app",
+            action="append",
+            dest="apps",
+            help="Only load tables of this app (repeatable; default: DB).",
+        )
+        parser.add_argument("--table", action="append", dest="tables", help="Only load this table (repeatable).")
+        parser.add_argument("-j", "--jobs", type=int, default=4, help="Parallel connections (default: 4).")
+        parser.add_argument(
+            "--checkpoint",
+            help="Checkpoint file (default: CACHE_DIR/lbg_load_checkpoint.json).",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore any existing checkpoint and load every table again.",
+        )
+
+    def handle(self, *args, **options):
+        csv_dir = options["csv_dir"]
+        if not os.path.isdir(csv_dir):
+            raise CommandError(f"CSV directory not found: {os.path.abspath(csv_dir)}")
+        try:
+            levels, skipped = bulk_load.plan(
+                csv_dir, app_labels=set(options["apps"] or ["DB"]), only=options["tables"]
+            )
+        except ValueError as exc:
+            raise CommandError(exc)
+        for name in skipped:
+            self.stdout.write(f"{name}: no matching table, skipping.")
+
+        checkpoint_path = options["checkpoint"] or bulk_load.default_checkpoint_path()
+        os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+        checkpoint = bulk_load.Checkpoint(checkpoint_path)
+        if options["restart"]:
+            checkpoint.clear()
+
+        for depth, level in enumerate(levels):
+            self.stdout.write(f"Level {depth}: {', '.join(load.table for load in level)}")
+        failures = bulk_load.run(
+            levels,
+            checkpoint,
+            jobs=options["jobs"],
+            columns_for=csv_schema.columns_for,
+            report=self.stdout.write,
+        )
+        if failures:
+            raise CommandError(
+                f"{len(failures)} table(s) failed; fix them and re-run to resume from the checkpoint."
+            )
+        checkpoint.clear()
+        # COPY bypasses the signals that maintain the table versions (which
+        # also key the facet cache), the search table and the motif fingerprints.
+        table_versions.bump(*(load.table for level in levels for load in level))
+        if any(load.model._meta.app_label == "DB" for level in levels for load in level):
+            rows = glycan_search.rebuild()
+            self.stdout.write(f"Rebuilt {rows} glycan search rows.")
+            stored, _ = motif_index.backfill()
+            self.stdout.write(f"Stored {stored} motif fingerprints.")
+        self.stdout.write(self.style.SUCCESS("All tables loaded."))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+
+from DB import storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Move glycan structure images stored under their upload names to "
+        "content-addressed names (images/<sha256[:2]>/<sha256>.<ext>), merging "
+        "identical files and updating the glycans that use them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Report what would change without touching anything.")
+        parser.add_argument(
+            "--prune",
+            action="store_true",
+            help="Also delete files under images/ that no glycan references.",
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+
+        def progress(name, target):
+            if target is None:
+                self.stderr.write(f"Missing file: {name}")
+            elif options["verbosity"] > 1:
+                self.stdout.write(f"{name} -> {target}")
+
+        stats = storage.migrate_existing(dry_run=dry_run, progress=progress)
+        verb = "Would move" if dry_run else "Moved"
+        self.stdout.write(
+            f"{verb} {stats['files']} files ({stats['rows']} glycans): "
+            f"{stats['bytes_before']} bytes -> {stats['bytes_after']} bytes after deduplication"
+            + (f", {stats['missing']} missing" if stats["missing"] else "")
+            + "."
+        )
+
+        if options["prune"]:
+            orphans = storage.unreferenced_files()
+            image_storage = storage.glycan_image_storage()
+            kept = 0
+            for name in orphans:
+                if options["verbosity"] > 1:
+                    self.stdout.write(f"Unreferenced: {name}")
+                if not dry_run:
+                    image_storage.delete(name)
+                    kept += image_storage.exists(name)  # used within the grace period
+            self.stdout.write(
+                f"{'Would delete' if dry_run else 'Deleted'} {len(orphans) - kept} unreferenced files"
+                + (f", kept {kept} used in the last {image_storage.grace}s" if kept else "")
+                + "."
+            )
+        self.stdout.write(self.style.SUCCESS("Done."))
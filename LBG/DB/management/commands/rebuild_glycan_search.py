@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from DB import glycan_search
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the denormalised GlycanSearch table from scratch. Normal edits "
+        "keep it up to date automatically; run this after migrating or after "
+        "writing to the source tables outside the ORM."
+    )
+
+    def handle(self, *args, **options):
+        rows = glycan_search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} glycan search rows."))
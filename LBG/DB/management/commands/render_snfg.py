@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from DB import snfg
+from DB.models import Glycan
+
+
+class Command(BaseCommand):
+    help = (
+        "Draw the SNFG image of every glycan with a WURCS into the render cache "
+        "(CACHE_DIR/snfg), so the first page view doesn't have to. Drawings "
+        "already cached are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes (default: one per CPU).")
+        parser.add_argument(
+            "--format",
+            action="append",
+            choices=sorted(snfg.FORMATS),
+            dest="formats",
+            help="Format to render; repeat for several (default svg).",
+        )
+
+    def handle(self, *args, **options):
+        formats = options["formats"] or ["svg"]
+        wurcs = sorted(set(Glycan.objects.exclude(wurcs="").exclude(wurcs__isnull=True).values_list("wurcs", flat=True)))
+        if options["jobs"] is not None and options["jobs"] < 1:
+            raise CommandError("--jobs must be at least 1.")
+
+        def progress(text, fmt, error):
+            if error:
+                self.stderr.write(f"Cannot draw {text[:60]}...: {error}")
+            elif options["verbosity"] > 1:
+                self.stdout.write(f"{fmt}: {text[:60]}")
+
+        errors = snfg.render_all(wurcs, formats=formats, jobs=options["jobs"], progress=progress)
+        done = len(wurcs) * len(formats) - len(errors)
+        self.stdout.write(self.style.SUCCESS(f"Rendered {done} drawings ({len(errors)} failed)."))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from DB import xrefs
+from DB.models import RegistryEntry
+
+
+class Command(BaseCommand):
+    help = (
+        "Load a GlyTouCan, GlyCosmos or GlyConnect dump file (CSV/TSV, optionally "
+        ".gz/.zst) into the local registry mirror, replacing that registry's "
+        "previous import. Run xref_sync afterwards to fill in glycan IDs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("registry", choices=[key for key, _ in RegistryEntry.REGISTRIES])
+        parser.add_argument("path", help="Dump file with a header row (see DB/xrefs.py for the columns).")
+
+    def handle(self, *args, **options):
+        try:
+            rows = xrefs.import_dump(options["registry"], options["path"])
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f"Mirrored {rows} {options['registry']} entries."))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from DB import xrefs
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill in missing GlyTouCan/GlyCosmos/GlyConnect IDs, WURCS and compositions "
+        "on every glycan from the local registry mirror (see xref_import), in one "
+        "set-based pass. Existing values are never overwritten."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be filled in without saving it.")
+
+    def handle(self, *args, **options):
+        filled = xrefs.sync(dry_run=options["dry_run"])
+        verb = "Would fill" if options["dry_run"] else "Filled"
+        for field, count in filled.items():
+            self.stdout.write(f"{verb} {field} on {count} glycans.")
+        self.stdout.write(self.style.SUCCESS(f"{verb} {sum(filled.values())} fields."))
@@ -0,0 +1,190 @@
+"""
+In-memory mass search index over `Glycan.mass` / `Glycan.theoretical_mass`.
+
+Every glycan with a value for the indexed field is held in a sorted NumPy
+array, along with its composition id, so a tolerance query ("everything within ±10 ppm of m/z X") is just two
+`searchsorted` calls instead of an ORM round trip.
+
+The index is loaded lazily once per process and remembers the `Glycan`
+table version (table_versions.py) it was built from. Within the writing
+process the `Glycan` post_save/post_delete signals (see `signals.py`) patch
+the loaded index on commit, inserting or removing a single entry, and move
+its version on to the one their write created. `get_index()` compares the
+index's version with the current one (read at most once a second, see
+`table_versions.recent_version()`) and reloads only when they differ, i.e.
+after writes from other workers or management commands. Writes that skip
+signals (`QuerySet.update()`, `bulk_create()`, raw COPY loads) must
+`table_versions.bump()` the table.
+"""
+
+import threading
+
+import numpy as np
+
+from . import table_versions
+from .models import Glycan
+
+# Glycan fields that can be searched by mass.
+MASS_FIELDS = ("mass", "theoretical_mass")
+
+
+def tolerance_window(mz, ppm=None, da=None):
+    """
+    Return the (low, high) mass bounds for a query value.
+
+    Exactly one of `ppm` / `da` must be given. Works element-wise when `mz`
+    is an array.
+    """
+    if (ppm is None) == (da is None):
+        raise ValueError("Give exactly one of ppm or da.")
+    mz = np.asarray(mz, dtype=np.float64)
+    delta = mz * ppm * 1e-6 if ppm is not None else np.full_like(mz, da)
+    return mz - delta, mz + delta
+
+
+def _composition_id(composition_id=None):
+    return -1 if composition_id is None else composition_id
+
+
+class MassIndex:
+    """Sorted, array-backed index of glycan IDs by one mass field."""
+
+    def __init__(self, field):
+        if field not in MASS_FIELDS:
+            raise ValueError(f"Unknown mass field: {field!r}")
+        self.field = field
+        # (masses, ids, composition_ids) are replaced together, never mutated
+        # in place, so readers can search a consistent snapshot without taking
+        # the lock. Glycans without a composition have composition id -1.
+        self._arrays = (np.empty(0, dtype=np.float64), np.empty(0, dtype=object), np.empty(0, dtype=np.int64))
+        self._by_id = {}
+        self._lock = threading.Lock()
+        self.version = None  # Glycan table version loaded, set by get_index()
+
+    def __len__(self):
+        return len(self._arrays[0])
+
+    def load(self, rows=None):
+        """
+        (Re)build the index from `(glycan_id, mass)` or
+        `(glycan_id, mass, composition_id)` rows, or from the DB.
+        """
+        if rows is None:
+            rows = (
+                Glycan.objects.filter(**{f"{self.field}__isnull": False})
+                .values_list("id", self.field, "monosaccharide_comp_id")
+            )
+        by_id, compositions = {}, {}
+        for glycan_id, mass, *composition_id in rows:
+            if mass is not None:
+                by_id[glycan_id] = float(mass)
+                compositions[glycan_id] = _composition_id(*composition_id)
+        ids = np.array(list(by_id), dtype=object)
+        masses = np.fromiter(by_id.values(), dtype=np.float64, count=len(by_id))
+        composition_ids = np.fromiter(compositions.values(), dtype=np.int64, count=len(by_id))
+        order = np.argsort(masses, kind="stable")
+        with self._lock:
+            self._by_id = by_id
+            self._arrays = (masses[order], ids[order], composition_ids[order])
+        return self
+
+    def snapshot(self):
+        """Return the current `(masses, ids)` arrays, sorted by mass."""
+        return self._arrays[:2]
+
+    def library(self):
+        """Return the current `(masses, ids, composition_ids)` arrays, sorted by mass."""
+        return self._arrays
+
+    # -- incremental maintenance ------------------------------------------
+    def _remove_locked(self, arrays, glycan_id):
+        old = self._by_id.pop(glycan_id, None)
+        if old is None:
+            return arrays
+        masses, ids, _ = arrays
+        lo = np.searchsorted(masses, old, side="left")
+        hi = np.searchsorted(masses, old, side="right")
+        pos = lo + int(np.flatnonzero(ids[lo:hi] == glycan_id)[0])
+        return tuple(np.delete(a, pos) for a in arrays)
+
+    def upsert(self, glycan_id, mass, composition_id=None):
+        """Insert, move or (when `mass` is None) drop a single glycan."""
+        with self._lock:
+            masses, ids, composition_ids = self._remove_locked(self._arrays, glycan_id)
+            if mass is not None:
+                mass = float(mass)
+                pos = np.searchsorted(masses, mass, side="right")
+                masses = np.insert(masses, pos, mass)
+                ids = np.insert(ids, pos, glycan_id)
+                composition_ids = np.insert(composition_ids, pos, _composition_id(composition_id))
+                self._by_id[glycan_id] = mass
+            self._arrays = (masses, ids, composition_ids)
+
+    def remove(self, glycan_id):
+        with self._lock:
+            self._arrays = self._remove_locked(self._arrays, glycan_id)
+
+    # -- queries ------------------------------------------------------------
+    def bounds(self, mz, ppm=None, da=None):
+        """
+        Vectorised lookup: return `(start, stop)` index arrays into
+        `snapshot()` for every query value in `mz`.
+        """
+        masses = self._arrays[0]
+        low, high = tolerance_window(mz, ppm=ppm, da=da)
+        return (
+            np.searchsorted(masses, low, side="left"),
+            np.searchsorted(masses, high, side="right"),
+        )
+
+    def search(self, mz, ppm=None, da=None):
+        """
+        Return every glycan within tolerance of a single `mz`, nearest first,
+        as a list of `(glycan_id, mass, error_da, error_ppm)` tuples.
+        """
+        masses, ids, _ = self._arrays
+        start, stop = self.bounds(mz, ppm=ppm, da=da)
+        hits = masses[start:stop]
+        errors = hits - mz
+        order = np.argsort(np.abs(errors), kind="stable")
+        return [
+            (ids[start + i], float(hits[i]), float(errors[i]), float(errors[i] / mz * 1e6))
+            for i in order
+        ]
+
+
+# ---------------------------------------------------------------------------
+# Per-process registry
+# ---------------------------------------------------------------------------
+_indexes = {}
+_registry_lock = threading.Lock()
+
+
+def get_index(field="mass"):
+    """
+    Return the process-wide index for `field`, loading it on first use and
+    reloading it whenever the Glycan table version has moved on.
+    """
+    version = table_versions.recent_version(Glycan._meta.db_table)
+    index = _indexes.get(field)
+    if index is None or index.version != version:
+        with _registry_lock:
+            index = _indexes.get(field)
+            if index is None or index.version != version:
+                # The version is read before loading: a write that lands
+                # meanwhile is loaded again on the next call, never missed.
+                index = MassIndex(field).load()
+                index.version = version
+                _indexes[field] = index
+    return index
+
+
+def loaded_indexes():
+    """Indexes that have already been built in this process."""
+    return list(_indexes.values())
+
+
+def reset_indexes():
+    """Drop all loaded indexes; they are rebuilt on next use."""
+    with _registry_lock:
+        _indexes.clear()
@@ -0,0 +1,97 @@
+# Generated by Django 6.0.6 on 2026-10-18 19:33
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Fill the new table from the existing data, so search works straight after
+# migrating. The SQL is frozen at this migration's schema (it must not follow
+# later changes to glycan_search.py); `rebuild_glycan_search` does the same
+# with the current code.
+COUNT_COLUMNS = ("H_num", "N_num", "F_num", "P_num", "T_num", "G_num", "S_num", "E_num", "M_num")
+
+
+def backfill(apps, schema_editor):
+    q = schema_editor.quote_name
+    t = {name: q(apps.get_model("DB", name)._meta.db_table) for name in (
+        "Glycan", "GlycanSearch", "MonosaccharideComposition", "ModelSpecies", "Tissue", "OntogenicStage", "Study",
+    )}
+    Glycan = apps.get_model("DB", "Glycan")
+    species_m2m = q(Glycan.model_species.through._meta.db_table)
+    studies_m2m = q(Glycan.studies.through._meta.db_table)
+
+    def species_array(expression, joins=""):
+        return (
+            f"ARRAY(SELECT DISTINCT {expression} FROM {species_m2m} gm "
+            f"JOIN {t['ModelSpecies']} ms ON ms.id = gm.modelspecies_id {joins}"
+            f"WHERE gm.glycan_id = g.id AND {expression} <> '' ORDER BY 1)"
+        )
+
+    columns = ", ".join(q(c) for c in (
+        "glycan_id", "composition_string", *COUNT_COLUMNS, "mass", "theoretical_mass", "gu_mean", "gu_min",
+        "gu_max", "brain_specific", "species_names", "taxids", "tissues", "stages", "study_dois",
+    ))
+    schema_editor.execute(f"""
+        INSERT INTO {t['GlycanSearch']} ({columns})
+        SELECT
+            g.id,
+            COALESCE(c.composition_string, ''),
+            {", ".join(f"c.{q(column)}" for column in COUNT_COLUMNS)},
+            g.mass, g.theoretical_mass, g.gu_mean, g.gu_min, g.gu_max, g.brain_specific,
+            {species_array("ms.species_name")},
+            {species_array("COALESCE(NULLIF(ms.species_taxid, ''), ms.taxid)")},
+            {species_array("concat_ws(' - ', NULLIF(ti.organ, ''), NULLIF(ti.structure, ''))",
+                           f"JOIN {t['Tissue']} ti ON ti.id = ms.tissue_id ")},
+            {species_array("st.stage", f"JOIN {t['OntogenicStage']} st ON st.id = ms.stage_id ")},
+            ARRAY(
+                SELECT DISTINCT s.doi FROM {studies_m2m} gs JOIN {t['Study']} s ON s.id = gs.study_id
+                WHERE gs.glycan_id = g.id AND s.doi IS NOT NULL AND s.doi <> '' ORDER BY 1
+            )
+        FROM {t['Glycan']} g
+        LEFT JOIN {t['MonosaccharideComposition']} c ON c.id = g.monosaccharide_comp_id
+    """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DB', '0008_ontogenicstage_tissue_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GlycanSearch',
+            fields=[
+                ('glycan', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search', serialize=False, to='DB.glycan')),
+                ('composition_string', models.CharField(blank=True, max_length=255)),
+                ('H_num', models.PositiveIntegerField(null=True)),
+                ('N_num', models.PositiveIntegerField(null=True)),
+                ('F_num', models.PositiveIntegerField(null=True)),
+                ('P_num', models.PositiveIntegerField(null=True)),
+                ('T_num', models.PositiveIntegerField(null=True)),
+                ('G_num', models.PositiveIntegerField(null=True)),
+                ('S_num', models.PositiveIntegerField(null=True)),
+                ('E_num', models.PositiveIntegerField(null=True)),
+                ('M_num', models.PositiveIntegerField(null=True)),
+                ('mass', models.FloatField(null=True)),
+                ('theoretical_mass', models.FloatField(null=True)),
+                ('gu_mean', models.FloatField(null=True)),
+                ('gu_min', models.FloatField(null=True)),
+                ('gu_max', models.FloatField(null=True)),
+                ('brain_specific', models.BooleanField(default=False)),
+                ('species_names', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list)),
+                ('taxids', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list)),
+                ('tissues', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list)),
+                ('stages', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list)),
+                ('study_dois', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list)),
+            ],
+            options={
+                'verbose_name': 'Glycan search row',
+                'verbose_name_plural': 'Glycan search rows',
+                'indexes': [models.Index(fields=['mass'], name='glycansearch_mass_idx'), models.Index(fields=['theoretical_mass'], name='glycansearch_theo_mass_idx'), models.Index(fields=['gu_mean'], name='glycansearch_gu_mean_idx'), models.Index(fields=['composition_string'], name='glycansearch_comp_idx'), django.contrib.postgres.indexes.GinIndex(fields=['species_names'], name='glycansearch_species_gin'), django.contrib.postgres.indexes.GinIndex(fields=['tissues'], name='glycansearch_tissues_gin'), django.contrib.postgres.indexes.GinIndex(fields=['study_dois'], name='glycansearch_dois_gin')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 6.0.6 on 2026-10-18 19:39
+
+from django.db import migrations, models
+
+# Keep in step with DB/glycan_ids.py (encode() mirrors lbg_encode_glycan_id).
+CREATE_ALLOCATOR = """
+CREATE SEQUENCE lbg_glycan_id_seq MINVALUE 0 MAXVALUE 60466175 START 0 NO CYCLE;
+
+CREATE FUNCTION lbg_encode_glycan_id(n bigint) RETURNS text
+LANGUAGE plpgsql IMMUTABLE STRICT PARALLEL SAFE AS $$
+DECLARE
+    space constant bigint := 60466176;  -- 36^5
+    alphabet constant text := 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789';
+    x bigint := n;
+    code text := '';
+BEGIN
+    x := (44696359 * x + 39110241) % space;
+    x := (x % 36) * 1679616 + x / 36;
+    x := (24047633 * x + 34053435) % space;
+    x := (x % 36) * 1679616 + x / 36;
+    x := (22671683 * x + 5767821) % space;
+    FOR i IN 1..5 LOOP
+        code := substr(alphabet, (x % 36)::int + 1, 1) || code;
+        x := x / 36;
+    END LOOP;
+    RETURN code;
+END
+$$;
+
+CREATE FUNCTION lbg_next_glycan_id() RETURNS varchar
+LANGUAGE plpgsql VOLATILE AS $$
+DECLARE
+    candidate varchar;
+BEGIN
+    LOOP
+        candidate := 'LBG-' || lbg_encode_glycan_id(nextval('lbg_glycan_id_seq'));
+        -- Skip codes already taken by legacy (randomly generated) IDs.
+        EXIT WHEN NOT EXISTS (SELECT 1 FROM "DB_glycan" WHERE id = candidate);
+    END LOOP;
+    RETURN candidate;
+END
+$$;
+"""
+
+DROP_ALLOCATOR = """
+DROP FUNCTION lbg_next_glycan_id();
+DROP FUNCTION lbg_encode_glycan_id(bigint);
+DROP SEQUENCE lbg_glycan_id_seq;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DB', '0010_tableversion'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_ALLOCATOR, DROP_ALLOCATOR),
+        migrations.AlterField(
+            model_name='glycan',
+            name='id',
+            field=models.CharField(db_default=models.Func(function='lbg_next_glycan_id', output_field=models.CharField()), editable=False, max_length=9, primary_key=True, serialize=False, unique=True),
+        ),
+    ]
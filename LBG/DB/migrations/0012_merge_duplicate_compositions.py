@@ -0,0 +1,35 @@
+# Generated by Django 6.0.6 on 2026-10-18 19:42
+
+from django.db import migrations
+
+# Point glycans at the lowest-id copy of each duplicated composition, then
+# delete the other copies, so the unique constraint can be added.
+MERGE_DUPLICATES = """
+WITH ranked AS (
+    SELECT id, MIN(id) OVER (
+        PARTITION BY "H_num", "N_num", "F_num", "P_num", "T_num", "G_num", "S_num", "E_num", "M_num"
+    ) AS keep
+    FROM "DB_monosaccharidecomposition"
+)
+UPDATE "DB_glycan" g SET monosaccharide_comp_id = r.keep
+FROM ranked r WHERE g.monosaccharide_comp_id = r.id AND r.id <> r.keep;
+
+WITH ranked AS (
+    SELECT id, MIN(id) OVER (
+        PARTITION BY "H_num", "N_num", "F_num", "P_num", "T_num", "G_num", "S_num", "E_num", "M_num"
+    ) AS keep
+    FROM "DB_monosaccharidecomposition"
+)
+DELETE FROM "DB_monosaccharidecomposition" c USING ranked r WHERE c.id = r.id AND r.id <> r.keep;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DB', '0011_glycan_id_allocator'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MERGE_DUPLICATES, migrations.RunSQL.noop),
+    ]
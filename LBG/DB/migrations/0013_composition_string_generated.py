@@ -0,0 +1,29 @@
+# Generated by Django 6.0.6 on 2026-10-18 19:42
+
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DB', '0012_merge_duplicate_compositions'),
+    ]
+
+    operations = [
+        # A column can't be altered into a generated one: drop and re-add it.
+        migrations.RemoveField(
+            model_name='monosaccharidecomposition',
+            name='composition_string',
+        ),
+        migrations.AddField(
+            model_name='monosaccharidecomposition',
+            name='composition_string',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.text.Concat(models.Case(models.When(H_num__gt=0, then=django.db.models.functions.text.Concat(models.Value('H'), django.db.models.functions.comparison.Cast('H_num', models.TextField()), output_field=models.TextField())), default=models.Value(''), output_field=models.TextField()), models.Case(models.When(N_num__gt=0, then=django.db.models.functions.text.Concat(models.Value('N'), django.db.models.functions.comparison.Cast('N_num', models.TextField()), output_field=models.TextField())), default=models.Value(''), output_field=models.TextField()), models.Case(models.When(F_num__gt=0, then=django.db.models.functions.text.Concat(models.Value('F'), django.db.models.functions.comparison.Cast('F_num', models.TextField()), output_field=models.TextField())), default=models.Value(''), output_field=models.TextField()), models.Case(models.When(P_num__gt=0, then=django.db.models.functions.text.Concat(models.Value('P'), django.db.models.functions.comparison.Cast('P_num', models.TextField()), output_field=models.TextField())), default=models.Value(''), output_field=models.TextField()), models.Case(models.When(T_num__gt=0, then=django.db.models.functions.text.Concat(models.Value('T'), django.db.models.functions.comparison.Cast('T_num', models.TextField()), output_field=models.TextField())), default=models.Value(''), output_field=models.TextField()), models.Case(models.When(G_num__gt=0, then=django.db.models.functions.text.Concat(models.Value('G'), django.db.models.functions.comparison.Cast('G_num', models.TextField()), output_field=models.TextField())), default=models.Value(''), output_field=models.TextField()), models.Case(models.When(S_num__gt=0, then=django.db.models.functions.text.Concat(models.Value('S'), django.db.models.functions.comparison.Cast('S_num', models.TextField()), output_field=models.TextField())), default=models.Value(''), output_field=models.TextField()), models.Case(models.When(E_num__gt=0, then=django.db.models.functions.text.Concat(models.Value('E'), django.db.models.functions.comparison.Cast('E_num', models.TextField()), output_field=models.TextField())), default=models.Value(''), output_field=models.TextField()), models.Case(models.When(M_num__gt=0, then=django.db.models.functions.text.Concat(models.Value('M'), django.db.models.functions.comparison.Cast('M_num', models.TextField()), output_field=models.TextField())), default=models.Value(''), output_field=models.TextField()), output_field=models.TextField()), output_field=models.CharField(max_length=255)),
+        ),
+        migrations.AddConstraint(
+            model_name='monosaccharidecomposition',
+            constraint=models.UniqueConstraint(fields=('H_num', 'N_num', 'F_num', 'P_num', 'T_num', 'G_num', 'S_num', 'E_num', 'M_num'), name='unique_composition_counts'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 6.0.6 on 2026-10-18 19:48
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+# Frozen copies of text_search.TRIGRAM_COLUMNS and its index helpers at this
+# migration, so later changes to text_search.py can't change what it does.
+TRIGRAM_COLUMNS = [
+    ('DB_tissue', 'organ'),
+    ('DB_tissue', 'structure'),
+    ('DB_tissue', 'uberon_id'),
+    ('DB_ontogenicstage', 'stage'),
+    ('DB_ontogenicstage', 'age'),
+    ('DB_modelspecies', 'species_name'),
+    ('DB_modelspecies', 'species_taxid'),
+    ('DB_modelspecies', 'taxid'),
+    ('DB_monosaccharidecomposition', 'composition_string'),
+    ('DB_lastauthor', 'full_name'),
+    ('DB_lastauthor', 'affiliation'),
+    ('DB_study', 'title'),
+    ('DB_study', 'journal'),
+    ('DB_study', 'doi'),
+    ('DB_glycan', 'glytoucan_id'),
+    ('DB_glycan', 'glycosmos_id'),
+    ('DB_glycan', 'glyconnect_id'),
+]
+
+
+def trigram_index_name(table, column):
+    return f"{table}_{column}_trgm".lower()
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # Optional: servers built without the contrib extensions skip these indexes.
+    # Search still works, only unindexed. See `manage.py create_trigram_indexes`.
+    q = schema_editor.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for table, column in TRIGRAM_COLUMNS:
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {q(trigram_index_name(table, column))} ON {q(table)} "
+                f"USING gin ((UPPER({q(column)}::text)) gin_trgm_ops)"
+            )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    q = schema_editor.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        for table, column in TRIGRAM_COLUMNS:
+            cursor.execute(f"DROP INDEX IF EXISTS {q(trigram_index_name(table, column))}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DB', '0013_composition_string_generated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='study',
+            name='search_vector',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.SearchVector('title', config='english'), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        migrations.AddIndex(
+            model_name='study',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='study_search_vector_gin'),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.6 on 2026-10-18 19:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DB', '0014_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='glycan',
+            name='image_digest',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.6 on 2026-10-18 19:53
+
+import DB.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DB', '0015_glycan_image_digest'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='glycan',
+            name='graphical_structure',
+            field=models.ImageField(blank=True, null=True, storage=DB.storage.structure_image_storage, upload_to='images/'),
+        ),
+    ]
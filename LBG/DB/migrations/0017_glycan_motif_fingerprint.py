@@ -0,0 +1,18 @@
+# Generated by Django 6.0.6 on 2026-10-18 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DB', '0016_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='glycan',
+            name='motif_fingerprint',
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 6.0.6 on 2026-10-18 20:03
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DB', '0017_glycan_motif_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistryEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('registry', models.CharField(choices=[('glytoucan', 'GlyTouCan'), ('glycosmos', 'GlyCosmos'), ('glyconnect', 'GlyConnect')], max_length=16)),
+                ('accession', models.CharField(max_length=64)),
+                ('glytoucan_id', models.CharField(blank=True, max_length=64)),
+                ('wurcs', models.TextField(blank=True)),
+                ('composition_string', models.CharField(blank=True, max_length=255)),
+            ],
+            options={
+                'verbose_name': 'Registry entry',
+                'verbose_name_plural': 'Registry entries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='glycan',
+            index=models.Index(fields=['glytoucan_id'], name='glycan_glytoucan_id'),
+        ),
+        migrations.AddIndex(
+            model_name='glycan',
+            index=models.Index(fields=['glycosmos_id'], name='glycan_glycosmos_id'),
+        ),
+        migrations.AddIndex(
+            model_name='glycan',
+            index=models.Index(fields=['glyconnect_id'], name='glycan_glyconnect_id'),
+        ),
+        migrations.AddIndex(
+            model_name='glycan',
+            index=models.Index(django.db.models.functions.text.MD5('wurcs'), name='glycan_wurcs_md5'),
+        ),
+        migrations.AddIndex(
+            model_name='registryentry',
+            index=models.Index(fields=['glytoucan_id'], name='registry_glytoucan_id'),
+        ),
+        migrations.AddIndex(
+            model_name='registryentry',
+            index=models.Index(django.db.models.functions.text.MD5('wurcs'), name='registry_wurcs_md5'),
+        ),
+        migrations.AddConstraint(
+            model_name='registryentry',
+            constraint=models.UniqueConstraint(fields=('registry', 'accession'), name='unique_registry_accession'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 6.0.6 on 2026-10-18 20:18
+
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DB', '0018_registry_mirror'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sample',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('study', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='samples', to='DB.study')),
+                ('tissue', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='samples', to='DB.tissue')),
+            ],
+            options={
+                'verbose_name': 'Sample',
+                'verbose_name_plural': 'Samples',
+            },
+        ),
+        migrations.CreateModel(
+            name='Measurement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('relative_abundance', models.FloatField(blank=True, null=True)),
+                ('gu_observed', models.FloatField(blank=True, null=True)),
+                ('intensity', models.FloatField(blank=True, null=True)),
+                ('glycan', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='measurements', to='DB.glycan')),
+                ('sample', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='measurements', to='DB.sample')),
+            ],
+            options={
+                'verbose_name': 'Measurement',
+                'verbose_name_plural': 'Measurements',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='sample',
+            constraint=models.UniqueConstraint(fields=('study', 'name'), name='unique_sample_name_per_study'),
+        ),
+        migrations.AddIndex(
+            model_name='measurement',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['sample'], name='measurement_sample_brin'),
+        ),
+        migrations.AddConstraint(
+            model_name='measurement',
+            constraint=models.UniqueConstraint(fields=('glycan', 'sample'), name='unique_measurement_glycan_sample'),
+        ),
+    ]
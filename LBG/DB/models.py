@@ -1,7 +1,11 @@
-import string
-import random
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import BrinIndex, GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import connection, models
+from django.db.models import Case, Value, When
+from django.db.models.functions import MD5, Cast, Concat
 
-from django.db import models
+from .storage import structure_image_storage
 
 
 # ---------------------------------------------------------------------------
@@ -72,6 +76,19 @@ class ModelSpecies(models.Model):
 # ---------------------------------------------------------------------------
 # Glycan-related models
 # ---------------------------------------------------------------------------
+# Monosaccharide letters in the order used for composition strings
+# (each has a matching `<letter>_num` field on MonosaccharideComposition).
+COMPOSITION_LETTERS = ("H", "N", "F", "P", "T", "G", "S", "E", "M")
+COMPOSITION_FIELDS = tuple(f"{letter}_num" for letter in COMPOSITION_LETTERS)
+
+
+def format_composition(counts):
+    """Composition string (e.g. "H5N4F1S2") for counts in COMPOSITION_LETTERS order."""
+    return "".join(
+        f"{letter}{value}" for letter, value in zip(COMPOSITION_LETTERS, counts) if value > 0
+    )
+
+
 class MonosaccharideComposition(models.Model):
     """Composition of a glycan in terms of its monosaccharide content."""
 
@@ -87,35 +104,69 @@ class MonosaccharideComposition(models.Model):
     M_num = models.PositiveIntegerField(default=0)  # Neu5Ac MA (methyl amidation)
     # NOTE: A_num (GlcA) has been removed — it is not present in the new diagram.
 
-    composition_string = models.CharField(
-        max_length=255, editable=False, blank=True
-    )  # Auto-generated composition string
+    # Computed by the database from the counts (e.g. "H5N4F1S2"), so it is
+    # correct however rows are written: save(), bulk_create(), update() or COPY.
+    composition_string = models.GeneratedField(
+        expression=Concat(
+            *(
+                Case(
+                    When(
+                        **{f"{field}__gt": 0},
+                        then=Concat(Value(letter), Cast(field, models.TextField()), output_field=models.TextField()),
+                    ),
+                    default=Value(""),
+                    output_field=models.TextField(),
+                )
+                for letter, field in zip(COMPOSITION_LETTERS, COMPOSITION_FIELDS)
+            ),
+            output_field=models.TextField(),
+        ),
+        output_field=models.CharField(max_length=255),
+        db_persist=True,
+    )
 
     def __str__(self):
         return self.composition_string
 
-    def save(self, *args, **kwargs):
-        # Build the composition string in a stable, defined order.
-        elements = []
-        for letter, value in (
-            ("H", self.H_num),
-            ("N", self.N_num),
-            ("F", self.F_num),
-            ("P", self.P_num),
-            ("T", self.T_num),
-            ("G", self.G_num),
-            ("S", self.S_num),
-            ("E", self.E_num),
-            ("M", self.M_num),
-        ):
-            if value > 0:
-                elements.append(f"{letter}{value}")
-        self.composition_string = "".join(elements)
-        super().save(*args, **kwargs)
+    def counts(self):
+        """Monosaccharide counts as a tuple in COMPOSITION_LETTERS order."""
+        return tuple(getattr(self, field) for field in COMPOSITION_FIELDS)
 
     class Meta:
         verbose_name = "Monosaccharide composition"
         verbose_name_plural = "Monosaccharide compositions"
+        constraints = [
+            # One row per composition; bulk writers deduplicate with ON CONFLICT.
+            models.UniqueConstraint(fields=COMPOSITION_FIELDS, name="unique_composition_counts"),
+        ]
+
+
+def composition_ids(counts):
+    """
+    `{counts: id}` for an iterable of count tuples (COMPOSITION_LETTERS order),
+    inserting the compositions that don't exist yet. One INSERT ... ON
+    CONFLICT DO NOTHING plus one SELECT, however many compositions.
+    """
+    counts = sorted({tuple(int(v) for v in c) for c in counts})
+    if not counts:
+        return {}
+    q = connection.ops.quote_name
+    table = q(MonosaccharideComposition._meta.db_table)
+    columns = ", ".join(q(field) for field in COMPOSITION_FIELDS)
+    arrays = ", ".join(["%s::int[]"] * len(COMPOSITION_FIELDS))
+    params = [list(column) for column in zip(*counts)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}) SELECT * FROM unnest({arrays}) "
+            f"ON CONFLICT ({columns}) DO NOTHING",
+            params,
+        )
+        cursor.execute(
+            f"SELECT c.id, {', '.join(f'c.{q(f)}' for f in COMPOSITION_FIELDS)} FROM {table} c "
+            f"JOIN unnest({arrays}) AS u({columns}) USING ({columns})",
+            params,
+        )
+        return {tuple(row[1:]): row[0] for row in cursor.fetchall()}
 
 
 class LastAuthor(models.Model):
@@ -143,6 +194,12 @@ class Study(models.Model):
     # empty DOI would violate the unique constraint.)
     doi = models.CharField(max_length=255, unique=True, null=True, blank=True)
     last_authors = models.ManyToManyField(LastAuthor, related_name="studies", blank=True)  # M2M
+    # Stemmed title words for full-text search (see text_search.py).
+    search_vector = models.GeneratedField(
+        expression=SearchVector("title", config="english"),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
 
     def __str__(self):
         return f"{self.title} | {self.journal} | {self.year} | DOI: {self.doi}"
@@ -150,32 +207,39 @@ class Study(models.Model):
     class Meta:
         verbose_name = "Study"
         verbose_name_plural = "Studies"
-
-
-# Generates a unique glycan ID in the format LBG-xxxxx
-def generate_unique_glycan_id():
-    while True:
-        glycan_id = f"LBG-{''.join(random.choices(string.ascii_uppercase + string.digits, k=5))}"
-        if not Glycan.objects.filter(id=glycan_id).exists():
-            return glycan_id
+        indexes = [GinIndex(fields=["search_vector"], name="study_search_vector_gin")]
 
 
 class Glycan(models.Model):
     """A glycan with structural, mass, cross-reference, and study data."""
 
-    # Human-readable LBG-xxxxx public ID (kept from the original).
-    id = models.CharField(max_length=9, primary_key=True, editable=False, unique=True)
+    # Human-readable LBG-xxxxx public ID, allocated by the database on insert
+    # from a sequence + permutation (see glycan_ids.py); never reused.
+    id = models.CharField(
+        max_length=9,
+        primary_key=True,
+        editable=False,
+        unique=True,
+        db_default=models.Func(function="lbg_next_glycan_id", output_field=models.CharField()),
+    )
 
     # External database cross-references
     glytoucan_id = models.CharField(max_length=255, blank=True)
     glycosmos_id = models.CharField(max_length=255, blank=True)
     glyconnect_id = models.CharField(max_length=255, blank=True)
     wurcs = models.TextField(blank=True)  # WURCS strings can get long, so TextField
+    # Substructure fingerprint of `wurcs`, set on save (see motif_index.py).
+    motif_fingerprint = models.BinaryField(null=True, editable=False)
 
     brain_specific = models.BooleanField(default=False)
 
     # SNFG, static image (was `structural_resolution`)
-    graphical_structure = models.ImageField(upload_to="images/", null=True, blank=True)
+    # Stored by content hash, shared between identical uploads (see storage.py).
+    graphical_structure = models.ImageField(
+        upload_to="images/", storage=structure_image_storage, null=True, blank=True
+    )
+    # SHA-256 of graphical_structure; names its thumbnails (see thumbnails.py).
+    image_digest = models.CharField(max_length=64, blank=True, editable=False)
 
     mass = models.FloatField(null=True, blank=True)
     theoretical_mass = models.FloatField(null=True, blank=True)
@@ -197,14 +261,189 @@ class Glycan(models.Model):
     # NOTE: the DiagnosticFragment model + its M2M have been removed — they are
     # not present in the new diagram.
 
-    def save(self, *args, **kwargs):
-        if not self.id:
-            self.id = generate_unique_glycan_id()
-        super().save(*args, **kwargs)
-
     def __str__(self):
         return f"Glycan {self.id}"
 
     class Meta:
         verbose_name = "Glycan"
         verbose_name_plural = "Glycans"
+        indexes = [
+            # Equality lookups and joins against the registry mirror (xrefs.py).
+            # WURCS strings can exceed a B-tree entry, so that index is on their MD5.
+            models.Index(fields=["glytoucan_id"], name="glycan_glytoucan_id"),
+            models.Index(fields=["glycosmos_id"], name="glycan_glycosmos_id"),
+            models.Index(fields=["glyconnect_id"], name="glycan_glyconnect_id"),
+            models.Index(MD5("wurcs"), name="glycan_wurcs_md5"),
+        ]
+
+
+# ---------------------------------------------------------------------------
+# Local mirror of external glycan registries
+# ---------------------------------------------------------------------------
+class RegistryEntry(models.Model):
+    """
+    One structure from a GlyTouCan, GlyCosmos or GlyConnect dump file.
+
+    Loaded with `manage.py xref_import` and used by `manage.py xref_sync`
+    to fill in the cross-reference IDs on Glycan (see xrefs.py). Each import
+    replaces the whole registry, so the table is a mirror, not a record of
+    edits. Never edit it directly.
+    """
+
+    GLYTOUCAN = "glytoucan"
+    GLYCOSMOS = "glycosmos"
+    GLYCONNECT = "glyconnect"
+    REGISTRIES = [(GLYTOUCAN, "GlyTouCan"), (GLYCOSMOS, "GlyCosmos"), (GLYCONNECT, "GlyConnect")]
+
+    registry = models.CharField(max_length=16, choices=REGISTRIES)
+    accession = models.CharField(max_length=64)  # the registry's own ID
+    glytoucan_id = models.CharField(max_length=64, blank=True)  # same as accession for GlyTouCan
+    wurcs = models.TextField(blank=True)
+    composition_string = models.CharField(max_length=255, blank=True)  # e.g. "H5N4F1S2"
+
+    def __str__(self):
+        return f"{self.get_registry_display()} {self.accession}"
+
+    class Meta:
+        verbose_name = "Registry entry"
+        verbose_name_plural = "Registry entries"
+        constraints = [
+            models.UniqueConstraint(fields=["registry", "accession"], name="unique_registry_accession"),
+        ]
+        indexes = [
+            models.Index(fields=["glytoucan_id"], name="registry_glytoucan_id"),
+            models.Index(MD5("wurcs"), name="registry_wurcs_md5"),
+        ]
+
+
+# ---------------------------------------------------------------------------
+# Quantitative data: samples and per-sample glycan abundances
+# ---------------------------------------------------------------------------
+class Sample(models.Model):
+    """One measured sample (e.g. a tissue extract or a plasma draw) of a study."""
+
+    study = models.ForeignKey(Study, on_delete=models.CASCADE, related_name="samples")
+    name = models.CharField(max_length=255)  # the sample's label in the study's data files
+    tissue = models.ForeignKey(Tissue, on_delete=models.SET_NULL, null=True, blank=True, related_name="samples")
+
+    def __str__(self):
+        return f"{self.name} ({self.study_id})"
+
+    class Meta:
+        verbose_name = "Sample"
+        verbose_name_plural = "Samples"
+        constraints = [
+            models.UniqueConstraint(fields=["study", "name"], name="unique_sample_name_per_study"),
+        ]
+
+
+class Measurement(models.Model):
+    """
+    How much of one glycan was seen in one sample.
+
+    Bulk-loaded with `manage.py abundance_import` (see abundance.py), which
+    inserts each file sorted by sample, so rows of a sample sit together on
+    disk. Sample lookups therefore use a BRIN index (a few pages however many
+    millions of rows there are) instead of a B-tree, and glycan lookups the
+    unique (glycan, sample) index.
+    """
+
+    sample = models.ForeignKey(Sample, on_delete=models.CASCADE, related_name="measurements", db_index=False)
+    glycan = models.ForeignKey(Glycan, on_delete=models.CASCADE, related_name="measurements", db_index=False)
+    relative_abundance = models.FloatField(null=True, blank=True)  # % of the sample's total
+    gu_observed = models.FloatField(null=True, blank=True)
+    intensity = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.glycan_id} in {self.sample_id}"
+
+    class Meta:
+        verbose_name = "Measurement"
+        verbose_name_plural = "Measurements"
+        constraints = [
+            models.UniqueConstraint(fields=["glycan", "sample"], name="unique_measurement_glycan_sample"),
+        ]
+        indexes = [BrinIndex(fields=["sample"], name="measurement_sample_brin")]
+
+
+# ---------------------------------------------------------------------------
+# Read-optimised search table
+# ---------------------------------------------------------------------------
+class GlycanSearch(models.Model):
+    """
+    One flattened row per Glycan for read-heavy search and listing.
+
+    Copies the composition, masses and GU range, and collects the species,
+    tissues, stages and study DOIs that normally need a 5-way join through
+    MonosaccharideComposition, the two M2M tables, ModelSpecies and
+    Tissue / OntogenicStage. Maintained by `glycan_search.refresh()` from
+    signal handlers (see signals.py); rebuild it from scratch with
+    `manage.py rebuild_glycan_search`. Never edit it directly.
+    """
+
+    glycan = models.OneToOneField(
+        Glycan, on_delete=models.CASCADE, primary_key=True, related_name="search"
+    )
+
+    composition_string = models.CharField(max_length=255, blank=True)
+    # Counts are NULL when the glycan has no composition.
+    H_num = models.PositiveIntegerField(null=True)
+    N_num = models.PositiveIntegerField(null=True)
+    F_num = models.PositiveIntegerField(null=True)
+    P_num = models.PositiveIntegerField(null=True)
+    T_num = models.PositiveIntegerField(null=True)
+    G_num = models.PositiveIntegerField(null=True)
+    S_num = models.PositiveIntegerField(null=True)
+    E_num = models.PositiveIntegerField(null=True)
+    M_num = models.PositiveIntegerField(null=True)
+
+    mass = models.FloatField(null=True)
+    theoretical_mass = models.FloatField(null=True)
+    gu_mean = models.FloatField(null=True)
+    gu_min = models.FloatField(null=True)
+    gu_max = models.FloatField(null=True)
+    brain_specific = models.BooleanField(default=False)
+
+    species_names = ArrayField(models.CharField(max_length=255), default=list)
+    taxids = ArrayField(models.CharField(max_length=255), default=list)
+    tissues = ArrayField(models.CharField(max_length=255), default=list)  # "organ - structure"
+    stages = ArrayField(models.CharField(max_length=255), default=list)
+    study_dois = ArrayField(models.CharField(max_length=255), default=list)
+
+    def __str__(self):
+        return f"Search row for {self.glycan_id}"
+
+    class Meta:
+        verbose_name = "Glycan search row"
+        verbose_name_plural = "Glycan search rows"
+        indexes = [
+            models.Index(fields=["mass"], name="glycansearch_mass_idx"),
+            models.Index(fields=["theoretical_mass"], name="glycansearch_theo_mass_idx"),
+            models.Index(fields=["gu_mean"], name="glycansearch_gu_mean_idx"),
+            models.Index(fields=["composition_string"], name="glycansearch_comp_idx"),
+            GinIndex(fields=["species_names"], name="glycansearch_species_gin"),
+            GinIndex(fields=["tissues"], name="glycansearch_tissues_gin"),
+            GinIndex(fields=["study_dois"], name="glycansearch_dois_gin"),
+        ]
+
+
+# ---------------------------------------------------------------------------
+# Change tracking
+# ---------------------------------------------------------------------------
+class TableVersion(models.Model):
+    """
+    Per-table change counter, bumped in the same transaction as every write
+    (see `table_versions.bump()`). The JSON API derives its ETag and
+    Last-Modified headers from these rows.
+    """
+
+    table = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.table} v{self.version}"
+
+    class Meta:
+        verbose_name = "Table version"
+        verbose_name_plural = "Table versions"
@@ -0,0 +1,355 @@
+"""
+Substructure (motif) search over `Glycan.wurcs`.
+
+Each WURCS string is parsed into a residue tree (wurcs.py). A query motif,
+itself a WURCS fragment or one of the named MOTIFS, matches a glycan when
+it can be embedded in the glycan's tree: every motif residue maps to a
+distinct glycan residue and every motif linkage to a glycan linkage.
+Unknowns in the motif ("?" anomer or position, or a generic residue such
+as Hex) match anything, while unknowns in the glycan only match unknowns.
+Anchored motifs (core fucose, ...) must start at the reducing end.
+Floating subtrees (antennae whose attachment point is unknown) are part of
+the glycan too: they are fingerprinted and searched like the main tree.
+
+Exact matching is a small backtracking search per glycan, so the index
+first narrows the candidates with fingerprints. A glycan's fingerprint is a
+FINGERPRINT_BITS bitset of hashed features: residue names with counts
+("Man#3"), linkages ("Fuc-a6-GlcNAc") and two-linkage paths, each also
+emitted in every generalisation a motif could ask for (HexNAc for GlcNAc,
+"?" for the anomer or position). A motif emits only its own features, so
+if the glycan contains the motif, the motif's bits are a subset of the
+glycan's. One vectorised `fingerprints & query == query` over all glycans
+leaves a few candidates for the exact check.
+
+Computing a fingerprint means parsing the WURCS, so each glycan's is
+stored in `Glycan.motif_fingerprint`, set on save (signals.py) and
+backfilled by `manage.py build_motif_fingerprints`. Like mass_index.py,
+the index lives in memory: it is loaded lazily once per process from the
+stored fingerprints, patched by the Glycan signals on commit, and reloaded
+whenever the `Glycan` table version changes. Rows without a fingerprint
+are fingerprinted while loading.
+"""
+
+import functools
+import hashlib
+import threading
+
+import numpy as np
+
+from . import table_versions, wurcs
+from .models import Glycan
+
+FINGERPRINT_BITS = 512
+_WORDS = FINGERPRINT_BITS // 64
+MAX_COUNT = 6  # "Man#k" features go up to this count
+
+# Generic residue classes a motif may use instead of a specific name.
+CLASSES = {
+    "Glc": "Hex", "Gal": "Hex", "Man": "Hex",
+    "GlcNAc": "HexNAc", "GalNAc": "HexNAc", "ManNAc": "HexNAc",
+    "Fuc": "dHex", "Rha": "dHex",
+    "Neu5Ac": "Sia", "Neu5Gc": "Sia", "Kdn": "Sia",
+}
+
+# Named motifs: (WURCS fragment, anchored at the reducing end).
+MOTIFS = {
+    "core_fucose": ("WURCS=2.0/2,2,1/[a2122h-1x_1-5_2*NCC/3=O][a1221m-1a_1-5]/1-2/a6-b1", True),
+    "bisecting_glcnac": (
+        "WURCS=2.0/3,4,3/[a1122h-1b_1-5][a2122h-1b_1-5_2*NCC/3=O][a1122h-1a_1-5]/1-2-3-3/a4-b1_a3-c1_a6-d1",
+        False,
+    ),
+    "lacdinac": ("WURCS=2.0/2,2,1/[a2122h-1x_1-5_2*NCC/3=O][a2112h-1b_1-5_2*NCC/3=O]/1-2/a4-b1", False),
+    "lewis_x": (
+        "WURCS=2.0/3,3,2/[a2122h-1x_1-5_2*NCC/3=O][a2112h-1b_1-5][a1221m-1a_1-5]/1-2-3/a4-b1_a3-c1",
+        False,
+    ),
+    "alpha2_3_sialic_acid": ("WURCS=2.0/2,2,1/[a2112h-1x_1-5][Aad21122h-2a_2-6_5*NCC/3=O]/1-2/a3-b2", False),
+    "alpha2_6_sialic_acid": ("WURCS=2.0/2,2,1/[a2112h-1x_1-5][Aad21122h-2a_2-6_5*NCC/3=O]/1-2/a6-b2", False),
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def parse(text):
+    """Cached `wurcs.parse()`; candidates are re-parsed for the exact check."""
+    return wurcs.parse(text)
+
+
+# ---------------------------------------------------------------------------
+# Features and fingerprints
+# ---------------------------------------------------------------------------
+def _names(name):
+    """A residue name and the generic names it also answers to."""
+    return (name, CLASSES[name]) if name in CLASSES else (name,)
+
+
+def _link(parent, child, anomer, position):
+    return f"{child}-{anomer}{'?' if position is None else position}-{parent}"
+
+
+def glycan_features(structure):
+    """Every feature a motif contained in `structure` could have."""
+    features = set()
+    counts = {}
+    for residue in structure.walk(floating=True):
+        for name in _names(residue.name):
+            counts[name] = counts.get(name, 0) + 1
+        for link in residue.children:
+            child = link.child
+            for parent_name in _names(residue.name):
+                for child_name in _names(child.name):
+                    for anomer in {child.anomer, "?"}:
+                        for position in {link.parent_position, None}:
+                            features.add(_link(parent_name, child_name, anomer, position))
+                    for grandchild in child.children:
+                        for name in _names(grandchild.child.name):
+                            features.add(f"{parent_name}>{child_name}>{name}")
+    for name, count in counts.items():
+        features.update(f"{name}#{k}" for k in range(1, min(count, MAX_COUNT) + 1))
+    for name in _names(structure.root.name):
+        features.add(f"^{name}")
+    return features
+
+
+def motif_features(structure, anchored=False):
+    """The features any glycan containing the motif must have."""
+    features = set()
+    counts = {}
+    for residue in structure.walk():
+        if residue.name == "?":
+            continue
+        counts[residue.name] = counts.get(residue.name, 0) + 1
+        for link in residue.children:
+            child = link.child
+            if child.name == "?":
+                continue
+            features.add(_link(residue.name, child.name, child.anomer, link.parent_position))
+            for grandchild in child.children:
+                if grandchild.child.name != "?":
+                    features.add(f"{residue.name}>{child.name}>{grandchild.child.name}")
+    features.update(f"{name}#{min(count, MAX_COUNT)}" for name, count in counts.items())
+    if anchored and structure.root.name != "?":
+        features.add(f"^{structure.root.name}")
+    return features
+
+
+@functools.lru_cache(maxsize=65536)
+def _bit(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=4).digest(), "little") % FINGERPRINT_BITS
+
+
+def fingerprint(features):
+    """The features hashed into a `_WORDS`-long uint64 bitset."""
+    words = [0] * _WORDS
+    for feature in features:
+        bit = _bit(feature)
+        words[bit // 64] |= 1 << (bit % 64)
+    return np.array(words, dtype=np.uint64)
+
+
+def glycan_fingerprint(text):
+    """Stored form (little-endian bytes) of a WURCS string's fingerprint, or None if it can't be parsed."""
+    try:
+        return fingerprint(glycan_features(parse(text))).astype("<u8").tobytes()
+    except ValueError:
+        return None
+
+
+def _from_bytes(stored, text):
+    """Fingerprint row for a glycan: the stored one, or computed when missing or stale."""
+    if stored is None or len(stored) != _WORDS * 8:
+        stored = glycan_fingerprint(text)
+        if stored is None:
+            return None
+    return np.frombuffer(bytes(stored), dtype="<u8").astype(np.uint64)
+
+
+# ---------------------------------------------------------------------------
+# Exact matching
+# ---------------------------------------------------------------------------
+def _residue_matches(motif, residue):
+    if motif.name != "?" and motif.name not in _names(residue.name):
+        return False
+    return set(motif.modifications) <= set(residue.modifications)
+
+
+def _link_matches(motif, link):
+    return (motif.child.anomer in ("?", link.child.anomer)) and (
+        motif.parent_position is None or motif.parent_position == link.parent_position
+    )
+
+
+def _embeds(motif, residue):
+    """Can the motif subtree rooted at `motif` be mapped onto `residue`'s subtree?"""
+    if not _residue_matches(motif, residue):
+        return False
+
+    def assign(i, used):
+        if i == len(motif.children):
+            return True
+        wanted = motif.children[i]
+        for j, link in enumerate(residue.children):
+            if j not in used and _link_matches(wanted, link) and _embeds(wanted.child, link.child):
+                if assign(i + 1, used | {j}):
+                    return True
+        return False
+
+    return assign(0, frozenset())
+
+
+def contains(structure, motif, anchored=False):
+    """Whether `motif` (a Structure) occurs in `structure`."""
+    if anchored:
+        return _embeds(motif.root, structure.root)
+    return any(_embeds(motif.root, residue) for residue in structure.walk(floating=True))
+
+
+def resolve(motif):
+    """
+    `(structure, anchored)` for a motif name from MOTIFS or a WURCS string.
+    A leading "^" on a WURCS string anchors it at the reducing end.
+    Raises ValueError.
+    """
+    motif = motif.strip()
+    if motif in MOTIFS:
+        text, anchored = MOTIFS[motif]
+    else:
+        anchored = motif.startswith("^")
+        text = motif.lstrip("^")
+        if not text.startswith("WURCS="):
+            raise ValueError(f"Unknown motif {motif!r}; use a WURCS string or one of: {', '.join(MOTIFS)}.")
+    return parse(text), anchored
+
+
+# ---------------------------------------------------------------------------
+# Index
+# ---------------------------------------------------------------------------
+class MotifIndex:
+    """Fingerprints of every parsable `Glycan.wurcs`, as one uint64 matrix."""
+
+    def __init__(self):
+        # (fingerprints, ids, texts) are replaced together, never mutated in
+        # place, so readers can search a consistent snapshot without the lock.
+        self._arrays = (np.empty((0, _WORDS), dtype=np.uint64), np.empty(0, dtype=object), np.empty(0, dtype=object))
+        self._lock = threading.Lock()
+        self.version = None  # Glycan table version loaded, set by get_index()
+
+    def __len__(self):
+        return len(self._arrays[1])
+
+    def load(self, rows=None):
+        """
+        (Re)build the index from `(glycan_id, wurcs, stored fingerprint)`
+        rows, or from the DB.
+        """
+        if rows is None:
+            rows = (
+                Glycan.objects.exclude(wurcs="")
+                .exclude(wurcs__isnull=True)
+                .values_list("id", "wurcs", "motif_fingerprint")
+                .iterator(chunk_size=10000)
+            )
+        fingerprints, ids, texts = [], [], []
+        for glycan_id, text, stored in rows:
+            row = _from_bytes(stored, text)
+            if row is not None:  # unparsable WURCS: never a match
+                fingerprints.append(row)
+                ids.append(glycan_id)
+                texts.append(text)
+        fingerprints = np.array(fingerprints, dtype=np.uint64).reshape(len(ids), _WORDS)
+        with self._lock:
+            self._arrays = (fingerprints, np.array(ids, dtype=object), np.array(texts, dtype=object))
+        return self
+
+    def upsert(self, glycan_id, text, stored=None):
+        """Insert, replace or (when `text` is empty or unparsable) drop one glycan."""
+        row = _from_bytes(stored, text) if text else None
+        with self._lock:
+            fingerprints, ids, texts = self._arrays
+            keep = ids != glycan_id
+            fingerprints, ids, texts = fingerprints[keep], ids[keep], texts[keep]
+            if row is not None:
+                fingerprints = np.vstack([fingerprints, row])
+                ids = np.append(ids, np.array([glycan_id], dtype=object))
+                texts = np.append(texts, np.array([text], dtype=object))
+            self._arrays = (fingerprints, ids, texts)
+
+    def remove(self, glycan_id):
+        self.upsert(glycan_id, "")
+
+    def candidates(self, query):
+        """Positions whose fingerprint has every bit of `query` set."""
+        fingerprints = self._arrays[0]
+        return np.flatnonzero(np.all((fingerprints & query) == query, axis=1))
+
+    def search(self, motif):
+        """
+        Glycan ids containing `motif` (see `resolve()`), plus the number of
+        fingerprint candidates that were checked. Raises ValueError.
+        """
+        structure, anchored = resolve(motif)
+        query = fingerprint(motif_features(structure, anchored))
+        _, ids, texts = self._arrays
+        positions = self.candidates(query)
+        matches = [ids[i] for i in positions if contains(parse(texts[i]), structure, anchored)]
+        return sorted(matches), len(positions)
+
+
+_index = None
+_registry_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Return the process-wide index, loading it on first use and reloading it
+    whenever the Glycan table version has moved on.
+    """
+    global _index
+    version = table_versions.recent_version(Glycan._meta.db_table)
+    index = _index
+    if index is None or index.version != version:
+        with _registry_lock:
+            index = _index
+            if index is None or index.version != version:
+                index = MotifIndex().load()
+                index.version = version
+                _index = index
+    return index
+
+
+def loaded_index():
+    """The index if this process has built it, else None."""
+    return _index
+
+
+def reset_index():
+    """Drop the index; it is rebuilt on next use."""
+    global _index
+    with _registry_lock:
+        _index = None
+
+
+def backfill(force=False, batch_size=1000):
+    """
+    Store the fingerprint of every glycan with a WURCS that has none yet
+    (all of them with `force`, e.g. after changing the features). Returns
+    `(stored, unparsable)`.
+    """
+    glycans = Glycan.objects.exclude(wurcs="").exclude(wurcs__isnull=True)
+    if not force:
+        glycans = glycans.filter(motif_fingerprint__isnull=True)
+    stored = unparsable = 0
+    batch = []
+    for glycan in glycans.only("id", "wurcs").iterator(chunk_size=batch_size):
+        glycan.motif_fingerprint = glycan_fingerprint(glycan.wurcs)
+        if glycan.motif_fingerprint is None:
+            unparsable += 1
+        else:
+            stored += 1
+            batch.append(glycan)
+        if len(batch) >= batch_size:
+            Glycan.objects.bulk_update(batch, ["motif_fingerprint"])
+            batch = []
+    Glycan.objects.bulk_update(batch, ["motif_fingerprint"])
+    table_versions.bump(Glycan._meta.db_table)  # bulk_update skips the signals
+    reset_index()
+    return stored, unparsable
@@ -0,0 +1,306 @@
+"""
+Glycan profile comparison between species, tissues, stages or contexts.
+
+A *profile* is the set of glycans linked (Glycan.model_species) to any
+ModelSpecies record in a group. Groups are formed along one dimension
+(`DIMENSIONS`): species name, tissue, ontogenic stage, or the individual
+ModelSpecies records ("context").
+
+`incidence()` reads every link in one query and packs each group's profile
+into a bitset over the glycan axis (uint8 rows, 8 glycans per byte):
+
+    bits[dimension]   (groups x ceil(glycans / 8))
+
+so every set operation is a vectorised AND / OR / AND-NOT across rows and
+every cardinality an `np.bitwise_count` sum:
+
+    shared      glycans in all selected groups
+    unique      per group: glycans in it and in none of the other groups
+    jaccard     |A & B| / |A | B| for every pair of groups
+    enrichment  per group and COMPOSITION_CLASSES entry: observed vs expected
+                count, fold change and a one-sided hypergeometric p-value
+                (Benjamini-Hochberg adjusted across the table)
+
+Both the incidence bitsets and every `compare()` result are stored with
+Django's cache framework under a key derived from the versions of the
+tables they are built from (see `table_versions`). Any write bumps a
+version and so moves on to a fresh key; nothing has to be invalidated.
+"""
+
+import hashlib
+from dataclasses import dataclass
+
+import numpy as np
+from django.core.cache import cache
+from django.db import connection
+
+from . import table_versions
+from .models import (
+    COMPOSITION_FIELDS,
+    COMPOSITION_LETTERS,
+    Glycan,
+    ModelSpecies,
+    MonosaccharideComposition,
+    OntogenicStage,
+    Tissue,
+)
+
+DIMENSIONS = ("species", "tissue", "stage", "context")
+TABLES = tuple(
+    model._meta.db_table
+    for model in (Glycan, MonosaccharideComposition, ModelSpecies, Tissue, OntogenicStage, Glycan.model_species.through)
+)
+CACHE_PREFIX = "DB:profiles"
+CACHE_TIMEOUT = 24 * 3600  # keys change with the data; this only bounds memory
+
+_L = {letter: i for i, letter in enumerate(COMPOSITION_LETTERS)}
+
+
+def _sialic(c):
+    return c[:, _L["S"]] + c[:, _L["G"]] + c[:, _L["E"]] + c[:, _L["M"]]
+
+
+# Composition classes as predicates over (n x 9) count arrays in
+# COMPOSITION_LETTERS order. E and M are esterified / amidated sialic acids.
+COMPOSITION_CLASSES = {
+    "sialylated": lambda c: _sialic(c) > 0,
+    "fucosylated": lambda c: c[:, _L["F"]] > 0,
+    "high_mannose": lambda c: (c[:, _L["N"]] == 2) & (c[:, _L["H"]] >= 5) & (c[:, _L["F"]] == 0) & (_sialic(c) == 0),
+    "paucimannose": lambda c: (c[:, _L["N"]] == 2) & (c[:, _L["H"]] <= 4) & (_sialic(c) == 0),
+    "phosphorylated": lambda c: c[:, _L["P"]] > 0,
+    "sulfated": lambda c: c[:, _L["T"]] > 0,
+}
+
+
+@dataclass
+class Incidence:
+    """Profiles of every group along every dimension, as packed bitsets."""
+
+    glycans: np.ndarray  # linked glycan ids, sorted
+    classes: dict  # class name -> packed bitset over glycans
+    has_composition: np.ndarray  # packed bitset over glycans
+    keys: dict  # dimension -> group keys (str)
+    labels: dict  # dimension -> group labels
+    bits: dict  # dimension -> (groups x bytes) uint8
+
+    def group_index(self, dimension, keys=None):
+        """Row indices of `keys` (all groups when None or empty); raises ValueError for unknown keys."""
+        if not keys:
+            return np.arange(len(self.keys[dimension]))
+        position = {key: i for i, key in enumerate(self.keys[dimension])}
+        unknown = [key for key in keys if key not in position]
+        if unknown:
+            raise ValueError(f"Unknown {dimension} group(s): {', '.join(unknown)}")
+        return np.array([position[key] for key in keys], dtype=np.int64)
+
+    def ids(self, bitset):
+        """Glycan ids of the set bits of one packed row."""
+        mask = np.unpackbits(bitset, count=len(self.glycans)).astype(bool)
+        return self.glycans[mask].tolist()
+
+
+def _version_key(*parts):
+    versions, _ = table_versions.snapshot(TABLES)
+    digest = hashlib.sha1(repr((versions,) + parts).encode()).hexdigest()
+    return f"{CACHE_PREFIX}:{digest}"
+
+
+def _pack(mask):
+    return np.packbits(mask, axis=-1)
+
+
+def _count(bits):
+    return np.bitwise_count(bits).sum(axis=-1, dtype=np.int64)
+
+
+def build_incidence():
+    """Read every glycan-context link and pack the profiles (uncached)."""
+    q = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT gm.glycan_id, ms.id, ms.species_name, t.id, t.organ, t.structure, st.id, st.stage, st.age "
+            f"FROM {q(Glycan.model_species.through._meta.db_table)} gm "
+            f"JOIN {q(ModelSpecies._meta.db_table)} ms ON ms.id = gm.modelspecies_id "
+            f"LEFT JOIN {q(Tissue._meta.db_table)} t ON t.id = ms.tissue_id "
+            f"LEFT JOIN {q(OntogenicStage._meta.db_table)} st ON st.id = ms.stage_id"
+        )
+        links = cursor.fetchall()
+    glycans = np.array(sorted({row[0] for row in links}), dtype=object)
+    position = {glycan_id: i for i, glycan_id in enumerate(glycans)}
+    row_of = np.array([position[row[0]] for row in links], dtype=np.int64)
+
+    # Group key and label of every link along every dimension (None: no group).
+    groups = {
+        "species": [(row[2], row[2]) if row[2] else None for row in links],
+        "tissue": [
+            (str(row[3]), str(Tissue(organ=row[4], structure=row[5]))) if row[3] is not None else None for row in links
+        ],
+        "stage": [
+            (str(row[6]), str(OntogenicStage(stage=row[7], age=row[8]))) if row[6] is not None else None
+            for row in links
+        ],
+        "context": [
+            (
+                str(row[1]),
+                str(
+                    ModelSpecies(
+                        species_name=row[2],
+                        tissue=Tissue(organ=row[4], structure=row[5]) if row[3] is not None else None,
+                        stage=OntogenicStage(stage=row[7], age=row[8]) if row[6] is not None else None,
+                    )
+                ),
+            )
+            for row in links
+        ],
+    }
+    keys, labels, bits = {}, {}, {}
+    for dimension, per_link in groups.items():
+        names = dict(sorted({group for group in per_link if group is not None}, key=lambda g: g[1].lower()))
+        keys[dimension] = list(names)
+        labels[dimension] = list(names.values())
+        column = {key: i for i, key in enumerate(names)}
+        matrix = np.zeros((len(names), len(glycans)), dtype=bool)
+        linked = [i for i, group in enumerate(per_link) if group is not None]
+        matrix[[column[per_link[i][0]] for i in linked], row_of[linked]] = True
+        bits[dimension] = _pack(matrix)
+
+    counts = np.full((len(glycans), len(COMPOSITION_FIELDS)), -1, dtype=np.int64)
+    rows = Glycan.objects.filter(pk__in=list(glycans), monosaccharide_comp__isnull=False).values_list(
+        "pk", *(f"monosaccharide_comp__{field}" for field in COMPOSITION_FIELDS)
+    )
+    for glycan_id, *values in rows:
+        counts[position[glycan_id]] = values
+    known = counts[:, 0] >= 0
+    classes = {name: _pack(predicate(counts) & known) for name, predicate in COMPOSITION_CLASSES.items()}
+    return Incidence(glycans, classes, _pack(known), keys, labels, bits)
+
+
+def incidence():
+    """The profiles for the current data version, from the cache when possible."""
+    key = _version_key("incidence")
+    result = cache.get(key)
+    if result is None:
+        result = build_incidence()
+        cache.set(key, result, CACHE_TIMEOUT)
+    return result
+
+
+def _log_choose_table(n):
+    """log(C(a, b)) via a log-factorial table up to n."""
+    log_factorial = np.concatenate([[0.0], np.cumsum(np.log(np.arange(1, n + 1, dtype=np.float64)))])
+
+    def log_choose(a, b):
+        return log_factorial[a] - log_factorial[b] - log_factorial[a - b]
+
+    return log_choose
+
+
+def hypergeometric_sf(k, n, K, N):
+    """P(X >= k) for X ~ Hypergeometric(population N, K successes, n draws), elementwise."""
+    k, n, K = np.broadcast_arrays(np.asarray(k), np.asarray(n), np.asarray(K))
+    log_choose = _log_choose_table(int(N))
+    p = np.ones(k.shape)
+    for index in np.ndindex(k.shape):
+        a, draws, successes = int(k[index]), int(n[index]), int(K[index])
+        top = min(draws, successes)
+        if a <= max(0, draws - (N - successes)):
+            continue  # the whole support: p = 1
+        x = np.arange(a, top + 1)
+        terms = log_choose(successes, x) + log_choose(N - successes, draws - x) - log_choose(N, draws)
+        p[index] = min(1.0, float(np.exp(terms).sum())) if len(x) else 0.0
+    return p
+
+
+def benjamini_hochberg(p):
+    """Benjamini-Hochberg adjusted p-values (same shape as `p`)."""
+    flat = np.asarray(p, dtype=np.float64).ravel()
+    if not len(flat):
+        return flat.reshape(np.shape(p))
+    order = np.argsort(flat)
+    ranked = flat[order] * len(flat) / np.arange(1, len(flat) + 1)
+    adjusted = np.minimum.accumulate(ranked[::-1])[::-1]
+    result = np.empty_like(flat)
+    result[order] = np.minimum(adjusted, 1.0)
+    return result.reshape(np.shape(p))
+
+
+def compute(dimension, groups=None, with_ids=False):
+    """
+    Compare the profiles of `groups` (keys along `dimension`, default all).
+    Returns a JSON-ready dict; see the module docstring.
+    """
+    if dimension not in DIMENSIONS:
+        raise ValueError(f"Unknown dimension: {dimension!r} (choose from {', '.join(DIMENSIONS)})")
+    data = incidence()
+    rows = data.group_index(dimension, groups)
+    bits = data.bits[dimension][rows]
+    keys = [data.keys[dimension][i] for i in rows]
+    labels = [data.labels[dimension][i] for i in rows]
+    sizes = _count(bits)
+
+    union = np.bitwise_or.reduce(bits, axis=0)
+    shared = np.bitwise_and.reduce(bits, axis=0) if len(rows) else union
+    # Glycans in group i and no other: i's bits AND NOT (OR of the others).
+    # With prefix / suffix ORs that's O(groups), not O(groups^2).
+    before, after = np.zeros_like(bits), np.zeros_like(bits)
+    before[1:] = np.bitwise_or.accumulate(bits[:-1], axis=0)
+    after[:-1] = np.bitwise_or.accumulate(bits[:0:-1], axis=0)[::-1]
+    unique = bits & ~(before | after)
+
+    # One row of pairwise intersections at a time: (groups x bytes) each.
+    intersections = np.array([_count(row & bits) for row in bits], dtype=np.int64).reshape(len(rows), len(rows))
+    unions = sizes[:, None] + sizes[None, :] - intersections
+    jaccard = np.where(unions > 0, intersections / np.maximum(unions, 1), 0.0)
+
+    # Enrichment among glycans with a known composition, against the union
+    # of the compared groups.
+    universe = union & data.has_composition
+    population = int(_count(universe))
+    class_names = list(COMPOSITION_CLASSES)
+    class_bits = np.stack([data.classes[name] for name in class_names]) & universe  # (classes x bytes)
+    known = _count(bits & universe)  # glycans with a composition, per group
+    in_class = np.array([_count(row & class_bits) for row in bits], dtype=np.int64).reshape(len(rows), -1)
+    class_sizes = _count(class_bits)
+    expected = known[:, None] * class_sizes[None, :] / max(population, 1)
+    fold = np.where(expected > 0, in_class / np.where(expected > 0, expected, 1), np.nan)
+    p = hypergeometric_sf(in_class, known[:, None], class_sizes[None, :], population)
+    q = benjamini_hochberg(p)
+
+    result = {
+        "dimension": dimension,
+        "groups": [
+            {"key": key, "label": label, "size": int(size), "unique": int(n_unique)}
+            for key, label, size, n_unique in zip(keys, labels, sizes, _count(unique))
+        ],
+        "union": int(_count(union)),
+        "shared": int(_count(shared)),
+        "jaccard": np.round(jaccard, 6).tolist(),
+        "enrichment": [
+            {
+                "group": keys[i],
+                "class": name,
+                "count": int(in_class[i, j]),
+                "expected": round(float(expected[i, j]), 4),
+                "fold": None if np.isnan(fold[i, j]) else round(float(fold[i, j]), 4),
+                "p": float(p[i, j]),
+                "q": float(q[i, j]),
+            }
+            for i in range(len(keys))
+            for j, name in enumerate(class_names)
+        ],
+    }
+    if with_ids:
+        result["shared_ids"] = data.ids(shared)
+        for group, row in zip(result["groups"], unique):
+            group["unique_ids"] = data.ids(row)
+    return result
+
+
+def compare(dimension, groups=None, with_ids=False):
+    """`compute()` through the cache, keyed by data version and arguments."""
+    key = _version_key("compare", dimension, tuple(groups) if groups else None, with_ids)
+    result = cache.get(key)
+    if result is None:
+        result = compute(dimension, groups, with_ids)
+        cache.set(key, result, CACHE_TIMEOUT)
+    return result
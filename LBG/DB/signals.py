@@ -0,0 +1,176 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import glycan_search, gu_index, mass_index, motif_index, table_versions, thumbnails
+from .models import Glycan
+
+
+# Bump the table version (used for API ETags and to keep the in-memory
+# indexes of other processes current) in the same transaction as the write,
+# so a cached response can never outlive the data it was built from. These
+# are connected first: the index handlers below read the version a save or
+# delete moved its table to from `instance._table_version`.
+def _bump_version(sender, instance, **kwargs):
+    table = sender._meta.db_table
+    instance._table_version = table_versions.bump(table)[table]
+
+
+def _bump_link_version(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        table_versions.bump(sender._meta.db_table)
+
+
+for _model in table_versions.TRACKED_MODELS:
+    if _model._meta.auto_created:
+        m2m_changed.connect(_bump_link_version, sender=_model, dispatch_uid=f"table_version_m2m_{_model.__name__}")
+    else:
+        post_save.connect(_bump_version, sender=_model, dispatch_uid=f"table_version_save_{_model.__name__}")
+        post_delete.connect(_bump_version, sender=_model, dispatch_uid=f"table_version_delete_{_model.__name__}")
+
+
+# Keep the in-memory mass indexes in step with the table. Changes are applied
+# on commit, so a rolled-back save never leaks into the index. The GU + mass
+# grid is cheap to rebuild, so it is simply dropped and reloaded on next use.
+def _advance(index, version):
+    # The TableVersion row stays locked until the write commits, so if this
+    # write is the only one since the index was loaded, the patched index is
+    # current at `version` and needs no reload; otherwise get_index() reloads.
+    if index.version == version - 1:
+        index.version = version
+    table_versions.committed(Glycan._meta.db_table, version)
+
+
+@receiver(post_save, sender=Glycan)
+def update_mass_indexes(sender, instance, **kwargs):
+    glycan_id, version = instance.pk, instance._table_version
+    values = {field: getattr(instance, field) for field in mass_index.MASS_FIELDS}
+    composition_id = instance.monosaccharide_comp_id
+
+    def apply():
+        for index in mass_index.loaded_indexes():
+            index.upsert(glycan_id, values[index.field], composition_id)
+            _advance(index, version)
+        gu_index.reset_indexes()
+
+    transaction.on_commit(apply)
+
+
+@receiver(post_delete, sender=Glycan)
+def remove_from_mass_indexes(sender, instance, **kwargs):
+    glycan_id, version = instance.pk, instance._table_version  # Django clears instance.pk once the delete finishes
+
+    def apply():
+        for index in mass_index.loaded_indexes():
+            index.remove(glycan_id)
+            _advance(index, version)
+        gu_index.reset_indexes()
+
+    transaction.on_commit(apply)
+
+
+# Keep GlycanSearch rows in step with everything they are derived from.
+# Affected glycan ids are looked up when the change happens (for deletes,
+# before the FK / M2M rows disappear) and refreshed once the change commits.
+# Deleted glycans lose their row through the FK's ON DELETE CASCADE.
+def _refresh_on_commit(glycan_ids):
+    if glycan_ids:
+        transaction.on_commit(lambda: glycan_search.refresh(glycan_ids))
+
+
+def _refresh_related(sender, instance, **kwargs):
+    _refresh_on_commit(glycan_search.affected_glycans(sender, [instance.pk]))
+
+
+for _model in glycan_search.DEPENDENCIES:
+    post_save.connect(_refresh_related, sender=_model, dispatch_uid=f"glycan_search_save_{_model.__name__}")
+    if _model is not Glycan:
+        pre_delete.connect(
+            _refresh_related, sender=_model, dispatch_uid=f"glycan_search_delete_{_model.__name__}"
+        )
+
+
+@receiver(m2m_changed, sender=Glycan.model_species.through)
+@receiver(m2m_changed, sender=Glycan.studies.through)
+def refresh_glycan_search_links(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        _refresh_on_commit([instance.pk])
+    elif action == "pre_clear":
+        _refresh_on_commit(glycan_search.affected_glycans(type(instance), [instance.pk]))
+    else:
+        _refresh_on_commit(list(pk_set))
+
+
+
+
+# Structure images: thumbnail new ones, and release replaced or deleted ones
+# to the refcounted storage (storage.py) once the change is committed.
+# pre_save runs before the FileField stores an upload, so the row still holds
+# the previous image name and `_committed` still marks a fresh upload.
+@receiver(pre_save, sender=Glycan)
+def track_image_change(sender, instance, raw=False, **kwargs):
+    image = instance.graphical_structure
+    previous = ""
+    if not instance._state.adding:
+        previous = Glycan.objects.filter(pk=instance.pk).values_list("graphical_structure", flat=True).first() or ""
+    if not image:
+        instance.image_digest = ""
+    instance._previous_image = previous
+    instance._thumbnails_stale = bool(image) and (
+        not image._committed or image.name != previous or not instance.image_digest
+    )
+
+
+@receiver(post_save, sender=Glycan)
+def update_image_files(sender, instance, **kwargs):
+    glycan_id = instance.pk
+    if getattr(instance, "_thumbnails_stale", False):
+        transaction.on_commit(lambda: thumbnails.update_glycan(glycan_id))
+    previous = getattr(instance, "_previous_image", "")
+    if previous and previous != instance.graphical_structure.name:
+        storage = instance.graphical_structure.storage
+        transaction.on_commit(lambda: storage.delete(previous))
+
+
+@receiver(post_delete, sender=Glycan)
+def release_image(sender, instance, **kwargs):
+    image = instance.graphical_structure
+    if image:
+        name, storage = image.name, image.storage
+        transaction.on_commit(lambda: storage.delete(name))
+
+
+# Motif search: store the WURCS fingerprint with the row, and update the
+# in-memory motif index once the change commits.
+@receiver(pre_save, sender=Glycan)
+def set_motif_fingerprint(sender, instance, raw=False, **kwargs):
+    instance.motif_fingerprint = motif_index.glycan_fingerprint(instance.wurcs) if instance.wurcs else None
+
+
+@receiver(post_save, sender=Glycan)
+def update_motif_index(sender, instance, **kwargs):
+    glycan_id, text, stored = instance.pk, instance.wurcs, instance.motif_fingerprint
+    version = instance._table_version
+
+    def apply():
+        index = motif_index.loaded_index()
+        if index is not None:
+            index.upsert(glycan_id, text, stored)
+            _advance(index, version)
+
+    transaction.on_commit(apply)
+
+
+@receiver(post_delete, sender=Glycan)
+def remove_from_motif_index(sender, instance, **kwargs):
+    glycan_id, version = instance.pk, instance._table_version
+
+    def apply():
+        index = motif_index.loaded_index()
+        if index is not None:
+            index.remove(glycan_id)
+            _advance(index, version)
+
+    transaction.on_commit(apply)
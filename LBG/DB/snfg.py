@@ -0,0 +1,299 @@
+"""
+SNFG (Symbol Nomenclature for Glycans) drawings rendered from WURCS.
+
+`render(wurcs, "svg" | "png")` parses the structure (wurcs.py) and lays it
+out in the usual SNFG style:
+- the reducing end is on the right and branches grow to the left;
+- at a branch point, the higher-numbered linkage goes on top (the 6-arm
+  above the 3-arm);
+- edges are labelled with the anomer and the parent position ("β4").
+Residues with an undefined attachment point are drawn in a column at the
+far left, marked "?".
+
+Drawing is split in two steps. The layout produces a list of primitives
+(lines, shapes, text). The SVG and PNG (Pillow) backends then only
+translate those primitives.
+
+`cached_render()` keeps results in a size-bounded LRU disk cache
+(disk_cache.py) under CACHE_DIR/snfg. The key is a hash of the WURCS
+string, the format and RENDERER_VERSION, so repeat views never re-render.
+`render_all()` fills the cache for many structures in a process pool.
+"""
+
+import hashlib
+import io
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+
+from . import wurcs
+from .disk_cache import DiskCache
+
+RENDERER_VERSION = 1  # bump to invalidate every cached drawing
+FORMATS = {"svg": "image/svg+xml", "png": "image/png"}
+
+WHITE, BLUE, GREEN, YELLOW = "#FFFFFF", "#0072BC", "#00A651", "#FFD400"
+ORANGE, PURPLE, LIGHT_BLUE, BROWN, RED = "#F47920", "#A54399", "#8FCCE9", "#A17A4D", "#ED1C24"
+
+# SNFG name -> (shape, colour)
+SYMBOLS = {
+    "Hex": ("circle", WHITE),
+    "Glc": ("circle", BLUE),
+    "Man": ("circle", GREEN),
+    "Gal": ("circle", YELLOW),
+    "HexNAc": ("square", WHITE),
+    "GlcNAc": ("square", BLUE),
+    "ManNAc": ("square", GREEN),
+    "GalNAc": ("square", YELLOW),
+    "GlcN": ("divided_square", BLUE),
+    "GalN": ("divided_square", YELLOW),
+    "dHex": ("triangle", WHITE),
+    "Fuc": ("triangle", RED),
+    "Rha": ("triangle", GREEN),
+    "Xyl": ("star", ORANGE),
+    "GlcA": ("divided_diamond", BLUE),
+    "ManA": ("divided_diamond", GREEN),
+    "GalA": ("divided_diamond", YELLOW),
+    "IdoA": ("divided_diamond", BROWN),
+    "Neu5Ac": ("diamond", PURPLE),
+    "Neu5Gc": ("diamond", LIGHT_BLUE),
+    "Kdn": ("diamond", GREEN),
+}
+UNKNOWN_SYMBOL = ("hexagon", WHITE)
+
+STEP_X, STEP_Y = 56, 40  # grid spacing in pixels
+RADIUS = 12  # symbol half-size
+MARGIN = 24
+FONT_SIZE = 11
+ANOMERS = {"a": "α", "b": "β", "?": "?"}
+
+
+# ---------------------------------------------------------------------------
+# Layout
+# ---------------------------------------------------------------------------
+def layout(structure):
+    """
+    Drawing primitives for `structure` plus the canvas size:
+    `(width, height, primitives)`. Each primitive is one of
+    ("line", x1, y1, x2, y2), ("symbol", shape, colour, cx, cy) or
+    ("text", x, y, string, anchor).
+    """
+    grid = {}  # residue -> (column, row); column 0 is the reducing end
+    next_row = 0
+
+    def place(residue, column):
+        nonlocal next_row
+        if residue.children:
+            rows = [place(link.child, column + 1) for link in residue.children]
+            row = (rows[0] + rows[-1]) / 2
+        else:
+            row, next_row = next_row, next_row + 1
+        grid[residue] = (column, row)
+        return row
+
+    place(structure.root, 0)
+    # Floating subtrees go one column past the tree, below its last row.
+    floating_column = max(column for column, _ in grid.values()) + 1
+    for residue in structure.floating:
+        place(residue, floating_column)
+    columns = max(column for column, _ in grid.values())
+    rows = max(max(row for _, row in grid.values()), 0)
+
+    def xy(residue):
+        column, row = grid[residue]
+        return MARGIN + RADIUS + (columns - column) * STEP_X, MARGIN + RADIUS + row * STEP_Y
+
+    lines, texts, symbols = [], [], []
+    for residue in grid:
+        x, y = xy(residue)
+        for link in residue.children:
+            cx, cy = xy(link.child)
+            lines.append(("line", x, y, cx, cy))
+            position = "?" if link.parent_position is None else str(link.parent_position)
+            texts.append(("text", (x + cx) / 2, (y + cy) / 2 - 4, ANOMERS[link.child.anomer] + position, "middle"))
+    for residue in grid:
+        x, y = xy(residue)
+        shape, colour = SYMBOLS.get(residue.name, UNKNOWN_SYMBOL)
+        symbols.append(("symbol", shape, colour, x, y))
+        if shape == "hexagon":
+            texts.append(("text", x, y + FONT_SIZE / 3, residue.name, "middle"))
+        if residue.modifications:
+            texts.append(("text", x + RADIUS + 2, y + RADIUS + FONT_SIZE, ",".join(residue.modifications), "start"))
+        if residue in structure.floating:
+            texts.append(("text", x + RADIUS + 4, y + FONT_SIZE / 3, ANOMERS[residue.anomer] + "?", "start"))
+    width = 2 * (MARGIN + RADIUS) + columns * STEP_X
+    height = 2 * (MARGIN + RADIUS) + rows * STEP_Y
+    return math.ceil(width), math.ceil(height), lines + symbols + texts
+
+
+def _polygon(shape, cx, cy, r):
+    """Outline points of a polygonal symbol."""
+    if shape in ("square", "divided_square"):
+        s = r * 0.9
+        return [(cx - s, cy - s), (cx + s, cy - s), (cx + s, cy + s), (cx - s, cy + s)]
+    if shape == "triangle":
+        return [(cx, cy - r), (cx + r, cy + r * 0.8), (cx - r, cy + r * 0.8)]
+    if shape in ("diamond", "divided_diamond"):
+        return [(cx, cy - r), (cx + r, cy), (cx, cy + r), (cx - r, cy)]
+    if shape == "star":
+        return [
+            (cx + (r if i % 2 == 0 else r * 0.45) * math.sin(i * math.pi / 5),
+             cy - (r if i % 2 == 0 else r * 0.45) * math.cos(i * math.pi / 5))
+            for i in range(10)
+        ]
+    if shape == "hexagon":
+        return [(cx + r * 1.2 * math.cos(a), cy + r * 0.8 * math.sin(a)) for a in (k * math.pi / 3 for k in range(6))]
+    raise ValueError(shape)
+
+
+def _half(shape, cx, cy, r):
+    """Coloured half of a divided symbol."""
+    if shape == "divided_diamond":
+        return [(cx - r, cy), (cx, cy - r), (cx + r, cy)]
+    s = r * 0.9
+    return [(cx - s, cy - s), (cx + s, cy - s), (cx - s, cy + s)]
+
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+def to_svg(width, height, primitives):
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}" font-family="sans-serif" font-size="{FONT_SIZE}">'
+    ]
+    for primitive in primitives:
+        kind = primitive[0]
+        if kind == "line":
+            _, x1, y1, x2, y2 = primitive
+            parts.append(f'<line x1="{x1:g}" y1="{y1:g}" x2="{x2:g}" y2="{y2:g}" stroke="#000" stroke-width="1.5"/>')
+        elif kind == "symbol":
+            _, shape, colour, cx, cy = primitive
+            if shape == "circle":
+                parts.append(f'<circle cx="{cx:g}" cy="{cy:g}" r="{RADIUS}" fill="{colour}" stroke="#000"/>')
+                continue
+            fill = WHITE if shape.startswith("divided") else colour
+            points = " ".join(f"{x:.1f},{y:.1f}" for x, y in _polygon(shape, cx, cy, RADIUS))
+            parts.append(f'<polygon points="{points}" fill="{fill}" stroke="#000"/>')
+            if shape.startswith("divided"):
+                half = " ".join(f"{x:.1f},{y:.1f}" for x, y in _half(shape, cx, cy, RADIUS))
+                parts.append(f'<polygon points="{half}" fill="{colour}" stroke="#000"/>')
+        else:
+            _, x, y, text, anchor = primitive
+            parts.append(f'<text x="{x:g}" y="{y:g}" text-anchor="{anchor}">{escape(text)}</text>')
+    parts.append("</svg>")
+    return "".join(parts).encode()
+
+
+def to_png(width, height, primitives, supersample=3):
+    from PIL import Image, ImageDraw, ImageFont
+
+    k = supersample  # draw large, then downscale: Pillow doesn't antialias shapes
+    image = Image.new("RGBA", (width * k, height * k), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(image)
+    try:
+        font, ascii_only = ImageFont.truetype("DejaVuSans.ttf", FONT_SIZE * k), False
+    except OSError:  # Pillow's built-in font has no Greek letters
+        font, ascii_only = ImageFont.load_default(size=FONT_SIZE * k), True
+    r = RADIUS * k
+    for primitive in primitives:
+        kind = primitive[0]
+        if kind == "line":
+            _, x1, y1, x2, y2 = primitive
+            draw.line([(x1 * k, y1 * k), (x2 * k, y2 * k)], fill="#000000", width=int(1.5 * k))
+        elif kind == "symbol":
+            _, shape, colour, cx, cy = primitive
+            cx, cy = cx * k, cy * k
+            if shape == "circle":
+                draw.ellipse([cx - r, cy - r, cx + r, cy + r], fill=colour, outline="#000000", width=k)
+                continue
+            fill = WHITE if shape.startswith("divided") else colour
+            draw.polygon(_polygon(shape, cx, cy, r), fill=fill, outline="#000000", width=k)
+            if shape.startswith("divided"):
+                draw.polygon(_half(shape, cx, cy, r), fill=colour, outline="#000000", width=k)
+        else:
+            _, x, y, text, anchor = primitive
+            if ascii_only:
+                text = text.replace("α", "a").replace("β", "b")
+            draw.text((x * k, y * k), text, fill="#000000", font=font, anchor="ms" if anchor == "middle" else "ls")
+    image = image.resize((width, height), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def render(wurcs_text, fmt="svg"):
+    """SNFG drawing of a WURCS string as SVG or PNG bytes. Raises ValueError."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt!r}")
+    width, height, primitives = layout(wurcs.parse(wurcs_text))
+    return to_svg(width, height, primitives) if fmt == "svg" else to_png(width, height, primitives)
+
+
+# ---------------------------------------------------------------------------
+# Cache
+# ---------------------------------------------------------------------------
+def cache_key(wurcs_text, fmt):
+    return hashlib.sha256(f"{RENDERER_VERSION}\0{fmt}\0{wurcs_text.strip()}".encode()).hexdigest()
+
+
+def cache_directory():
+    return os.path.join(settings.CACHE_DIR, "snfg")
+
+
+_caches = {}
+
+
+def get_cache(directory=None, max_bytes=None):
+    """The per-process DiskCache for `directory` (default CACHE_DIR/snfg)."""
+    directory = directory or cache_directory()
+    if directory not in _caches:
+        _caches[directory] = DiskCache(directory, max_bytes or settings.SNFG_CACHE_MAX_BYTES)
+    return _caches[directory]
+
+
+def cached_render(wurcs_text, fmt="svg"):
+    """`render()` through the disk cache. Raises ValueError."""
+    return get_cache().get_or_create(cache_key(wurcs_text, fmt), lambda: render(wurcs_text, fmt))
+
+
+def _render_into(directory, max_bytes, wurcs_text, fmt):
+    """Process-pool task: make sure one drawing is cached. Returns an error or None."""
+    cache = get_cache(directory, max_bytes)
+    key = cache_key(wurcs_text, fmt)
+    if os.path.exists(cache.path(key)):
+        return None
+    try:
+        cache.put(key, render(wurcs_text, fmt))
+    except ValueError as exc:
+        return str(exc)
+    return None
+
+
+def render_all(wurcs_texts, formats=("svg",), jobs=None, progress=None):
+    """
+    Render every WURCS string in every format into the cache using `jobs`
+    worker processes (default: one per CPU). Returns `{(wurcs, fmt): error}`
+    for the structures that couldn't be drawn.
+    """
+    directory, max_bytes = cache_directory(), settings.SNFG_CACHE_MAX_BYTES
+    tasks = [(text, fmt) for text in dict.fromkeys(wurcs_texts) for fmt in formats]
+    errors = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(
+            _render_into,
+            [directory] * len(tasks),
+            [max_bytes] * len(tasks),
+            [text for text, _ in tasks],
+            [fmt for _, fmt in tasks],
+            chunksize=max(1, len(tasks) // (4 * (jobs or os.cpu_count() or 1))),
+        )
+        for (text, fmt), error in zip(tasks, results):
+            if error:
+                errors[(text, fmt)] = error
+            if progress:
+                progress(text, fmt, error)
+    return errors
@@ -0,0 +1,184 @@
+"""
+Content-addressed storage for glycan structure images.
+
+`ContentAddressedStorage` saves every file under the SHA-256 of its bytes:
+
+    images/<digest[:2]>/<digest>.<ext>
+
+Uploading an image that is already stored writes nothing and returns the
+existing name, so identical uploads share one file. That ends the
+`foo.png` / `foo_hsRBWwT.png` copies that Django's collision renaming used
+to create. A name's content never changes, so its URL can be cached forever.
+
+Because files are shared, `delete()` is reference counted. A file is only
+removed once no row in `references` points at it any more. Signal handlers
+in signals.py release a glycan's previous image when it is replaced or
+the glycan is deleted.
+
+Counting references races with uploads: an upload of the same bytes finds
+the file, and its row only commits later. So reusing a file touches it
+(the touch is the existence check), and `delete()` leaves content-addressed
+files used within the last `grace` seconds alone. Such files are removed
+later by `manage.py migrate_media --prune`. The delete itself renames the
+file aside first and checks that it wasn't touched in between, putting it
+back if it was; an upload that comes after the rename writes a fresh copy.
+
+`manage.py migrate_media` moves files stored under their upload names into
+this layout and rewrites the field values (`migrate_existing()`).
+"""
+
+import hashlib
+import os
+import posixpath
+import re
+import time
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+CONTENT_NAME = re.compile(r"^(?:.*/)?([0-9a-f]{2})/\1[0-9a-f]{62}(\.[a-z0-9]+)?$")
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage that names files by content. `references` lists the
+    `"app_label.Model.field"` file fields whose values count as references.
+    """
+
+    def __init__(self, references=(), grace=3600, **kwargs):
+        kwargs.setdefault("allow_overwrite", True)  # a concurrent writer stores the same bytes
+        super().__init__(**kwargs)
+        self.references = tuple(references)
+        self.grace = grace  # seconds a reused file is safe from delete()
+
+    @staticmethod
+    def content_name(name, content):
+        """`<upload dir>/<digest[:2]>/<digest><ext>` for `content` uploaded as `name`."""
+        sha256 = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        content.seek(0)
+        digest = sha256.hexdigest()
+        directory, filename = posixpath.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return posixpath.join(directory, digest[:2], digest + extension)
+
+    def _save(self, name, content):
+        if CONTENT_NAME.match(name) is None:
+            name = self.content_name(name, content)
+        try:
+            os.utime(self.path(name))  # already stored: deduplicated, and marked as in use
+            return name
+        except FileNotFoundError:
+            return super()._save(name, content)
+
+    def reference_count(self, name):
+        """Rows that point at `name`, summed over `references`."""
+        count = 0
+        for reference in self.references:
+            label, field = reference.rsplit(".", 1)
+            count += apps.get_model(label).objects.filter(**{field: name}).count()
+        return count
+
+    def _recently_used(self, path):
+        return time.time() - os.stat(path).st_mtime < self.grace
+
+    def delete(self, name):
+        """Remove `name` unless a row still references it or it was used within `grace` seconds."""
+        if not name or self.reference_count(name) != 0:
+            return
+        if CONTENT_NAME.match(name) is None:  # nothing deduplicates onto other names
+            super().delete(name)
+            return
+        path = self.path(name)
+        aside = f"{path}.{os.getpid()}.deleting"
+        try:
+            if self._recently_used(path):
+                return
+            os.rename(path, aside)
+        except FileNotFoundError:
+            return
+        if self._recently_used(aside):  # reused just before the rename
+            os.replace(aside, path)  # same bytes as any copy written since
+        else:
+            os.remove(aside)
+
+
+def structure_image_storage():
+    return ContentAddressedStorage(references=("DB.Glycan.graphical_structure",))
+
+
+# ---------------------------------------------------------------------------
+# Migrating files stored under their upload names
+# ---------------------------------------------------------------------------
+def glycan_image_storage():
+    """The storage instance `Glycan.graphical_structure` uses."""
+    return apps.get_model("DB", "Glycan")._meta.get_field("graphical_structure").storage
+
+
+def migrate_existing(dry_run=False, progress=None):
+    """
+    Move every `Glycan.graphical_structure` file that isn't content-addressed
+    yet to its content name, and point the rows at it. Old names go through
+    the refcounted `delete()`, so files still in use elsewhere stay.
+
+    Returns `{"files", "rows", "missing", "bytes_before", "bytes_after"}`.
+    The byte counts are the disk use of the migrated files before and after
+    deduplication.
+    """
+    from . import table_versions  # imports the models, which import this module
+
+    Glycan = apps.get_model("DB", "Glycan")
+    storage = glycan_image_storage()
+    names = sorted(
+        name
+        for name in set(Glycan.objects.values_list("graphical_structure", flat=True))
+        if name and CONTENT_NAME.match(name) is None
+    )
+    stats = {"files": 0, "rows": 0, "missing": 0, "bytes_before": 0, "bytes_after": 0}
+    targets = set()
+    for name in names:
+        if not storage.exists(name):
+            stats["missing"] += 1
+            if progress:
+                progress(name, None)
+            continue
+        with storage.open(name, "rb") as file:
+            target = storage.content_name(name, file)
+            if not dry_run:
+                target = storage.save(name, file)
+        size = storage.size(name)
+        stats["files"] += 1
+        stats["bytes_before"] += size
+        if target not in targets:
+            targets.add(target)
+            stats["bytes_after"] += size
+        if not dry_run:
+            with transaction.atomic():
+                stats["rows"] += Glycan.objects.filter(graphical_structure=name).update(graphical_structure=target)
+                table_versions.bump(Glycan._meta.db_table)
+            storage.delete(name)
+        else:
+            stats["rows"] += Glycan.objects.filter(graphical_structure=name).count()
+        if progress:
+            progress(name, target)
+    return stats
+
+
+def unreferenced_files(directory="images"):
+    """Stored files under `directory` that no glycan references."""
+    Glycan = apps.get_model("DB", "Glycan")
+    storage = glycan_image_storage()
+    referenced = set(Glycan.objects.values_list("graphical_structure", flat=True))
+    if not storage.exists(directory):
+        return []
+    found = []
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        subdirectories, files = storage.listdir(current)
+        pending.extend(posixpath.join(current, sub) for sub in subdirectories)
+        found.extend(posixpath.join(current, f) for f in files if posixpath.join(current, f) not in referenced)
+    return sorted(found)
@@ -0,0 +1,103 @@
+"""
+Per-table change counters for HTTP caching.
+
+Every write to a tracked table increments its `TableVersion` row in the
+same transaction (signal handlers in signals.py; bulk paths call `bump()`
+themselves). A response built from tables T1..Tn is therefore unchanged
+for as long as their versions are. `snapshot()` returns them, and api.py
+turns that into ETag / Last-Modified validators.
+"""
+
+import time
+
+from django.db import connection
+
+from .models import (
+    Glycan,
+    LastAuthor,
+    Measurement,
+    ModelSpecies,
+    MonosaccharideComposition,
+    OntogenicStage,
+    Sample,
+    Study,
+    TableVersion,
+    Tissue,
+)
+
+TRACKED_MODELS = (
+    Glycan,
+    MonosaccharideComposition,
+    ModelSpecies,
+    Tissue,
+    OntogenicStage,
+    Study,
+    LastAuthor,
+    Sample,
+    Measurement,
+    Glycan.model_species.through,
+    Glycan.studies.through,
+    Study.last_authors.through,
+)
+
+
+def bump(*tables):
+    """Increment the version of each db_table in `tables`; returns `{table: new version}`."""
+    q = connection.ops.quote_name
+    versions = {}
+    with connection.cursor() as cursor:
+        for table in sorted(set(tables)):  # fixed order: no deadlocks between bumpers
+            cursor.execute(
+                f"INSERT INTO {q(TableVersion._meta.db_table)} AS v (\"table\", version, updated_at) "
+                "VALUES (%s, 1, now()) "
+                "ON CONFLICT (\"table\") DO UPDATE SET version = v.version + 1, updated_at = now() "
+                "RETURNING version",
+                [table],
+            )
+            versions[table] = cursor.fetchone()[0]
+    return versions
+
+
+def snapshot(tables):
+    """`(versions, last_modified)` for `tables`: one version per table (0 if never bumped)."""
+    rows = dict(
+        (table, (version, updated_at))
+        for table, version, updated_at in TableVersion.objects.filter(table__in=tables).values_list(
+            "table", "version", "updated_at"
+        )
+    )
+    versions = tuple(rows.get(table, (0, None))[0] for table in tables)
+    stamps = [updated_at for _, updated_at in rows.values()]
+    return versions, max(stamps) if stamps else None
+
+
+def version(table):
+    """The current version of one db_table (0 if never bumped)."""
+    return snapshot([table])[0][0]
+
+
+# In-memory indexes check the version on every lookup; outside transactions
+# the answer is reused for RECENT_SECONDS, so a busy worker asks at most
+# about once a second and sees other processes' writes within that time.
+RECENT_SECONDS = 1.0
+_recent = {}  # table -> (version, time.monotonic() when read)
+
+
+def recent_version(table):
+    """`version(table)`, as read at most RECENT_SECONDS ago."""
+    cached = _recent.get(table)
+    now = time.monotonic()
+    if cached is not None and now - cached[1] < RECENT_SECONDS:
+        return cached[0]
+    current = version(table)
+    # Inside a transaction the read may include uncommitted bumps: don't share it.
+    if not connection.in_atomic_block:
+        _recent[table] = (current, now)
+    return current
+
+
+def committed(table, version):
+    """Note that `version` of `table` is committed (by this process's own write)."""
+    cached = _recent.get(table)
+    if not connection.in_atomic_block and (cached is None or cached[0] < version):
+        _recent[table] = (version, time.monotonic())
@@ -1,7 +1,68 @@
-from django.test import TestCase, RequestFactory
+import csv
+import gzip
+import io
+import os
+import tempfile
+import time
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchQuery
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
 from django.contrib.admin.sites import AdminSite
-from .models import Glycan, MonosaccharideComposition
-from .admin import GlycanAdmin, GURangeFilter
+from .models import (
+    composition_ids,
+    Glycan,
+    GlycanSearch,
+    LastAuthor,
+    Measurement,
+    ModelSpecies,
+    MonosaccharideComposition,
+    OntogenicStage,
+    RegistryEntry,
+    Study,
+    Tissue,
+)
+from .admin import GlycanAdmin, GURangeFilter, ModelSpeciesAdmin, SpeciesFilter, StudyAdmin, TissueAdmin
+from . import (
+    abundance,
+    annotation,
+    batch_annotation,
+    bulk_export,
+    bulk_load,
+    composition_mass,
+    composition_query,
+    composition_space,
+    csv_schema,
+    disk_cache,
+    facets,
+    glycan_ids,
+    glycan_search,
+    gu_index,
+    isotopes,
+    mass_index,
+    motif_index,
+    profiles,
+    snfg,
+    storage,
+    table_versions,
+    text_search,
+    thumbnails,
+    wurcs,
+    xrefs,
+)
+from .gu_index import GuMassIndex
+from .mass_index import MassIndex
 
 class GURangeFilterTest(TestCase):
     def setUp(self):
@@ -21,3 +82,1360 @@ class GURangeFilterTest(TestCase):
         filtered = filter_instance.queryset(request, queryset)
         self.assertEqual(filtered.count(), 1)
         self.assertEqual(filtered.first().gu_mean, 3.0)
+
+
+class FacetTest(TestCase):
+    def setUp(self):
+        cache.clear()  # the versions in the cache keys restart with each test
+        self.addCleanup(cache.clear)
+        brain = Tissue.objects.create(organ="brain", structure="cortex")
+        self.human = ModelSpecies.objects.create(species_name="Homo sapiens", tissue=brain)
+        self.mouse = ModelSpecies.objects.create(species_name="Mus musculus")
+        for n, (mass, gu) in enumerate([(900, 1.5), (1200, 3.0), (2500, None)]):
+            glycan = Glycan.objects.create(id=f"LBG-F000{n}", mass=mass, gu_mean=gu)
+            glycan.model_species.add(self.human, self.mouse)  # fan-out must not double-count
+        self.admin = GlycanAdmin(Glycan, AdminSite())
+
+    def test_counts_from_one_grouped_query(self):
+        with self.assertNumQueries(2):  # the table versions, then the grouped query
+            counts = facets.counts()
+        with self.assertNumQueries(1):
+            facets.counts()
+        self.assertEqual(counts["species"], {"Homo sapiens": ("Homo sapiens", 3), "Mus musculus": ("Mus musculus", 3)})
+        self.assertEqual(list(counts["tissue"].values()), [("brain - cortex", 3)])
+        self.assertEqual(counts["gu"]["0-2"], ("0.0 - 2.0", 1))
+        self.assertEqual(counts["mass"]["2000+"], ("> 2000", 1))
+        self.assertEqual(counts["mass"]["1500-2000"], ("1500 - 2000", 0))
+
+    def test_filters_show_counts_and_use_exists(self):
+        request = RequestFactory().get("/")
+        species = SpeciesFilter(request, {}, Glycan, self.admin)
+        self.assertIn(("Homo sapiens", "Homo sapiens (3)"), species.lookup_choices)
+        species.value = lambda: "Homo sapiens"
+        filtered = species.queryset(request, Glycan.objects.all())
+        self.assertIn("EXISTS", str(filtered.query))
+        self.assertEqual(filtered.count(), 3)
+
+        Glycan.objects.get(pk="LBG-F0000").model_species.remove(self.human)
+        self.assertEqual(facets.counts()["species"]["Homo sapiens"][1], 2)
+        # Writes that skip signals (another process, a bulk load) bump the version.
+        Glycan.objects.filter(pk="LBG-F0001").update(mass=2100)
+        table_versions.bump(Glycan._meta.db_table)
+        self.assertEqual(facets.counts()["mass"]["2000+"][1], 2)
+
+
+class GlycanIdAllocatorTest(TestCase):
+    def next_sequence_value(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT last_value, is_called FROM lbg_glycan_id_seq")
+            last, called = cursor.fetchone()
+        return last + 1 if called else last
+
+    def test_python_mirror_matches_sql(self):
+        values = [0, 1, 2, 35, 36, 1_000_000, glycan_ids.SPACE - 1]
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT lbg_encode_glycan_id(n) FROM unnest(%s::bigint[]) AS n", [values])
+            self.assertEqual([row[0] for row in cursor.fetchall()], [glycan_ids.encode(n) for n in values])
+        self.assertEqual(len({glycan_ids.encode(n) for n in range(10_000)}), 10_000)
+
+    def test_ids_assigned_on_insert_skip_legacy_codes(self):
+        n = self.next_sequence_value()
+        Glycan.objects.create(id=glycan_ids.PREFIX + glycan_ids.encode(n))  # a legacy random ID
+        glycan = Glycan.objects.create(mass=1000.0)
+        self.assertEqual(glycan.pk, glycan_ids.PREFIX + glycan_ids.encode(n + 1))
+        self.assertEqual(Glycan.objects.get(pk=glycan.pk).mass, 1000.0)
+
+        reserved = glycan_ids.reserve_glycan_ids(50)
+        self.assertEqual(reserved, [glycan_ids.PREFIX + glycan_ids.encode(n + 2 + i) for i in range(50)])
+
+
+class MassIndexTest(TestCase):
+    def setUp(self):
+        Glycan.objects.create(id="LBG-M0001", mass=1130.58, theoretical_mass=1130.51)
+        Glycan.objects.create(id="LBG-M0002", mass=1130.60)
+        Glycan.objects.create(id="LBG-M0003", mass=1276.64)
+        self.index = MassIndex("mass").load()
+        self.addCleanup(mass_index.reset_indexes)
+
+    def test_ppm_and_da_windows(self):
+        hits = self.index.search(1130.59, ppm=20)
+        self.assertEqual({h[0] for h in hits}, {"LBG-M0001", "LBG-M0002"})
+        self.assertEqual([h[0] for h in self.index.search(1276.0, da=1.0)], ["LBG-M0003"])
+        self.assertEqual(self.index.search(1500.0, ppm=10), [])
+
+    def test_incremental_updates(self):
+        self.index.upsert("LBG-M0002", 1276.65)
+        self.index.upsert("LBG-M0004", 900.0)
+        self.index.remove("LBG-M0001")
+        masses, ids = self.index.snapshot()
+        self.assertEqual(list(ids), ["LBG-M0004", "LBG-M0003", "LBG-M0002"])
+        self.assertTrue((masses[:-1] <= masses[1:]).all())
+
+    def test_signals_keep_loaded_index_current(self):
+        index = mass_index.get_index("mass")
+        with self.captureOnCommitCallbacks(execute=True):
+            Glycan.objects.create(id="LBG-M0005", mass=1500.0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Glycan.objects.get(id="LBG-M0003").delete()
+        self.assertEqual([h[0] for h in index.search(1500.0, da=0.1)], ["LBG-M0005"])
+        self.assertEqual(index.search(1276.64, da=0.1), [])
+
+    def test_own_writes_patch_without_reload(self):
+        index = mass_index.get_index("mass")
+        with self.captureOnCommitCallbacks(execute=True):
+            Glycan.objects.create(id="LBG-M0005", mass=1500.0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Glycan.objects.get(id="LBG-M0003").delete()
+        with mock.patch.object(MassIndex, "load", side_effect=AssertionError("index reloaded")):
+            self.assertIs(mass_index.get_index("mass"), index)
+        self.assertEqual([h[0] for h in index.search(1500.0, da=0.1)], ["LBG-M0005"])
+
+    def test_reloads_when_table_version_changes(self):
+        # As another worker or a management command would: no signals here.
+        mass_index.get_index("mass")
+        Glycan.objects.filter(id="LBG-M0003").update(mass=1500.0)
+        self.assertEqual(mass_index.get_index("mass").search(1500.0, da=0.1), [])
+        table_versions.bump(Glycan._meta.db_table)
+        self.assertEqual([h[0] for h in mass_index.get_index("mass").search(1500.0, da=0.1)], ["LBG-M0003"])
+
+    def test_mass_search_endpoint(self):
+        response = self.client.get("/api/mass-search/", {"mz": "1130.58,1276.64", "da": "0.05"})
+        self.assertEqual(response.status_code, 200)
+        queries = response.json()["queries"]
+        self.assertEqual([m["id"] for m in queries[0]["matches"]], ["LBG-M0001", "LBG-M0002"])
+        self.assertEqual(self.client.get("/api/mass-search/", {"mz": "x"}).status_code, 400)
+
+
+class PeakAnnotationTest(TestCase):
+    PEAKS = "mz,charge,intensity,gu\n911.3353,1,1000,4.2\n456.1713,,250,\n933.317,1,80,\n500.0,1,10,\n"
+
+    def setUp(self):
+        Glycan.objects.create(id="LBG-P0001", mass=910.3278)  # H3N2
+        Glycan.objects.create(id="LBG-P0002", mass=1276.64)
+        self.addCleanup(mass_index.reset_indexes)
+
+    def test_vectorised_charge_and_adduct_states(self):
+        peaks = annotation.read_peak_list(io.StringIO(self.PEAKS))
+        masses, ids = mass_index.get_index("mass").snapshot()
+        result = annotation.annotate(peaks, masses, charges=(1, 2), adducts=("H", "Na"), ppm=10)
+        found = sorted(
+            (int(p), annotation.adduct_label(z, a), ids[lib])
+            for p, z, a, lib in zip(result.peak, result.charge, result.adduct, result.library)
+        )
+        self.assertEqual(
+            found,
+            [(0, "[M+H]+", "LBG-P0001"), (1, "[M+2H]2+", "LBG-P0001"), (2, "[M+Na]+", "LBG-P0001")],
+        )
+
+    def test_command_and_upload_endpoint(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "peaks.csv")
+        with open(path, "w") as f:
+            f.write(self.PEAKS)
+        out = io.StringIO()
+        call_command("annotate_peaks", path, "--adducts", "H,Na", stdout=out, stderr=io.StringIO())
+        rows = list(csv.reader(io.StringIO(out.getvalue())))
+        self.assertEqual(rows[0][0], "peak")
+        self.assertEqual(len(rows), 5)  # header + 3 matched peaks + 1 unmatched
+        self.assertEqual([r[7] for r in rows[1:]], ["LBG-P0001"] * 3 + [""])
+
+        upload = SimpleUploadedFile("peaks.csv", self.PEAKS.encode())
+        response = self.client.post("/api/annotate/", {"peaks": upload, "matched_only": "1"})
+        self.assertEqual(response.status_code, 200)
+        body = b"".join(response.streaming_content).decode()
+        self.assertEqual(len(body.strip().splitlines()), 3)  # header + 2 [M+H] matches
+
+    def test_non_positive_tolerances_rejected(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "peaks.csv")
+        with open(path, "w") as f:
+            f.write(self.PEAKS)
+        for options in (["--ppm", "0"], ["--ppm", "-5"], ["--gu-tolerance", "0"], ["--gu-tolerance", "-0.1"]):
+            with self.assertRaisesMessage(CommandError, "must be positive"):
+                call_command("annotate_peaks", path, *options, stdout=io.StringIO(), stderr=io.StringIO())
+        for fields in ({"ppm": "0"}, {"ppm": "-5"}, {"gu_tolerance": "0"}, {"gu_tolerance": "-0.1"}):
+            upload = SimpleUploadedFile("peaks.csv", self.PEAKS.encode())
+            self.assertEqual(self.client.post("/api/annotate/", {"peaks": upload, **fields}).status_code, 400)
+        for params in ({"ppm": "0"}, {"ppm": "-5"}, {"da": "0"}, {"da": "-0.1"}):
+            self.assertEqual(self.client.get("/api/mass-search/", {"mz": "910.33", **params}).status_code, 400)
+
+
+class IsotopeEnvelopeTest(TestCase):
+    def setUp(self):
+        self.enterContext(override_settings(CACHE_DIR=self.enterContext(tempfile.TemporaryDirectory())))
+        self.addCleanup(isotopes.reset_tables)
+        self.addCleanup(mass_index.reset_indexes)
+        self.counts = (3, 2, 0, 0, 0, 0, 0, 0, 0)  # H3N2
+        self.composition = MonosaccharideComposition.objects.create(H_num=3, N_num=2)
+        self.mass = float(composition_mass.composition_masses([self.counts])[0])
+        Glycan.objects.create(id="LBG-I0001", mass=self.mass, monosaccharide_comp=self.composition)
+        Glycan.objects.create(id="LBG-I0002", mass=self.mass + 300.0)  # no composition
+
+    def test_fft_envelopes(self):
+        # Pure carbon is a binomial distribution.
+        envelope = isotopes.envelopes([[100, 0, 0, 0, 0, 0]])[0]
+        self.assertAlmostEqual(envelope[1] / envelope[0], 100 * 0.0107 / 0.9893, places=4)
+        self.assertAlmostEqual(envelope[2] / envelope[0], 4950 * 0.0107**2 / 0.9893**2, places=4)
+
+        table = isotopes.get_table()
+        found, present = table.lookup([self.composition.pk, 10**9])
+        self.assertEqual(list(present), [True, False])
+        np.testing.assert_allclose(found[0], isotopes.composition_envelopes([self.counts])[0])
+        envelopes = isotopes.library_envelopes([self.composition.pk, -1], [self.mass, self.mass + 300.0])
+        self.assertGreater(envelopes[1][1] / envelopes[1][0], envelopes[0][1] / envelopes[0][0])  # heavier
+
+    def test_table_follows_compositions(self):
+        masses, ids, composition_ids = mass_index.get_index("mass").library()
+        self.assertEqual(dict(zip(ids, composition_ids)), {"LBG-I0001": self.composition.pk, "LBG-I0002": -1})
+        expected = isotopes.library_envelopes(composition_ids, masses)
+        with self.assertNumQueries(1):  # the composition table version, no glycan lookups
+            np.testing.assert_array_equal(isotopes.library_envelopes(composition_ids, masses), expected)
+
+        added = MonosaccharideComposition.objects.create(H_num=5, N_num=4)
+        found, present = isotopes.get_table().lookup([added.pk])
+        self.assertTrue(present[0])
+        np.testing.assert_allclose(found[0], isotopes.composition_envelopes([(5, 4, 0, 0, 0, 0, 0, 0, 0)])[0])
+
+    def peaks(self, ks, scale=1000.0):
+        envelope = isotopes.composition_envelopes([self.counts])[0]
+        rows = [f"{self.mass + k * isotopes.ISOTOPE_SPACING + annotation.ADDUCTS['H']:.5f},1,{scale * envelope[k]:.3f}" for k in ks]
+        return annotation.read_peak_list(io.StringIO("mz,charge,intensity\n" + "\n".join(rows) + "\n"))
+
+    def annotate(self, peaks):
+        masses, ids, composition_ids = mass_index.get_index("mass").library()
+        envelopes = isotopes.library_envelopes(composition_ids, masses)
+        return isotopes.annotate(peaks, masses, envelopes, charges=(1,), ppm=10, isotope_errors=(0, 1))
+
+    def test_envelope_scoring(self):
+        result = self.annotate(self.peaks(range(4)))
+        by_peak = {(int(p), int(k)): float(score) for p, k, score in zip(result.peak, result.isotope, result.envelope_score)}
+        self.assertGreater(by_peak[(0, 0)], 0.999)
+        self.assertIn((1, 1), by_peak)  # the M+1 peak is also recognised
+
+        # The instrument only picked up M+1 onwards: matched as an isotope peak,
+        # but the missing monoisotopic peak costs score.
+        result = self.annotate(self.peaks(range(1, 4)))
+        self.assertEqual([(int(p), int(k)) for p, k in zip(result.peak, result.isotope)], [(0, 1)])
+        self.assertLess(result.envelope_score[0], 0.95)
+
+    def test_command(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "peaks.csv")
+        with open(path, "w") as f:
+            f.write(f"mz,charge,intensity\n{self.mass + annotation.ADDUCTS['H'] + isotopes.ISOTOPE_SPACING:.5f},1,100\n")
+        out = io.StringIO()
+        call_command("annotate_peaks", path, "--isotope-errors", "0,1", "--charges", "1", stdout=out, stderr=io.StringIO())
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual((rows[0]["glycan_id"], rows[0]["isotope"]), ("LBG-I0001", "1"))
+        out = io.StringIO()
+        call_command("build_isotope_envelopes", stdout=out)
+        self.assertIn("Stored 1 envelopes", out.getvalue())
+
+
+class BatchAnnotationTest(TestCase):
+    def setUp(self):
+        composition = MonosaccharideComposition.objects.create(H_num=3, N_num=2)
+        Glycan.objects.create(id="LBG-B0001", mass=910.3278, gu_mean=4.2, monosaccharide_comp=composition)
+        Glycan.objects.create(id="LBG-B0002", mass=1276.64)
+        self.addCleanup(mass_index.reset_indexes)
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        with open(os.path.join(self.directory, "run1.csv"), "w") as f:
+            f.write(PeakAnnotationTest.PEAKS)
+        with gzip.open(os.path.join(self.directory, "run2.csv.gz"), "wt") as f:
+            f.write("mz,charge\n1277.6473,1\n")
+        with open(os.path.join(self.directory, "broken.csv"), "w") as f:
+            f.write("intensity\n5\n")
+        with open(os.path.join(self.directory, "notes.txt"), "w") as f:
+            f.write("not a run")
+
+    def test_shared_library(self):
+        arrays = batch_annotation.library_arrays()
+        self.assertEqual(list(arrays["ids"]), ["LBG-B0001", "LBG-B0002"])
+        self.assertEqual(list(arrays["composition"]), ["H3N2", ""])
+        with batch_annotation.SharedLibrary.create(arrays) as library:
+            attached = batch_annotation.SharedLibrary.attach(library.spec)
+            np.testing.assert_array_equal(attached.mass, arrays["mass"])
+            np.testing.assert_array_equal(attached.gu, arrays["gu"])
+            self.assertEqual(attached.ids[1], "LBG-B0002")
+            attached.close()
+
+    def test_command_csv_matches_annotate_peaks(self):
+        output = os.path.join(self.directory, "out", "all.csv")
+        os.mkdir(os.path.dirname(output))
+        out, err = io.StringIO(), io.StringIO()
+        call_command("annotate_runs", self.directory, "-o", output, "-j", "2", "--adducts", "H,Na", stdout=out, stderr=err)
+        self.assertIn("Annotated 2 runs (5 peaks, 4 matches)", out.getvalue())
+        self.assertIn("broken: skipped (Peak list has no m/z column.)", err.getvalue())
+        with open(output, newline="") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(tuple(rows[0]), batch_annotation.BATCH_HEADER)
+        by_run = {}
+        for row in rows[1:]:
+            by_run.setdefault(row[0], []).append(row)
+        self.assertEqual([r[8] for r in by_run["run2"]], ["LBG-B0002"])
+        self.assertEqual(by_run["run2"][0][-1], "")
+
+        single = io.StringIO()
+        call_command(
+            "annotate_peaks", os.path.join(self.directory, "run1.csv"), "--adducts", "H,Na",
+            stdout=single, stderr=io.StringIO(),
+        )
+        expected = list(csv.reader(io.StringIO(single.getvalue())))[1:]
+        self.assertEqual([r[1:-1] for r in by_run["run1"]], expected)
+        self.assertEqual([r[-1] for r in by_run["run1"]], ["H3N2"] * 3 + [""])
+
+    def test_parquet_output(self):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        output = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "all.parquet")
+        call_command(
+            "annotate_runs", self.directory, "-o", output, "--gu-tolerance", "0.2", "--matched-only",
+            stdout=io.StringIO(), stderr=io.StringIO(),
+        )
+        table = pq.read_table(output).to_pylist()
+        self.assertEqual([(r["run"], r["glycan_id"], r["composition"]) for r in table], [("run1", "LBG-B0001", "H3N2")])
+        self.assertEqual(table[0]["gu_error"], 0.0)
+        self.assertIsNone(table[0]["isotope"])
+
+    def test_command_rejects_bad_options(self):
+        output = os.path.join(self.directory, "all.csv")
+        for options in (["--ppm", "0"], ["--ppm", "-5"], ["--gu-tolerance", "0"], ["-j", "0"]):
+            with self.assertRaises(CommandError):
+                call_command("annotate_runs", self.directory, "-o", output, *options, stdout=io.StringIO())
+        self.assertFalse(os.path.exists(output))
+
+
+class GuMassIndexTest(TestCase):
+    def setUp(self):
+        Glycan.objects.create(id="LBG-G0001", mass=1000.0, gu_mean=4.0, gu_min=3.8, gu_max=4.3)
+        Glycan.objects.create(id="LBG-G0002", mass=1000.005, gu_mean=6.0, gu_min=6.0, gu_max=6.0)
+        Glycan.objects.create(id="LBG-G0003", mass=1000.002, gu_mean=4.45)
+        Glycan.objects.create(id="LBG-G0004", mass=1500.0)  # no GU: not indexed
+        self.index = GuMassIndex().load()
+        self.addCleanup(gu_index.reset_indexes)
+
+    def test_gu_interval_and_ranking(self):
+        self.assertEqual(len(self.index), 3)
+        matches = self.index.match([1000.001, 1000.0], [4.4, 6.1], ppm=10, delta_gu=0.2)
+        found = [(int(q), self.index.ids[lib]) for q, lib in zip(matches.query, matches.library)]
+        # Query 0 is 0.05 GU from G0003 and 0.1 GU past the end of G0001's range.
+        self.assertEqual(found, [(0, "LBG-G0003"), (0, "LBG-G0001"), (1, "LBG-G0002")])
+        self.assertAlmostEqual(matches.gu_error[1], 0.1)
+
+    def test_gu_mass_search_endpoint(self):
+        response = self.client.get(
+            "/api/gu-mass-search/", {"mass": "1000.0,1000.0", "gu": "4.0,9.0", "gu_tolerance": "0.1"}
+        )
+        self.assertEqual(response.status_code, 200)
+        queries = response.json()["queries"]
+        self.assertEqual([m["id"] for m in queries[0]["matches"]], ["LBG-G0001"])
+        self.assertEqual(queries[1]["matches"], [])
+
+    def test_non_positive_tolerances_rejected(self):
+        with self.assertRaises(ValueError):
+            self.index.match([1000.0], [4.0], ppm=0)
+        with self.assertRaises(ValueError):
+            self.index.match([1000.0], [4.0], delta_gu=-0.1)
+        for params in ({"ppm": "0"}, {"gu_tolerance": "-1"}, {"ppm": "nan"}):
+            response = self.client.get("/api/gu-mass-search/", {"mass": "1000.0", "gu": "4.0", **params})
+            self.assertEqual(response.status_code, 400)
+
+
+class CompositionMassTest(TestCase):
+    def test_known_masses(self):
+        # Man3GlcNAc2 (H3N2) and FA2G2S2 (H5N4F1S2), free reducing end.
+        masses = composition_mass.composition_masses([(3, 2, 0, 0, 0, 0, 0, 0, 0), (5, 4, 1, 0, 0, 0, 2, 0, 0)])
+        self.assertAlmostEqual(masses[0], 910.3278, places=3)
+        self.assertAlmostEqual(masses[1], 2368.8409, places=3)
+        labelled = composition_mass.composition_masses([(3, 2, 0, 0, 0, 0, 0, 0, 0)], tag="procainamide")
+        self.assertAlmostEqual(labelled[0] - masses[0], 219.1735, places=3)
+        permethylated = composition_mass.composition_masses(
+            [(3, 2, 0, 0, 0, 0, 0, 0, 0)], derivatization="permethylated"
+        )
+        self.assertAlmostEqual(permethylated[0], 1148.5938, places=3)
+
+    def test_command_fills_missing_theoretical_masses(self):
+        comp = MonosaccharideComposition.objects.create(H_num=3, N_num=2)
+        Glycan.objects.create(id="LBG-T0001", monosaccharide_comp=comp)
+        Glycan.objects.create(id="LBG-T0002", monosaccharide_comp=comp, theoretical_mass=900.0)
+        call_command("compute_theoretical_masses", stdout=io.StringIO())
+        self.assertAlmostEqual(Glycan.objects.get(id="LBG-T0001").theoretical_mass, 910.3278, places=3)
+        self.assertEqual(Glycan.objects.get(id="LBG-T0002").theoretical_mass, 900.0)
+
+        out = io.StringIO()
+        call_command("compute_theoretical_masses", "--check", stdout=out)
+        self.assertIn("LBG-T0002", out.getvalue())
+        call_command("compute_theoretical_masses", "--overwrite", stdout=io.StringIO())
+        self.assertAlmostEqual(Glycan.objects.get(id="LBG-T0002").theoretical_mass, 910.3278, places=3)
+
+
+class CompositionSpaceTest(TestCase):
+    def test_build_and_search(self):
+        path = self.enterContext(tempfile.TemporaryDirectory())
+        bounds = composition_space.parse_bounds("H0-12,N0-8,F0-4,S0-4")
+        composition_space.build_space(path, bounds)
+        space = composition_space.CompositionSpace.open(path)
+        self.assertEqual(len(space), 13 * 9 * 5 * 5)
+        self.assertTrue((space.masses[:-1] <= space.masses[1:]).all())
+        hits = space.search(2368.8409, ppm=5)
+        self.assertIn("H5N4F1S2", [h[0] for h in hits])
+        self.assertEqual(len(list(composition_space.iter_compositions({"H": (0, 2), "N": (1, 2)}))), 6)
+
+    def test_endpoint(self):
+        self.enterContext(override_settings(CACHE_DIR=self.enterContext(tempfile.TemporaryDirectory())))
+        self.enterContext(mock.patch.object(composition_space, "_space", None))
+        url = "/api/composition-mass-search/"
+        self.assertEqual(self.client.get(url, {"mass": "2368.8409"}).status_code, 503)  # not built yet
+        composition_space.build_space(composition_space.default_path(), composition_space.parse_bounds("H3-6,N2-5,F0-1,S0-2"))
+        response = self.client.get(url, {"mass": "2368.8409,910.3278", "ppm": "5"})
+        self.assertEqual(response.status_code, 200)
+        queries = response.json()["queries"]
+        self.assertIn("H5N4F1S2", [m["composition"] for m in queries[0]["matches"]])
+        self.assertEqual(queries[1]["matches"][0]["composition"], "H3N2")
+        self.assertEqual(self.client.get(url, {"mass": "910.3", "da": "0"}).status_code, 400)
+
+
+class CompositionQueryTest(TestCase):
+    def setUp(self):
+        for h, n, f, s in [(5, 4, 0, 0), (5, 4, 1, 0), (5, 4, 1, 2), (3, 4, 1, 0), (6, 4, 0, 1)]:
+            comp = MonosaccharideComposition.objects.create(H_num=h, N_num=n, F_num=f, S_num=s)
+            Glycan.objects.create(monosaccharide_comp=comp)
+
+    def matches(self, query):
+        condition = composition_query.compile_query(query)
+        return sorted(MonosaccharideComposition.objects.filter(condition).values_list("composition_string", flat=True))
+
+    def test_grammar(self):
+        self.assertEqual(self.matches("H5N4"), ["H5N4"])
+        self.assertEqual(self.matches("H5N4F*S*"), ["H5N4", "H5N4F1", "H5N4F1S2"])
+        self.assertEqual(self.matches("H3-5N4F>=1S*"), ["H3N4F1", "H5N4F1", "H5N4F1S2"])
+        self.assertEqual(self.matches("h5, n4, f1+, s<=1"), ["H5N4F1"])
+        self.assertEqual(composition_query.parse("N4")["H"], (0, 0))
+        for bad in ("", "H", "H5H6", "X1", "H5-3", "G00031MO"):
+            with self.assertRaises(ValueError):
+                composition_query.parse(bad)
+
+    def test_admin_and_endpoint(self):
+        request = RequestFactory().get("/")
+        admin = GlycanAdmin(Glycan, AdminSite())
+        found, may_have_duplicates = admin.get_search_results(request, Glycan.objects.all(), "H5N4F1S*")
+        self.assertEqual(found.count(), 2)
+        self.assertFalse(may_have_duplicates)
+        Glycan.objects.filter(monosaccharide_comp__composition_string="H3N4F1").update(glytoucan_id="G00031MO")
+        found, _ = admin.get_search_results(request, Glycan.objects.all(), "G00031MO")
+        self.assertEqual(found.count(), 1)  # not a query: normal search_fields lookup
+
+        response = self.client.get("/api/composition-search/", {"q": "H>=5N4S1-2F*"})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([r["composition_string"] for r in results], ["H5N4F1S2", "H6N4S1"])
+        self.assertEqual(len(results[0]["glycans"]), 1)
+        self.assertEqual(self.client.get("/api/composition-search/", {"q": "H5Q1"}).status_code, 400)
+
+
+class GlycanSearchTest(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.comp = MonosaccharideComposition.objects.create(H_num=5, N_num=4, F_num=1)
+            self.tissue = Tissue.objects.create(organ="brain", structure="cortex")
+            self.species = ModelSpecies.objects.create(species_name="Mus musculus", taxid="10090", tissue=self.tissue)
+            self.study = Study.objects.create(title="Brain N-glycome", doi="10.1000/brain")
+            self.glycan = Glycan.objects.create(id="LBG-S0001", monosaccharide_comp=self.comp, mass=1786.6, gu_mean=6.1)
+            self.glycan.model_species.add(self.species)
+            self.glycan.studies.add(self.study)
+
+    def row(self):
+        return GlycanSearch.objects.get(glycan_id="LBG-S0001")
+
+    def test_flattened_row(self):
+        row = self.row()
+        self.assertEqual((row.composition_string, row.H_num, row.F_num, row.mass), ("H5N4F1", 5, 1, 1786.6))
+        self.assertEqual(row.species_names, ["Mus musculus"])
+        self.assertEqual(row.taxids, ["10090"])
+        self.assertEqual(row.tissues, ["brain - cortex"])
+        self.assertEqual(row.study_dois, ["10.1000/brain"])
+
+    def test_related_changes_refresh_affected_rows(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tissue.structure = "hippocampus"
+            self.tissue.save()
+        self.assertEqual(self.row().tissues, ["brain - hippocampus"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.study.glycan_set.clear()
+            self.comp.delete()
+        row = self.row()
+        self.assertEqual((row.study_dois, row.composition_string, row.H_num), ([], "", None))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.glycan.delete()
+        self.assertFalse(GlycanSearch.objects.exists())
+
+    def test_rebuild(self):
+        GlycanSearch.objects.all().delete()
+        call_command("rebuild_glycan_search", stdout=io.StringIO())
+        self.assertEqual(self.row().species_names, ["Mus musculus"])
+        self.assertEqual(glycan_search.affected_glycans(Tissue, [self.tissue.pk]), ["LBG-S0001"])
+
+
+class ThumbnailTest(TestCase):
+    def setUp(self):
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+
+    def png(self, color="red"):
+        buffer = io.BytesIO()
+        Image.new("RGB", (800, 400), color).save(buffer, "PNG")
+        return SimpleUploadedFile("snfg.png", buffer.getvalue(), content_type="image/png")
+
+    def test_upload_makes_hashed_thumbnails(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            glycan = Glycan.objects.create(graphical_structure=self.png())
+        glycan.refresh_from_db()
+        self.assertEqual(len(glycan.image_digest), 64)
+        with default_storage.open(thumbnails.thumbnail_name(glycan.image_digest, 200, "webp")) as file:
+            self.assertEqual(Image.open(file).size, (200, 100))
+        self.assertIn(thumbnails.thumbnail_url(glycan.image_digest, 100, "webp"), GlycanAdmin(Glycan, AdminSite()).display_image(glycan))
+
+        # Saving again doesn't re-read the image; clearing it drops the digest.
+        with mock.patch.object(thumbnails, "update_glycan") as update:
+            with self.captureOnCommitCallbacks(execute=True):
+                glycan.save()
+        update.assert_not_called()
+        glycan.graphical_structure = None
+        glycan.save()
+        self.assertEqual(Glycan.objects.get(pk=glycan.pk).image_digest, "")
+
+    def test_served_immutable(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            glycan = Glycan.objects.create(graphical_structure=self.png())
+        glycan.refresh_from_db()
+        url = thumbnails.thumbnail_url(glycan.image_digest, 100, "png")
+        response = self.client.get(url)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(self.client.get(url, headers={"if-none-match": response["ETag"]}).status_code, 304)
+        self.assertEqual(self.client.get(url.replace("-100.", "-150.")).status_code, 404)
+
+    def test_backfill_command(self):
+        name = default_storage.save("images/old.png", self.png("blue"))
+        Glycan.objects.bulk_create([Glycan(graphical_structure=name), Glycan(graphical_structure=name)])
+        Glycan.objects.create(graphical_structure=default_storage.save("images/old.svg", io.BytesIO(b"<svg/>")))
+        out = io.StringIO()
+        call_command("build_thumbnails", "-j", "2", stdout=out, stderr=io.StringIO())
+        self.assertIn("Thumbnailed 1 images (1 skipped)", out.getvalue())
+        self.assertEqual(Glycan.objects.filter(graphical_structure=name).exclude(image_digest="").count(), 2)
+        digest = Glycan.objects.filter(graphical_structure=name).first().image_digest
+        self.assertTrue(default_storage.exists(thumbnails.thumbnail_name(digest, 400, "webp")))
+
+
+class ContentAddressedStorageTest(TestCase):
+    def setUp(self):
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.storage = storage.glycan_image_storage()
+
+    def upload(self, data, name="snfg.png"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Glycan.objects.create(graphical_structure=SimpleUploadedFile(name, data))
+
+    def test_identical_uploads_share_one_refcounted_file(self):
+        first = self.upload(b"same bytes", "a.png")
+        second = self.upload(b"same bytes", "b.PNG")
+        name = first.graphical_structure.name
+        self.assertEqual(second.graphical_structure.name, name)
+        self.assertRegex(name, r"^images/([0-9a-f]{2})/\1[0-9a-f]{62}\.png$")
+        self.assertEqual(self.storage.listdir(os.path.dirname(name))[1], [os.path.basename(name)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(self.storage.exists(name))  # still used by `second`
+        with self.captureOnCommitCallbacks(execute=True):
+            second.graphical_structure = SimpleUploadedFile("c.png", b"new bytes")
+            second.save()
+        self.assertTrue(self.storage.exists(name))  # released, but uploaded moments ago
+        self.age(name)
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+
+    def age(self, name):
+        stale = time.time() - self.storage.grace - 1
+        os.utime(self.storage.path(name), (stale, stale))
+
+    def test_reused_file_survives_release(self):
+        # An upload of the same bytes can find the file before the release
+        # runs, and only commit its row afterwards.
+        glycan = self.upload(b"same bytes")
+        name = glycan.graphical_structure.name
+        self.age(name)
+        self.assertEqual(self.storage.save("images/other.png", io.BytesIO(b"same bytes")), name)  # in flight
+        with self.captureOnCommitCallbacks(execute=True):
+            glycan.delete()
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(os.listdir(os.path.dirname(self.storage.path(name))), [os.path.basename(name)])
+
+        self.age(name)
+        out = io.StringIO()
+        call_command("migrate_media", "--prune", stdout=out)
+        self.assertIn("Deleted 1 unreferenced files", out.getvalue())
+        self.assertFalse(self.storage.exists(name))
+
+    def test_migrate_media_command(self):
+        legacy = FileSystemStorage()  # how files were stored before
+        names = [
+            legacy.save("images/6.12_292_H4N2.png", io.BytesIO(b"H4N2")),
+            legacy.save("images/6_hsRBWwT.12_292_H4N2.png", io.BytesIO(b"H4N2")),
+            legacy.save("images/6.16_1536_H3N4.png", io.BytesIO(b"H3N4")),
+        ]
+        orphan = legacy.save("images/unused.png", io.BytesIO(b"unused"))
+        Glycan.objects.bulk_create(Glycan(graphical_structure=name) for name in names + names[1:2])
+
+        out = io.StringIO()
+        call_command("migrate_media", "--dry-run", stdout=out)
+        self.assertIn("Would move 3 files (4 glycans): 12 bytes -> 8 bytes", out.getvalue())
+        self.assertTrue(all(legacy.exists(name) for name in names))
+
+        out = io.StringIO()
+        call_command("migrate_media", "--prune", stdout=out, stderr=io.StringIO())
+        self.assertIn("Moved 3 files (4 glycans): 12 bytes -> 8 bytes", out.getvalue())
+        self.assertIn("Deleted 1 unreferenced files", out.getvalue())
+        stored = set(Glycan.objects.values_list("graphical_structure", flat=True))
+        self.assertEqual(len(stored), 2)
+        self.assertTrue(all(storage.CONTENT_NAME.match(name) for name in stored))
+        self.assertFalse(any(legacy.exists(name) for name in names + [orphan]))
+
+
+class SnfgTest(TestCase):
+    # Core-fucosylated biantennary N-glycan, disialylated (a2-3 and a2-6).
+    WURCS = (
+        "WURCS=2.0/6,12,11/[a2122h-1b_1-5_2*NCC/3=O][a1122h-1b_1-5][a1122h-1a_1-5][a2112h-1b_1-5]"
+        "[Aad21122h-2a_2-6_5*NCC/3=O][a1221m-1a_1-5]/1-1-2-3-1-4-5-3-1-4-5-6/"
+        "a4-b1_a6-l1_b4-c1_c3-d1_c6-h1_d2-e1_e4-f1_f6-g2_h2-i1_i4-j1_j3-k2"
+    )
+
+    def setUp(self):
+        self.enterContext(override_settings(CACHE_DIR=self.enterContext(tempfile.TemporaryDirectory())))
+        self.enterContext(mock.patch.dict(snfg._caches, clear=True))
+
+    def test_parse(self):
+        structure = wurcs.parse(self.WURCS)
+        self.assertEqual(structure.root.name, "GlcNAc")
+        self.assertEqual(structure.composition(), {"N": 4, "H": 5, "S": 2, "F": 1})
+        core_mannose = structure.residues[2]
+        self.assertEqual([link.parent_position for link in core_mannose.children], [6, 3])  # 6-arm on top
+        self.assertEqual([link.child.name for link in structure.root.children], ["Fuc", "GlcNAc"])
+
+        floating = wurcs.parse(
+            "WURCS=2.0/2,3,2/[a2122h-1b_1-5][a2112h-1b_1-5_6*OSO/3=O/3=O]/1-1-2/a4-b1_c1-a?|b?}"
+        )
+        self.assertEqual([r.name for r in floating.floating], ["Gal"])
+        self.assertEqual(floating.floating[0].modifications, ("6S",))
+        for bad in ("", "WURCS=2.0/1,1,0/[a2122h-1b_1-5]/2/", "WURCS=2.0/1,2,1/[a2122h-1b_1-5]/1-1/a4-b1~n"):
+            with self.assertRaises(ValueError):
+                wurcs.parse(bad)
+
+    def test_render(self):
+        svg = snfg.render(self.WURCS, "svg").decode()
+        self.assertTrue(svg.startswith("<svg"))
+        self.assertEqual(svg.count('fill="#A54399"'), 2)  # two Neu5Ac diamonds
+        self.assertIn(">α6</text>", svg)
+        with Image.open(io.BytesIO(snfg.render(self.WURCS, "png"))) as image:
+            self.assertEqual(image.format, "PNG")
+
+    def test_floating_subtree_is_drawn(self):
+        # Gal-a3-Neu5Ac floating on either GlcNAc of a GlcNAc-GlcNAc-Man core.
+        width, height, primitives = snfg.layout(wurcs.parse(
+            "WURCS=2.0/4,5,4/[a2122h-1b_1-5_2*NCC/3=O][a1122h-1b_1-5][a2112h-1b_1-5][Aad21122h-2a_2-6_5*NCC/3=O]/"
+            "1-1-2-3-4/a4-b1_b4-c1_d3-e2_b4|c4}-{d1"
+        ))
+        kinds = [primitive[0] for primitive in primitives]
+        self.assertEqual(kinds.count("symbol"), 5)
+        self.assertEqual(kinds.count("line"), 3)  # the floating Gal-Neu5Ac link too
+        positions = [primitive[3:5] for primitive in primitives if primitive[0] == "symbol"]
+        self.assertEqual(len(set(positions)), 5)
+
+    def test_disk_cache_is_lru_bounded(self):
+        cache = disk_cache.DiskCache(self.enterContext(tempfile.TemporaryDirectory()), max_bytes=1000)
+        for i, key in enumerate(("aa1", "bb2", "cc3")):
+            cache.put(key, b"x" * 400)
+            os.utime(cache.path(key), (i, i))  # distinct use times
+            if key == "bb2":
+                self.assertEqual(cache.get("aa1"), b"x" * 400)  # aa1 becomes most recent
+        self.assertIsNone(cache.get("bb2"))  # least recently used went first
+        self.assertIsNotNone(cache.get("aa1"))
+        self.assertLessEqual(cache.size(), 1000)
+
+    def test_endpoint_and_cache(self):
+        glycan = Glycan.objects.create(wurcs=self.WURCS)
+        url = f"/api/glycans/{glycan.pk}/snfg.svg"
+        with mock.patch.object(snfg, "render", wraps=snfg.render) as render:
+            response = self.client.get(url)
+            self.assertEqual(self.client.get(url).content, response.content)
+        render.assert_called_once()  # the second request was a cache hit
+        self.assertEqual(response["Content-Type"], "image/svg+xml")
+        self.assertEqual(self.client.get(url, headers={"if-none-match": response["ETag"]}).status_code, 304)
+        self.assertIn(url, GlycanAdmin(Glycan, AdminSite()).display_image(glycan))
+        self.assertEqual(self.client.get(f"/api/glycans/{glycan.pk}/").json()["snfg"], url)
+        self.assertEqual(self.client.get(f"/api/glycans/{Glycan.objects.create().pk}/snfg.svg").status_code, 404)
+        self.assertEqual(self.client.get(f"/api/glycans/{glycan.pk}/snfg.gif").status_code, 400)
+
+    def test_render_command(self):
+        Glycan.objects.create(wurcs=self.WURCS)
+        Glycan.objects.create(wurcs="WURCS=2.0/1,2,1/[a2122h-1b_1-5]/1-1/a4-b1~n")  # repeating unit
+        out, err = io.StringIO(), io.StringIO()
+        call_command("render_snfg", "-j", "2", "--format", "svg", "--format", "png", stdout=out, stderr=err)
+        self.assertIn("Rendered 2 drawings (2 failed)", out.getvalue())
+        self.assertTrue(os.path.exists(snfg.get_cache().path(snfg.cache_key(self.WURCS, "png"))))
+
+
+class MotifIndexTest(TestCase):
+    FUCOSYLATED = SnfgTest.WURCS
+    # Bisected, agalactosylated biantennary N-glycan with a LacdiNAc antenna.
+    BISECTED = (
+        "WURCS=2.0/4,8,7/[a2122h-1b_1-5_2*NCC/3=O][a1122h-1b_1-5][a1122h-1a_1-5][a2112h-1b_1-5_2*NCC/3=O]/"
+        "1-1-2-3-1-4-3-1/a4-b1_b4-c1_c3-d1_c6-g1_c4-h1_d2-e1_e4-f1"
+    )
+
+    def setUp(self):
+        self.enterContext(mock.patch.object(motif_index, "_index", None))
+        self.fucosylated = Glycan.objects.create(wurcs=self.FUCOSYLATED)
+        self.bisected = Glycan.objects.create(wurcs=self.BISECTED)
+        Glycan.objects.create(wurcs="not WURCS")
+        Glycan.objects.create()
+
+    def search(self, motif):
+        return motif_index.get_index().search(motif)[0]
+
+    def test_named_motifs(self):
+        self.assertEqual(self.search("core_fucose"), [self.fucosylated.pk])
+        self.assertEqual(self.search("bisecting_glcnac"), [self.bisected.pk])
+        self.assertEqual(self.search("lacdinac"), [self.bisected.pk])
+        self.assertEqual(self.search("alpha2_6_sialic_acid"), [self.fucosylated.pk])
+        self.assertEqual(self.search("lewis_x"), [])
+        # Generic residues and unknown positions in a motif match anything.
+        self.assertEqual(
+            self.search("WURCS=2.0/2,2,1/[a2122h-1x_1-5_2*NCC/3=O][a2112h-1x_1-5]/1-2/a?-b1"),
+            [self.fucosylated.pk],
+        )
+        with self.assertRaises(ValueError):
+            self.search("sialyl_lewis_q")
+
+    def test_floating_antenna(self):
+        # Gal-a3-Neu5Ac whose attachment to the core is unknown.
+        floating = Glycan.objects.create(
+            wurcs="WURCS=2.0/4,5,4/[a2122h-1b_1-5_2*NCC/3=O][a1122h-1b_1-5][a2112h-1b_1-5]"
+            "[Aad21122h-2a_2-6_5*NCC/3=O]/1-1-2-3-4/a4-b1_b4-c1_d3-e2_b4|c4}-{d1"
+        )
+        self.assertEqual(self.search("alpha2_3_sialic_acid"), sorted([self.fucosylated.pk, floating.pk]))
+        self.assertEqual(self.search("alpha2_6_sialic_acid"), [self.fucosylated.pk])
+
+    def test_fingerprint_prefilters(self):
+        self.assertEqual(self.fucosylated.motif_fingerprint, motif_index.glycan_fingerprint(self.FUCOSYLATED))
+        self.assertEqual(len(motif_index.get_index()), 2)  # the unparsable WURCS is left out
+        _, candidates = motif_index.get_index().search("core_fucose")
+        self.assertEqual(candidates, 1)
+        # A motif's bits are always a subset of a glycan containing it.
+        for name in motif_index.MOTIFS:
+            structure, anchored = motif_index.resolve(name)
+            query = motif_index.fingerprint(motif_index.motif_features(structure, anchored))
+            for glycan in (self.fucosylated, self.bisected):
+                if motif_index.contains(motif_index.parse(glycan.wurcs), structure, anchored):
+                    row = np.frombuffer(glycan.motif_fingerprint, dtype="<u8")
+                    self.assertTrue(np.all(row & query == query), name)
+
+    def test_index_follows_saves(self):
+        motif_index.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bisected.wurcs = self.FUCOSYLATED
+            self.bisected.save()
+        self.assertEqual(self.search("core_fucose"), sorted([self.fucosylated.pk, self.bisected.pk]))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fucosylated.delete()
+        with mock.patch.object(motif_index.MotifIndex, "load", side_effect=AssertionError("index reloaded")):
+            self.assertEqual(self.search("core_fucose"), [self.bisected.pk])
+
+    def test_backfill_and_endpoint(self):
+        Glycan.objects.update(motif_fingerprint=None)
+        out = io.StringIO()
+        call_command("build_motif_fingerprints", stdout=out)
+        self.assertIn("Stored 2 fingerprints (1 unparsable WURCS)", out.getvalue())
+        response = self.client.get("/api/motif-search/", {"motif": "bisecting_glcnac"})
+        self.assertEqual(response.json()["results"], [self.bisected.pk])
+        self.assertEqual(self.client.get("/api/motif-search/", {"motif": "nope"}).status_code, 400)
+
+
+class XrefTest(TestCase):
+    WURCS = MotifIndexTest.BISECTED
+
+    def dump(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as file:
+            file.write(text)
+        return path
+
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        xrefs.import_dump(
+            "glytoucan",
+            self.dump("glytoucan.tsv", f"Accession\tWURCS\nG00001AA\t{self.WURCS}\nG00002BB\t{SnfgTest.WURCS}\n"),
+        )
+        xrefs.import_dump(
+            "glycosmos",
+            self.dump("glycosmos.csv", "Accession Number,GlyTouCan AC\nGS-1,G00001AA\nGS-2,G00002BB\nGS-3,G00002BB\n"),
+        )
+        xrefs.import_dump(
+            "glyconnect",
+            self.dump("glyconnect.csv", 'id,glytoucan_ac,composition\n77,G00002BB,"Hex:5 HexNAc:4 dHex:1 NeuAc:2"\n'),
+        )
+
+    def test_import(self):
+        self.assertEqual(RegistryEntry.objects.filter(registry="glytoucan").count(), 2)
+        entries = xrefs.lookup(["G00001AA", "G00002BB", "G99999ZZ"])
+        self.assertEqual(entries["G00001AA"]["composition"], "H3N5")  # derived from the WURCS
+        self.assertNotIn("G99999ZZ", entries)
+        self.assertEqual(RegistryEntry.objects.get(registry="glyconnect").composition_string, "H5N4F1S2")
+        # Re-importing replaces the registry's rows.
+        xrefs.import_dump("glyconnect", self.dump("empty.csv", "id,glytoucan_ac\n"))
+        self.assertFalse(RegistryEntry.objects.filter(registry="glyconnect").exists())
+        with self.assertRaises(ValueError):
+            xrefs.import_dump("glytoucan", self.dump("bad.csv", "name,wurcs\nx,y\n"))
+
+    def test_sync(self):
+        by_wurcs = Glycan.objects.create(wurcs=self.WURCS)
+        by_id = Glycan.objects.create(glytoucan_id="G00002BB")
+        curated = Glycan.objects.create(wurcs=self.WURCS, glytoucan_id="G00001AA", glycosmos_id="kept")
+
+        out = io.StringIO()
+        call_command("xref_sync", "--dry-run", stdout=out)
+        self.assertIn("Would fill glytoucan_id on 1 glycans", out.getvalue())
+        self.assertEqual(Glycan.objects.get(pk=by_wurcs.pk).glytoucan_id, "")
+
+        with CaptureQueriesContext(connection) as queries:
+            filled = xrefs.sync()
+        self.assertLess(len(queries), 20)  # set-based: no per-glycan queries
+        self.assertEqual(
+            filled, {"glytoucan_id": 1, "wurcs": 1, "glycosmos_id": 1, "glyconnect_id": 1, "composition": 3}
+        )
+        by_wurcs.refresh_from_db()
+        self.assertEqual((by_wurcs.glytoucan_id, by_wurcs.glycosmos_id), ("G00001AA", "GS-1"))
+        self.assertEqual(str(by_wurcs.monosaccharide_comp), "H3N5")  # derived from the mirrored WURCS
+        by_id.refresh_from_db()
+        self.assertEqual(by_id.wurcs, SnfgTest.WURCS)
+        self.assertEqual(by_id.glycosmos_id, "")  # GS-2 and GS-3 are ambiguous
+        self.assertEqual(by_id.glyconnect_id, "77")
+        self.assertEqual(str(by_id.monosaccharide_comp), "H5N4F1S2")
+        self.assertEqual(GlycanSearch.objects.get(glycan=by_id).composition_string, "H5N4F1S2")
+        self.assertIsNotNone(by_id.motif_fingerprint)
+        self.assertEqual(Glycan.objects.get(pk=curated.pk).glycosmos_id, "kept")
+
+
+class AbundanceTest(TestCase):
+    ROWS = (
+        "Sample,Glycan ID,Intensity,GU\n"
+        "s1,LBG-A0001,300,5.1\n"
+        "s1,LBG-A0002,100,\n"
+        "s2,LBG-A0002,50,6.0\n"
+        "s2,LBG-NOPE,10,\n"
+        "s2,LBG-A0002,80,6.1\n"  # repeated: the last row wins
+    )
+
+    def setUp(self):
+        self.study = Study.objects.create(title="Cohort", doi="10.1/cohort")
+        for pk in ("LBG-A0001", "LBG-A0002", "LBG-A0003"):
+            Glycan.objects.create(id=pk, mass=1000.0)
+        self.path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "abundance.csv.gz")
+        with gzip.open(self.path, "wt") as f:
+            f.write(self.ROWS)
+
+    def test_ingest_and_pivot(self):
+        result = abundance.ingest(self.study, self.path)
+        self.assertEqual(result, {"rows": 5, "samples": 2, "measurements": 3, "unknown_glycans": 1})
+        self.assertEqual(set(self.study.glycan_set.values_list("pk", flat=True)), {"LBG-A0001", "LBG-A0002"})
+
+        matrix = abundance.pivot(study=self.study)
+        self.assertEqual(list(matrix.glycans), ["LBG-A0001", "LBG-A0002"])
+        self.assertEqual(list(matrix.sample_names), ["s1", "s2"])
+        np.testing.assert_allclose(matrix.values, [[75.0, np.nan], [25.0, 100.0]])
+        gu = abundance.pivot(samples=list(matrix.samples[::-1]), glycans=["LBG-A0003", "LBG-A0002"], value="gu_observed")
+        np.testing.assert_allclose(gu.values, [[np.nan, np.nan], [6.1, np.nan]])
+
+        # Re-importing overwrites values in place.
+        with gzip.open(self.path, "wt") as f:
+            f.write("sample\tglycan_id\trelative_abundance\ns1\tLBG-A0001\t60\n")
+        self.assertEqual(abundance.ingest(self.study, self.path)["measurements"], 1)
+        self.assertEqual(Measurement.objects.get(glycan_id="LBG-A0001").relative_abundance, 60.0)
+        self.assertEqual(Measurement.objects.count(), 3)
+
+    def test_malformed_file(self):
+        for rows, message in (
+            ("sample,glycan_id,intensity\ns1,LBG-A0001,5\ns2,LBG-A0002\n", "Abundance file line 3: missing data"),
+            ("sample,glycan_id\ns1,LBG-A0001,5\n", "Abundance file line 2: extra data"),
+            ("sample,glycan_id,intensity\ns1,LBG-A0001,lots\n", "Abundance file: invalid input syntax"),
+        ):
+            with gzip.open(self.path, "wt") as f:
+                f.write(rows)
+            with self.assertRaisesMessage(ValueError, message):
+                abundance.ingest(self.study, self.path)
+        self.assertFalse(Measurement.objects.exists())
+        with self.assertRaisesMessage(CommandError, "line 3"):
+            with gzip.open(self.path, "wt") as f:
+                f.write("sample,glycan_id,intensity\ns1,LBG-A0001,5\ns2,LBG-A0002\n")
+            call_command("abundance_import", str(self.study.pk), self.path, stdout=io.StringIO())
+
+    def test_pivot_many_chunks(self):
+        abundance.ingest(self.study, self.path)
+        sample = self.study.samples.get(name="s2")
+        Glycan.objects.bulk_create(Glycan(id=f"LBG-M{i:04d}", mass=1000.0) for i in range(5000))
+        Measurement.objects.bulk_create(
+            Measurement(sample=sample, glycan_id=f"LBG-M{i:04d}", intensity=float(i)) for i in range(5000)
+        )
+        matrix = abundance.pivot(study=self.study, value="intensity")
+        self.assertEqual(matrix.shape, (5002, 2))
+        self.assertEqual(np.nansum(matrix.values[:, 1]), sum(range(5000)) + 80)
+
+    def test_command_and_endpoint(self):
+        out = io.StringIO()
+        call_command("abundance_import", "10.1/cohort", self.path, stdout=out, stderr=io.StringIO())
+        self.assertIn("3 measurements written, 2 new samples", out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command("abundance_import", "999999", self.path, stdout=io.StringIO())
+
+        response = self.client.get("/api/abundance/", {"study": self.study.pk})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["values"], [[75.0, None], [25.0, 100.0]])
+        self.assertEqual([s["name"] for s in body["samples"]], ["s1", "s2"])
+        self.assertEqual(self.client.get("/api/abundance/", {"study": self.study.pk}, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        self.assertEqual(self.client.get("/api/abundance/", {"study": "x"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/abundance/", {"study": self.study.pk, "value": "mass"}).status_code, 400)
+
+        try:
+            import pyarrow as pa
+        except ImportError:
+            return
+        response = self.client.get("/api/abundance/", {"study": self.study.pk, "format": "arrow"})
+        table = pa.ipc.open_stream(response.content).read_all()
+        self.assertEqual(table.column_names, ["glycan_id", "s1", "s2"])
+        self.assertEqual(table.column("s2").to_pylist(), [None, 100.0])
+
+
+class ProfileComparisonTest(TestCase):
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        brain, liver = Tissue.objects.create(organ="Brain"), Tissue.objects.create(organ="Liver")
+        adult = OntogenicStage.objects.create(stage="Adult")
+        self.brain = ModelSpecies.objects.create(species_name="Mouse", tissue=brain, stage=adult)
+        self.liver = ModelSpecies.objects.create(species_name="Mouse", tissue=liver)
+        self.human = ModelSpecies.objects.create(species_name="Human")
+        sialylated = MonosaccharideComposition.objects.create(H_num=5, N_num=4, S_num=2)
+        high_mannose = MonosaccharideComposition.objects.create(H_num=9, N_num=2)
+        links = {
+            "LBG-R0001": (sialylated, [self.brain, self.liver, self.human]),
+            "LBG-R0002": (sialylated, [self.brain]),
+            "LBG-R0003": (sialylated, [self.brain]),
+            "LBG-R0004": (high_mannose, [self.liver]),
+            "LBG-R0005": (None, [self.liver, self.human]),
+        }
+        for pk, (composition, species) in links.items():
+            Glycan.objects.create(id=pk, monosaccharide_comp=composition).model_species.set(species)
+        self.tissues = {"Brain": str(brain.pk), "Liver": str(liver.pk)}
+
+    def test_set_operations(self):
+        result = profiles.compare("tissue", [self.tissues["Brain"], self.tissues["Liver"]], with_ids=True)
+        brain, liver = result["groups"]
+        self.assertEqual((brain["size"], brain["unique"], brain["unique_ids"]), (3, 2, ["LBG-R0002", "LBG-R0003"]))
+        self.assertEqual((liver["size"], liver["unique"]), (3, 2))
+        self.assertEqual((result["union"], result["shared"], result["shared_ids"]), (5, 1, ["LBG-R0001"]))
+        self.assertAlmostEqual(result["jaccard"][0][1], 1 / 5)
+
+        species = profiles.compare("species")
+        self.assertEqual([g["label"] for g in species["groups"]], ["Human", "Mouse"])
+        self.assertEqual(species["jaccard"], [[1.0, 0.4], [0.4, 1.0]])  # {1, 5} vs {1..5}
+        self.assertEqual(len(profiles.compare("context")["groups"]), 3)
+        with self.assertRaises(ValueError):
+            profiles.compare("tissue", ["999999"])
+
+    def test_enrichment(self):
+        result = profiles.compare("tissue")
+        rows = {(r["group"], r["class"]): r for r in result["enrichment"]}
+        brain = rows[(self.tissues["Brain"], "sialylated")]
+        # 4 glycans with a composition, 3 sialylated; Brain has 3 of 3.
+        self.assertEqual((brain["count"], brain["expected"], brain["fold"]), (3, 2.25, round(4 / 3, 4)))
+        self.assertAlmostEqual(brain["p"], 0.25)  # C(3,3) C(1,0) / C(4,3)
+        self.assertEqual(rows[(self.tissues["Liver"], "high_mannose")]["count"], 1)
+        self.assertEqual(profiles.benjamini_hochberg([0.01, 0.04, 0.03]).tolist(), [0.03, 0.04, 0.04])
+
+    def test_cached_by_data_version(self):
+        profiles.compare("species")
+        with CaptureQueriesContext(connection) as queries:
+            profiles.compare("species")
+        self.assertEqual(len(queries), 1)  # only the version lookup
+        Glycan.objects.get(pk="LBG-R0004").model_species.add(self.human)
+        self.assertEqual(profiles.compare("species")["groups"][0]["size"], 3)
+
+    def test_endpoint(self):
+        response = self.client.get("/api/profiles/", {"by": "tissue", "ids": "1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["shared_ids"], ["LBG-R0001"])
+        again = self.client.get("/api/profiles/", {"by": "tissue", "ids": "1"}, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(self.client.get("/api/profiles/", {"by": "organ"}).status_code, 400)
+        # An empty group list means all groups, as if `groups` were omitted.
+        blank = self.client.get("/api/profiles/", {"by": "tissue", "ids": "1", "groups": ","})
+        self.assertEqual(blank.status_code, 200)
+        self.assertEqual(blank.json()["groups"], response.json()["groups"])
+        self.assertEqual(profiles.compute("tissue", [])["groups"], profiles.compute("tissue")["groups"])
+
+
+class ReadApiTest(TestCase):
+    def setUp(self):
+        tissue = Tissue.objects.create(organ="brain")
+        species = ModelSpecies.objects.create(species_name="Homo sapiens", tissue=tissue)
+        study = Study.objects.create(title="Glycome", doi="10.1000/x")
+        for n in range(5):
+            glycan = Glycan.objects.create(id=f"LBG-P000{n}", mass=1000 + n)
+            glycan.model_species.add(species)
+            glycan.studies.add(study)
+
+    def test_keyset_pages_use_fixed_query_count(self):
+        # Version lookup + glycans (with composition) + species (with tissue/stage) + studies.
+        with self.assertNumQueries(4):
+            page = self.client.get("/api/glycans/?limit=2").json()
+        self.assertEqual([g["id"] for g in page["results"]], ["LBG-P0000", "LBG-P0001"])
+        self.assertEqual(page["results"][0]["model_species"][0]["tissue"]["organ"], "brain")
+        with self.assertNumQueries(4):
+            page = self.client.get(page["next"]).json()
+        self.assertEqual([g["id"] for g in page["results"]], ["LBG-P0002", "LBG-P0003"])
+        page = self.client.get(page["next"]).json()
+        self.assertEqual(([g["id"] for g in page["results"]], page["next"]), (["LBG-P0004"], None))
+
+        self.assertEqual(self.client.get("/api/glycans/?limit=0").status_code, 400)
+        self.assertEqual(self.client.get("/api/species/?after=abc").status_code, 400)
+        self.assertEqual(self.client.get("/api/glycans/LBG-P0003/").json()["mass"], 1003)
+        self.assertEqual(self.client.get("/api/studies/999/").status_code, 404)
+
+    def test_etag_changes_only_when_source_tables_do(self):
+        response = self.client.get("/api/glycans/")
+        etag = response["ETag"]
+        self.assertTrue(response.has_header("Last-Modified"))
+        self.assertEqual(self.client.get("/api/glycans/", headers={"if-none-match": etag}).status_code, 304)
+
+        LastAuthor.objects.create(full_name="Unrelated")  # not part of a glycan page
+        self.assertEqual(self.client.get("/api/glycans/", headers={"if-none-match": etag}).status_code, 304)
+
+        tissue = Tissue.objects.get()
+        tissue.organ = "liver"
+        tissue.save()
+        response = self.client.get("/api/glycans/", headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][0]["model_species"][0]["tissue"]["organ"], "liver")
+
+
+class TextSearchTest(TestCase):
+    def setUp(self):
+        self.smith = LastAuthor.objects.create(full_name="Ann Smith")
+        self.jones = LastAuthor.objects.create(full_name="Bo Jones")
+        self.brain = Study.objects.create(title="Sialylated N-glycans of the mouse brain", journal="Glycobiology", doi="10.1/a")
+        self.serum = Study.objects.create(title="Serum glycome", journal="J Proteome Res", doi="10.1/b")
+        self.brain.last_authors.add(self.smith, self.jones)
+        self.serum.last_authors.add(self.smith)
+
+    def search(self, term):
+        admin = StudyAdmin(Study, AdminSite())
+        found, may_have_duplicates = admin.get_search_results(RequestFactory().get("/"), Study.objects.all(), term)
+        self.assertFalse(may_have_duplicates)
+        return sorted(found.values_list("doi", flat=True))
+
+    def test_words_across_fields_and_stemmed_titles(self):
+        self.assertEqual(self.search("smith"), ["10.1/a", "10.1/b"])  # M2M match, no duplicates
+        self.assertEqual(self.search("smith glycobiology"), ["10.1/a"])  # every word must match
+        self.assertEqual(self.search("glycan"), ["10.1/a"])  # full text: "glycans" -> "glycan"
+        self.assertEqual(self.search('"serum glycome"'), ["10.1/b"])
+        self.assertEqual(self.search("  "), ["10.1/a", "10.1/b"])
+        self.assertEqual(self.search("nothing"), [])
+
+    def test_other_admins(self):
+        Tissue.objects.create(organ="brain", uberon_id="UBERON:0000955")
+        Tissue.objects.create(organ="liver")
+        request = RequestFactory().get("/")
+        admin = TissueAdmin(Tissue, AdminSite())
+        found, _ = admin.get_search_results(request, Tissue.objects.all(), "0000955")
+        self.assertEqual(list(found.values_list("organ", flat=True)), ["brain"])
+        admin = GlycanAdmin(Glycan, AdminSite())
+        Glycan.objects.create(glytoucan_id="G00031MO")
+        found, _ = admin.get_search_results(request, Glycan.objects.all(), "g00031")
+        self.assertEqual(found.count(), 1)
+
+
+@tag("benchmark")
+class SearchIndexBenchmark(TestCase):
+    """
+    Search latency must stay flat as a searched table grows: each query is
+    timed at 1%, 10% and 100% of LBG_BENCHMARK_ROWS rows (default 100k; set
+    it to 1000000 for the full-size run), and must be answerable without
+    a seq scan of that table. Whether the planner actually picks the index
+    depends on the table's size and statistics, so the plan is checked with
+    seq scans disabled: it fails only if no index can serve the query.
+    """
+
+    ROWS = int(os.environ.get("LBG_BENCHMARK_ROWS", 100_000))
+    NEEDLES = 20  # matching rows, the same at every size
+
+    # model: (columns, one filler row as SQL over the series value `i`)
+    FILLERS = {
+        Study: (
+            "title, journal, doi",
+            "'Study ' || i || ' of the ' || (ARRAY['brain', 'liver', 'serum', 'plasma'])[i %% 4 + 1] || ' glycome', "
+            "'Journal ' || i %% 500, '10.9000/' || i",
+        ),
+        Glycan: (
+            "glytoucan_id, glycosmos_id, glyconnect_id, wurcs, brain_specific, sialic_acid_derivatization, image_digest",
+            "'G' || lpad(i::text, 7, '0'), 'GS' || i, 'GC' || i, '', false, false, ''",
+        ),
+        Tissue: (
+            "organ, structure, uberon_id",
+            "(ARRAY['brain', 'liver', 'serum', 'plasma'])[i %% 4 + 1], 'structure ' || i, 'UBERON:' || lpad(i::text, 7, '0')",
+        ),
+        ModelSpecies: (
+            "species_name, species_taxid, taxid",
+            "'Species ' || i, (100000 + i)::text, (100000 + i)::text",
+        ),
+    }
+
+    def grow(self, model, rows):
+        table = connection.ops.quote_name(model._meta.db_table)
+        columns, values = self.FILLERS[model]
+        start = model.objects.count()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) SELECT {values} FROM generate_series(%s, %s) AS i",
+                [start, rows - 1],
+            )
+            cursor.execute(f"ANALYZE {table}")
+
+    def timings(self, needles, run):
+        """Best-of-5 seconds for `run()` at each size of the needles' table."""
+        model = type(needles[0])
+        model.objects.bulk_create(needles)
+        best = []
+        for rows in (self.ROWS // 100, self.ROWS // 10, self.ROWS):
+            self.grow(model, rows)
+            samples = []
+            for _ in range(5):
+                start = time.perf_counter()
+                self.assertEqual(len(run()), self.NEEDLES)
+                samples.append(time.perf_counter() - start)
+            best.append(min(samples))
+        return best
+
+    def assertFlat(self, best, queryset):
+        small, large = best[0], best[-1]
+        self.assertLess(large, small * 5 + 0.02, f"latency grew with table size: {best}")
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute(f"EXPLAIN {sql}", params)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        self.assertNotIn(f'Seq Scan on "{queryset.model._meta.db_table}"', plan)
+
+    def assertAdminSearchFlat(self, admin_class, needles, term):
+        if not text_search.trigram_installed(connection):
+            self.skipTest("pg_trgm is not installed")
+        model = type(needles[0])
+        admin = admin_class(model, AdminSite())
+        request = RequestFactory().get("/")
+
+        def search():
+            return list(admin.get_search_results(request, model.objects.all(), term)[0])
+
+        best = self.timings(needles, search)
+        self.assertFlat(best, admin.get_search_results(request, model.objects.all(), term)[0])
+
+    def test_title_full_text(self):
+        query = SearchQuery("needles", config=text_search.SEARCH_CONFIG, search_type="websearch")
+        queryset = Study.objects.filter(search_vector=query)
+        needles = [Study(title=f"Needle-shaped sialylated glycans {i}", doi=f"10.9999/{i}") for i in range(self.NEEDLES)]
+        self.assertFlat(self.timings(needles, lambda: list(queryset)), queryset)
+
+    def test_admin_search(self):
+        needles = [Study(title=f"Needle-shaped sialylated glycans {i}", doi=f"10.9999/{i}") for i in range(self.NEEDLES)]
+        self.assertAdminSearchFlat(StudyAdmin, needles, "needle-shaped")
+
+    def test_glycan_cross_reference_search(self):
+        needles = [Glycan(glytoucan_id=f"GNEEDLE{i:02d}") for i in range(self.NEEDLES)]
+        self.assertAdminSearchFlat(GlycanAdmin, needles, "needle")
+
+    def test_tissue_search(self):
+        needles = [Tissue(organ="needle gland", structure=f"lobe {i}") for i in range(self.NEEDLES)]
+        self.assertAdminSearchFlat(TissueAdmin, needles, "needle")
+
+    def test_model_species_search(self):
+        needles = [ModelSpecies(species_name=f"Acus needleri {i}") for i in range(self.NEEDLES)]
+        self.assertAdminSearchFlat(ModelSpeciesAdmin, needles, "needleri")
+
+
+@tag("benchmark")
+class AdminChangelistBenchmark(TestCase):
+    """
+    Changelist pages must cost a constant number of queries however many
+    rows they show. Run alone with `manage.py test --tag benchmark`
+    (or skip with `--exclude-tag benchmark`).
+    """
+
+    GLYCANS = 10_000
+    MAX_SECONDS = 2.0
+
+    @classmethod
+    def setUpTestData(cls):
+        comps = MonosaccharideComposition.objects.bulk_create(
+            MonosaccharideComposition(H_num=h, N_num=n)
+            for h in range(1, 11) for n in range(1, 11)
+        )
+        Glycan.objects.bulk_create(
+            Glycan(id=f"LBG-{i:05d}", mass=500 + i / 10, gu_mean=i % 12, monosaccharide_comp=comps[i % len(comps)])
+            for i in range(cls.GLYCANS)
+        )
+        tissues = Tissue.objects.bulk_create(Tissue(organ=f"organ {i}") for i in range(200))
+        ModelSpecies.objects.bulk_create(ModelSpecies(species_name=f"species {i}", tissue=t) for i, t in enumerate(tissues))
+        authors = LastAuthor.objects.bulk_create(LastAuthor(full_name=f"Author {i}") for i in range(300))
+        studies = Study.objects.bulk_create(Study(title=f"Study {i}", doi=f"10.1000/{i}") for i in range(1000))
+        Study.last_authors.through.objects.bulk_create(
+            Study.last_authors.through(study_id=study.pk, lastauthor_id=authors[(i + k) % 300].pk)
+            for i, study in enumerate(studies) for k in range(3)
+        )
+        cls.user = User.objects.create_superuser("bench", "bench@example.com", "bench")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        cache.clear()  # the versions in the cache keys restart with each test
+        self.addCleanup(cache.clear)
+
+    def changelist_queries(self, url, admin_class, per_page):
+        with mock.patch.object(admin_class, "list_per_page", per_page):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = self.client.get(url)
+                elapsed = time.perf_counter() - start
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, self.MAX_SECONDS)
+        return len(queries), response
+
+    def assertConstantQueries(self, url, admin_class):
+        self.client.get(url)  # warm the facet cache
+        small, _ = self.changelist_queries(url, admin_class, 5)
+        large, response = self.changelist_queries(url, admin_class, 100)
+        self.assertEqual(small, large)
+        return response
+
+    def test_glycan_changelist(self):
+        response = self.assertConstantQueries("/admin/DB/glycan/", GlycanAdmin)
+        self.assertContains(response, "H1N2")
+
+    def test_study_changelist(self):
+        response = self.assertConstantQueries("/admin/DB/study/?o=1", StudyAdmin)
+        self.assertContains(response, "Author 0, Author 1, Author 2")
+        response = self.assertConstantQueries("/admin/DB/study/?q=Author+1", StudyAdmin)
+        self.assertNotContains(response, "Author 1, Author 1")
+
+    def test_species_changelist(self):
+        self.assertConstantQueries("/admin/DB/modelspecies/", ModelSpeciesAdmin)
+
+
+class BulkLoadTest(TransactionTestCase):
+    def write_csv(self, directory, name, text):
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def test_fk_ordered_load_then_upsert(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.write_csv(directory, "DB_tissue.csv", 'id,organ,structure,uberon_id\n1,brain,cortex,""\n')
+        self.write_csv(
+            directory,
+            "DB_modelspecies.csv",
+            "id,species_name,species_taxid,taxid,tissue_id,stage_id\n1,Homo sapiens,9606,9606,1,\n",
+        )
+        checkpoint = os.path.join(directory, "checkpoint.json")
+        levels, skipped = bulk_load.plan(directory, app_labels={"DB"})
+        self.assertEqual([[load.table for load in level] for level in levels], [["DB_tissue"], ["DB_modelspecies"]])
+
+        call_command("lbg_load", directory, "--checkpoint", checkpoint, stdout=io.StringIO())
+        self.assertEqual(ModelSpecies.objects.get(pk=1).tissue.organ, "brain")
+        self.assertFalse(os.path.exists(checkpoint))
+
+        # Non-empty tables are merged through a staging table.
+        self.write_csv(directory, "DB_tissue.csv", 'id,organ,structure,uberon_id\n1,liver,lobe,""\n2,brain,stem,""\n')
+        out = io.StringIO()
+        call_command("lbg_load", directory, "--checkpoint", checkpoint, "--table", "DB_tissue", stdout=out)
+        self.assertIn("upsert 2 rows", out.getvalue())
+        self.assertEqual(list(Tissue.objects.order_by("id").values_list("organ", flat=True)), ["liver", "brain"])
+        self.assertEqual(Tissue.objects.create(organ="heart").pk, 3)  # sequence moved past loaded ids
+
+    def test_legacy_headers_are_remapped(self):
+        header = ["id", "structural_resolution", "mass", "sialic_derivatization", "gu_mean", "gu_max", "gu_min", "monosaccharide_comp_id"]
+        plan = csv_schema.plan_columns(Glycan, header)
+        self.assertEqual(
+            plan.renamed,
+            {"structural_resolution": "graphical_structure", "sialic_derivatization": "sialic_acid_derivatization"},
+        )
+        self.assertIn("brain_specific", plan.filled)
+
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.write_csv(
+            directory,
+            "DB_monosaccharidecomposition.csv",
+            "id,H_num,N_num,F_num,P_num,T_num,A_num,G_num,S_num,E_num,M_num,composition_string\n"
+            "11,3,2,0,0,0,0,0,0,0,0,H3N2\n",
+        )
+        self.write_csv(directory, "DB_glycan.csv", ",".join(header) + '\nLBG-TCV1O,"",1130.58,t,4.17,4.17,4.17,11\n')
+        out = io.StringIO()
+        call_command("lbg_load", directory, "--checkpoint", os.path.join(directory, "cp.json"), stdout=out)
+        self.assertIn("dropped A_num", out.getvalue())
+        glycan = Glycan.objects.get(pk="LBG-TCV1O")
+        self.assertTrue(glycan.sialic_acid_derivatization)
+        self.assertFalse(glycan.brain_specific)
+        self.assertEqual(glycan.monosaccharide_comp.composition_string, "H3N2")
+
+    def test_duplicate_compositions_are_merged_and_remapped(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.write_csv(
+            directory,
+            "DB_monosaccharidecomposition.csv",
+            "id,H_num,N_num,F_num,P_num,T_num,A_num,G_num,S_num,E_num,M_num,composition_string\n"
+            "1,3,2,0,0,0,0,0,0,0,0,H3N2\n"
+            "2,3,2,0,0,0,1,0,0,0,0,H3N2A1\n"  # same counts once A_num is dropped
+            "3,5,4,0,0,0,0,0,0,0,0,H5N4\n",
+        )
+        self.write_csv(directory, "DB_glycan.csv", "id,mass,monosaccharide_comp_id\nLBG-D0001,1.0,2\nLBG-D0002,2.0,3\n")
+        out = io.StringIO()
+        call_command("lbg_load", directory, "--checkpoint", os.path.join(directory, "cp.json"), stdout=out)
+        self.assertIn("merged 1 duplicate rows", out.getvalue())
+        self.assertEqual(
+            list(MonosaccharideComposition.objects.order_by("id").values_list("id", "composition_string")),
+            [(1, "H3N2"), (3, "H5N4")],
+        )
+        self.assertEqual(Glycan.objects.get(pk="LBG-D0001").monosaccharide_comp_id, 1)
+
+        # Compositions are deduplicated by the database, not by Python lookups.
+        ids = composition_ids([(3, 2, 0, 0, 0, 0, 0, 0, 0), (1, 1, 0, 0, 0, 0, 0, 0, 0)])
+        self.assertEqual(ids[(3, 2, 0, 0, 0, 0, 0, 0, 0)], 1)
+        self.assertEqual(MonosaccharideComposition.objects.get(pk=ids[(1, 1, 0, 0, 0, 0, 0, 0, 0)]).composition_string, "H1N1")
+
+    def test_export_round_trip(self):
+        tissue = Tissue.objects.create(organ="brain", structure="cortex")
+        ModelSpecies.objects.create(species_name="Homo sapiens", taxid=9606, tissue=tissue)
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        tables = ["DB_tissue", "DB_modelspecies"]
+        manifest = bulk_export.export(directory, tables=tables, jobs=2, report=lambda line: None)
+        self.assertEqual({t: e["rows"] for t, e in manifest["tables"].items()}, {"DB_tissue": 1, "DB_modelspecies": 1})
+        entry = manifest["tables"]["DB_tissue"]
+        self.assertEqual(entry["file"], "DB_tissue.csv.gz")
+        self.assertEqual(entry["sha256"], bulk_export._file_sha256(os.path.join(directory, entry["file"])))
+
+        # The Parquet threshold uses real counts: these tables were never analysed.
+        parquet = bulk_export.export(
+            self.enterContext(tempfile.TemporaryDirectory()), tables=["DB_tissue", "DB_ontogenicstage"],
+            parquet_rows=1, report=lambda line: None,
+        )
+        self.assertEqual({t: e["format"] for t, e in parquet["tables"].items()}, {"DB_tissue": "parquet", "DB_ontogenicstage": "csv"})
+
+        ModelSpecies.objects.all().delete()
+        Tissue.objects.all().delete()
+        call_command("lbg_load", directory, "--checkpoint", os.path.join(directory, "cp.json"), stdout=io.StringIO())
+        self.assertEqual(ModelSpecies.objects.get().tissue.structure, "cortex")
@@ -0,0 +1,139 @@
+"""
+Indexed text search for the admin search boxes.
+
+Django's admin search turns each word into `UPPER(col::text) LIKE
+UPPER('%word%')`, ORs that over every search field, and joins any related
+fields. The leading wildcard rules out B-tree indexes, and the OR across
+tables rules out every other index, so each search scans whole tables.
+
+The fix has two parts:
+
+- Trigram GIN indexes (`pg_trgm`) on `UPPER(col::text)`, the exact
+  expression Django's `icontains` emits, for every search column in
+  TRIGRAM_COLUMNS. They are created by migration 0014 when the server
+  ships the extension. On a server without it, the migration skips them;
+  install the extension later and run `manage.py create_trigram_indexes`.
+- `matching_ids()` rewrites a search as set operations on the primary key.
+  For each word it takes the UNION of one single-column match per search
+  field, then INTERSECTs the words. Each branch is a bitmap scan of one
+  index, and no JOIN + DISTINCT is needed afterwards. For Study, the
+  stemmed `search_vector` full-text column (GIN-indexed) is UNIONed in too,
+  so "glycans" finds titles that say "glycan".
+"""
+
+from django.contrib.postgres.search import SearchQuery
+from django.utils.text import smart_split, unescape_string_literal
+
+from .models import Glycan, LastAuthor, ModelSpecies, MonosaccharideComposition, OntogenicStage, Study, Tissue
+
+SEARCH_CONFIG = "english"
+
+# (model, field) for every column an admin search_fields entry ends on.
+TRIGRAM_FIELDS = (
+    (Tissue, "organ"),
+    (Tissue, "structure"),
+    (Tissue, "uberon_id"),
+    (OntogenicStage, "stage"),
+    (OntogenicStage, "age"),
+    (ModelSpecies, "species_name"),
+    (ModelSpecies, "species_taxid"),
+    (ModelSpecies, "taxid"),
+    (MonosaccharideComposition, "composition_string"),
+    (LastAuthor, "full_name"),
+    (LastAuthor, "affiliation"),
+    (Study, "title"),
+    (Study, "journal"),
+    (Study, "doi"),
+    (Glycan, "glytoucan_id"),
+    (Glycan, "glycosmos_id"),
+    (Glycan, "glyconnect_id"),
+)
+TRIGRAM_COLUMNS = tuple(
+    (model._meta.db_table, model._meta.get_field(field).column) for model, field in TRIGRAM_FIELDS
+)
+
+
+# ---------------------------------------------------------------------------
+# Trigram indexes
+# ---------------------------------------------------------------------------
+def trigram_index_name(table, column):
+    return f"{table}_{column}_trgm".lower()
+
+
+def trigram_available(connection):
+    """True if the server can install pg_trgm."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def trigram_installed(connection):
+    """True if pg_trgm is installed in this database."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def create_trigram_indexes(connection, columns=TRIGRAM_COLUMNS):
+    """
+    Install pg_trgm and create the missing trigram indexes on `columns`
+    (`(table, column)` pairs). Returns the index names, or None if the
+    server doesn't ship the extension.
+    """
+    if not trigram_available(connection):
+        return None
+    q = connection.ops.quote_name
+    names = []
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for table, column in columns:
+            name = trigram_index_name(table, column)
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {q(name)} ON {q(table)} "
+                f"USING gin ((UPPER({q(column)}::text)) gin_trgm_ops)"
+            )
+            names.append(name)
+    return names
+
+
+def drop_trigram_indexes(connection, columns=TRIGRAM_COLUMNS):
+    q = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for table, column in columns:
+            cursor.execute(f"DROP INDEX IF EXISTS {q(trigram_index_name(table, column))}")
+
+
+# ---------------------------------------------------------------------------
+# Search
+# ---------------------------------------------------------------------------
+def search_words(search_term):
+    """Split a search like the admin does: on spaces, keeping "quoted phrases"."""
+    words = []
+    for bit in smart_split(search_term):
+        if bit.startswith(('"', "'")) and bit[0] == bit[-1]:
+            bit = unescape_string_literal(bit)
+        if bit:
+            words.append(bit)
+    return words
+
+
+def matching_ids(model, search_fields, search_term, vector_field=None):
+    """
+    A `values("pk")` queryset of the `model` rows that match `search_term`.
+    A row matches if every word is contained in at least one of
+    `search_fields`, or if the whole term matches the full-text `vector_field`.
+    Returns None for a blank search.
+    """
+    words = search_words(search_term)
+    if not words:
+        return None
+    rows = model._default_manager
+    per_word = []
+    for word in words:
+        branches = [rows.filter(**{f"{field}__icontains": word}).values("pk") for field in search_fields]
+        per_word.append(branches[0].union(*branches[1:]) if len(branches) > 1 else branches[0])
+    ids = per_word[0].intersection(*per_word[1:]) if len(per_word) > 1 else per_word[0]
+    if vector_field:
+        query = SearchQuery(search_term, config=SEARCH_CONFIG, search_type="websearch")
+        ids = rows.filter(**{vector_field: query}).values("pk").union(ids)
+    return ids
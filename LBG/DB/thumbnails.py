@@ -0,0 +1,134 @@
+"""
+Content-addressed thumbnails for `Glycan.graphical_structure`.
+
+Each image is resized once per size in SIZES and saved as WebP and as PNG,
+for browsers without WebP. The files are named after the SHA-256 of the
+source image:
+
+    thumbnails/<digest[:2]>/<digest>-<size>.<fmt>
+
+The digest is stored on the glycan (`Glycan.image_digest`), so pages can
+build thumbnail URLs without touching the storage backend. Because a name
+never changes meaning, the files are served as immutable. Identical images
+share the same thumbnails, and re-rendering a name that already exists is
+a no-op.
+
+Thumbnails are made on commit after an upload (signals.py). Run
+`manage.py build_thumbnails` to backfill existing images.
+"""
+
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image, UnidentifiedImageError
+
+from . import table_versions
+from .models import Glycan
+from .storage import glycan_image_storage
+
+SIZES = (100, 200, 400)  # bounding box edge in pixels
+FORMATS = {"webp": "image/webp", "png": "image/png"}
+DIRECTORY = "thumbnails"
+
+
+def thumbnail_name(digest, size, fmt):
+    return f"{DIRECTORY}/{digest[:2]}/{digest}-{size}.{fmt}"
+
+
+def thumbnail_url(digest, size, fmt):
+    return reverse("thumbnail", kwargs={"digest": digest, "size": size, "fmt": fmt})
+
+
+def thumbnail_urls(digest):
+    """`{size: {fmt: url}}` for every thumbnail of an image (empty without a digest)."""
+    if not digest:
+        return {}
+    return {size: {fmt: thumbnail_url(digest, size, fmt) for fmt in FORMATS} for size in SIZES}
+
+
+def file_digest(file):
+    """SHA-256 hex digest of an open file, read in chunks."""
+    sha256 = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(1 << 20), b""):
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+def render(name, storage=default_storage):
+    """
+    Thumbnail the stored image `name` at every size and format into
+    `storage`. Returns its digest, or None if the file is missing or Pillow
+    can't read it (e.g. SVG, which scales anyway).
+    """
+    source = glycan_image_storage()
+    try:
+        with source.open(name, "rb") as file:
+            digest = file_digest(file)
+            wanted = [
+                (size, fmt)
+                for size in SIZES
+                for fmt in FORMATS
+                if not storage.exists(thumbnail_name(digest, size, fmt))
+            ]
+            if not wanted:
+                return digest
+            image = Image.open(file)
+            image.load()
+    except (UnidentifiedImageError, OSError):  # unreadable or missing file
+        return None
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+    for size, fmt in wanted:
+        thumb = image.copy()
+        thumb.thumbnail((size, size), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        if fmt == "webp":
+            thumb.save(buffer, "WEBP", quality=85, method=6)
+        else:
+            thumb.save(buffer, "PNG", optimize=True)
+        storage.save(thumbnail_name(digest, size, fmt), ContentFile(buffer.getvalue()))
+    return digest
+
+
+def update_glycan(glycan_id):
+    """(Re)build the thumbnails of one glycan and record its image digest."""
+    glycan = Glycan.objects.filter(pk=glycan_id).only("graphical_structure", "image_digest").first()
+    if glycan is None:
+        return None
+    digest = render(glycan.graphical_structure.name) if glycan.graphical_structure else None
+    if (digest or "") != glycan.image_digest:
+        Glycan.objects.filter(pk=glycan_id).update(image_digest=digest or "")
+        table_versions.bump(Glycan._meta.db_table)  # the API lists thumbnail URLs
+    return digest
+
+
+def backfill(jobs=4, force=False, progress=None):
+    """
+    Thumbnail every glycan image that has no digest yet (all of them with
+    `force`). Distinct files are rendered in a pool of `jobs` threads;
+    Pillow releases the GIL while decoding, resizing and encoding. Returns
+    `(images rendered, images skipped as unreadable)`.
+    """
+    glycans = Glycan.objects.exclude(graphical_structure="").exclude(graphical_structure__isnull=True)
+    if not force:
+        glycans = glycans.filter(image_digest="")
+    names = sorted(set(glycans.values_list("graphical_structure", flat=True)))
+    rendered = skipped = 0
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for name, digest in zip(names, pool.map(render, names)):
+            if digest is None:
+                skipped += 1
+            else:
+                rendered += 1
+                Glycan.objects.filter(graphical_structure=name).update(image_digest=digest)
+            if progress:
+                progress(name, digest)
+    if rendered:
+        table_versions.bump(Glycan._meta.db_table)
+    return rendered, skipped
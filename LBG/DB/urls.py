@@ -0,0 +1,24 @@
+from django.urls import path
+
+from . import api, views
+
+app_name = "DB"
+
+urlpatterns = [
+    path("mass-search/", views.mass_search, name="mass-search"),
+    path("gu-mass-search/", views.gu_mass_search, name="gu-mass-search"),
+    path("composition-mass-search/", views.composition_mass_search, name="composition-mass-search"),
+    path("composition-search/", views.composition_search, name="composition-search"),
+    path("motif-search/", views.motif_search, name="motif-search"),
+    path("annotate/", views.annotate_peaks, name="annotate-peaks"),
+    path("abundance/", api.abundance_matrix, name="abundance-matrix"),
+    path("profiles/", api.profile_comparison, name="profile-comparison"),
+    path("glycans/<str:pk>/snfg.<str:fmt>", views.glycan_snfg, name="glycan-snfg"),
+]
+
+# Read-only JSON API: /api/<resource>/ and /api/<resource>/<pk>/
+for _resource in api.RESOURCES:
+    urlpatterns += [
+        path(f"{_resource}/", api.resource_list, {"resource": _resource}, name=f"{_resource}-list"),
+        path(f"{_resource}/<str:pk>/", api.resource_detail, {"resource": _resource}, name=f"{_resource}-detail"),
+    ]
@@ -1,3 +1,377 @@
-from django.shortcuts import render
+import csv
+import io
 
-# Create your views here.
+from django.core.files.storage import default_storage
+from django.db.models import Prefetch
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET, require_POST
+
+from . import (
+    annotation,
+    composition_mass,
+    composition_query,
+    composition_space,
+    gu_index,
+    isotopes,
+    mass_index,
+    motif_index,
+    snfg,
+    thumbnails,
+)
+from .api import composition_json
+from .models import COMPOSITION_FIELDS, Glycan, MonosaccharideComposition
+
+
+class _Echo:
+    """File-like object that hands each written line straight back, for streaming CSV."""
+
+    def write(self, value):
+        return value
+
+
+def _float_param(request, name, default=None):
+    """Read an optional float query parameter; raise ValueError if malformed."""
+    raw = request.GET.get(name)
+    if raw in (None, ""):
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        raise ValueError(f"'{name}' must be a number.")
+
+
+def _float_list_param(request, name):
+    """Read a repeated and/or comma-separated list of floats."""
+    try:
+        return [
+            float(v)
+            for raw in request.GET.getlist(name)
+            for v in raw.split(",")
+            if v.strip()
+        ]
+    except ValueError:
+        raise ValueError(f"'{name}' must be a list of numbers.")
+
+
+# ---------------------------------------------------------------------------
+# Mass search
+# ---------------------------------------------------------------------------
+@require_GET
+def mass_search(request):
+    """
+    Match one or more m/z values against the in-memory mass index.
+
+    GET /api/mass-search/?mz=1130.58&ppm=10[&field=theoretical_mass]
+    `mz` may be repeated or comma-separated; use `da` instead of `ppm` for an
+    absolute tolerance (default is ±10 ppm).
+    """
+    field = request.GET.get("field", "mass")
+    if field not in mass_index.MASS_FIELDS:
+        return JsonResponse(
+            {"error": f"'field' must be one of: {', '.join(mass_index.MASS_FIELDS)}."},
+            status=400,
+        )
+    try:
+        values = _float_list_param(request, "mz")
+        ppm = _float_param(request, "ppm")
+        da = _float_param(request, "da")
+        annotation.check_tolerances(ppm=ppm, da=da)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    if not values:
+        return JsonResponse({"error": "'mz' is required."}, status=400)
+    if ppm is not None and da is not None:
+        return JsonResponse({"error": "Give either 'ppm' or 'da', not both."}, status=400)
+    if ppm is None and da is None:
+        ppm = 10.0
+
+    index = mass_index.get_index(field)
+    return JsonResponse(
+        {
+            "field": field,
+            "tolerance": {"ppm": ppm} if ppm is not None else {"da": da},
+            "queries": [
+                {
+                    "mz": mz,
+                    "matches": [
+                        {"id": glycan_id, field: mass, "error_da": err_da, "error_ppm": err_ppm}
+                        for glycan_id, mass, err_da, err_ppm in index.search(mz, ppm=ppm, da=da)
+                    ],
+                }
+                for mz in values
+            ],
+        }
+    )
+
+
+@require_GET
+def composition_mass_search(request):
+    """
+    Match neutral masses against every composition of the precomputed
+    composition space (composition_space.py), not just the library.
+
+    GET /api/composition-mass-search/?mass=2368.84&ppm=5
+    `mass` may be repeated or comma-separated; use `da` instead of `ppm` for
+    an absolute tolerance (default is ±10 ppm).
+    """
+    try:
+        values = _float_list_param(request, "mass")
+        ppm = _float_param(request, "ppm")
+        da = _float_param(request, "da")
+        annotation.check_tolerances(ppm=ppm, da=da)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    if not values:
+        return JsonResponse({"error": "'mass' is required."}, status=400)
+    if ppm is not None and da is not None:
+        return JsonResponse({"error": "Give either 'ppm' or 'da', not both."}, status=400)
+    if ppm is None and da is None:
+        ppm = 10.0
+    try:
+        space = composition_space.get_space()
+    except FileNotFoundError:
+        return JsonResponse(
+            {"error": "The composition space hasn't been built; run 'manage.py build_composition_space'."},
+            status=503,
+        )
+    return JsonResponse(
+        {
+            "tolerance": {"ppm": ppm} if ppm is not None else {"da": da},
+            "space": {key: space.meta[key] for key in ("bounds", "tag", "derivatization", "size")},
+            "queries": [
+                {
+                    "mass": mass,
+                    "matches": [
+                        {"composition": composition, "mass": hit, "error_ppm": error}
+                        for composition, _, hit, error in space.search(mass, ppm=ppm, da=da)
+                    ],
+                }
+                for mass in values
+            ],
+        }
+    )
+
+
+@require_GET
+def gu_mass_search(request):
+    """
+    Combined retention + mass lookup.
+
+    GET /api/gu-mass-search/?mass=1129.5&gu=4.2&ppm=10&gu_tolerance=0.2
+    `mass` and `gu` may be repeated or comma-separated (paired by position)
+    to query a whole chromatogram at once. Candidates are ranked by the
+    combined GU + mass score (lower is better).
+    """
+    field = request.GET.get("field", "mass")
+    if field not in mass_index.MASS_FIELDS:
+        return JsonResponse(
+            {"error": f"'field' must be one of: {', '.join(mass_index.MASS_FIELDS)}."},
+            status=400,
+        )
+    try:
+        masses = _float_list_param(request, "mass")
+        gus = _float_list_param(request, "gu")
+        ppm = _float_param(request, "ppm", 10.0)
+        gu_tolerance = _float_param(request, "gu_tolerance", 0.2)
+        annotation.check_tolerances(ppm=ppm, gu_tolerance=gu_tolerance)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    if not masses or len(masses) != len(gus):
+        return JsonResponse({"error": "Give one 'gu' value for every 'mass'."}, status=400)
+
+    index = gu_index.get_index(field)
+    matches = index.match(masses, gus, ppm=ppm, delta_gu=gu_tolerance)
+    results = [{"mass": m, "gu": g, "matches": []} for m, g in zip(masses, gus)]
+    for q, lib, err_ppm, gu_err, score in zip(
+        matches.query, matches.library, matches.error_ppm, matches.gu_error, matches.score
+    ):
+        results[q]["matches"].append(
+            {
+                "id": index.ids[lib],
+                field: float(index.mass[lib]),
+                "gu_mean": float(index.gu_mean[lib]),
+                "gu_range": [float(index.gu_low[lib]), float(index.gu_high[lib])],
+                "error_ppm": float(err_ppm),
+                "gu_error": float(gu_err),
+                "score": float(score),
+            }
+        )
+    return JsonResponse(
+        {"field": field, "tolerance": {"ppm": ppm, "gu": gu_tolerance}, "queries": results}
+    )
+
+# ---------------------------------------------------------------------------
+# Composition query
+# ---------------------------------------------------------------------------
+@require_GET
+def composition_search(request):
+    """
+    Compositions (and their glycan ids) matching a composition query.
+
+    GET /api/composition-search/?q=H3-5N4F>=1S*
+    Grammar in composition_query.py: exact counts, ranges (H3-5), at least
+    (F>=1 or F1+), at most (S<=2) and any (S*); unmentioned letters are 0.
+    """
+    try:
+        condition = composition_query.compile_query(request.GET.get("q", ""))
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    compositions = (
+        MonosaccharideComposition.objects.filter(condition)
+        .prefetch_related(Prefetch("glycans", queryset=Glycan.objects.only("id", "monosaccharide_comp_id")))
+        .order_by(*COMPOSITION_FIELDS)
+    )
+    return JsonResponse(
+        {
+            "query": request.GET["q"],
+            "results": [
+                {**composition_json(comp), "glycans": [g.pk for g in comp.glycans.all()]}
+                for comp in compositions
+            ],
+        }
+    )
+
+
+# ---------------------------------------------------------------------------
+# Motif (substructure) search
+# ---------------------------------------------------------------------------
+@require_GET
+def motif_search(request):
+    """
+    Glycans whose structure contains a motif.
+
+    GET /api/motif-search/?motif=core_fucose
+    GET /api/motif-search/?motif=WURCS=2.0/...   (prefix "^" to anchor it at the reducing end)
+    `motif` is a name from motif_index.MOTIFS or a WURCS fragment.
+    `candidates` is how many glycans passed the fingerprint prefilter.
+    """
+    motif = request.GET.get("motif", "")
+    if not motif:
+        return JsonResponse({"error": "Give a motif.", "motifs": list(motif_index.MOTIFS)}, status=400)
+    try:
+        ids, candidates = motif_index.get_index().search(motif)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return JsonResponse({"motif": motif, "candidates": candidates, "count": len(ids), "results": ids})
+
+
+# ---------------------------------------------------------------------------
+# Peak-list annotation
+# ---------------------------------------------------------------------------
+@csrf_exempt
+@require_POST
+def annotate_peaks(request):
+    """
+    Annotate an uploaded CSV peak list and stream the result back as CSV.
+
+    POST /api/annotate/ (multipart, file field `peaks`) with optional form
+    fields `ppm`, `charges` ("1,2,3"), `adducts` ("H,Na,NH4"), `field`,
+    `gu_tolerance`, `isotope_errors` ("0,1,2"), `tag` and `matched_only`.
+    Same matching as `manage.py annotate_peaks`.
+    """
+    upload = request.FILES.get("peaks")
+    if upload is None:
+        return JsonResponse({"error": "Upload the peak list as the 'peaks' file field."}, status=400)
+    field = request.POST.get("field", "mass")
+    if field not in mass_index.MASS_FIELDS:
+        return JsonResponse(
+            {"error": f"'field' must be one of: {', '.join(mass_index.MASS_FIELDS)}."},
+            status=400,
+        )
+    try:
+        ppm = float(request.POST.get("ppm", 10.0))
+        gu_tolerance = request.POST.get("gu_tolerance")
+        gu_tolerance = float(gu_tolerance) if gu_tolerance else None
+        annotation.check_tolerances(ppm=ppm, gu_tolerance=gu_tolerance)
+        charges = annotation.parse_charges(request.POST.get("charges", "1,2,3"))
+        adducts = annotation.parse_adducts(request.POST.get("adducts", "H"))
+        isotope_errors = request.POST.get("isotope_errors")
+        isotope_errors = isotopes.parse_isotope_errors(isotope_errors) if isotope_errors else None
+        tag = request.POST.get("tag", "free")
+        if tag not in composition_mass.REDUCING_END_TAGS:
+            raise ValueError(f"'tag' must be one of: {', '.join(composition_mass.REDUCING_END_TAGS)}.")
+        if isotope_errors and gu_tolerance is not None:
+            raise ValueError("'isotope_errors' can't be combined with 'gu_tolerance'.")
+        peaks = annotation.read_peak_list(io.TextIOWrapper(upload, encoding="utf-8", newline=""))
+    except (UnicodeDecodeError, ValueError) as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+
+    if isotope_errors:
+        library_masses, library_ids, composition_ids = mass_index.get_index(field).library()
+        envelopes = isotopes.library_envelopes(composition_ids, library_masses, tag=tag)
+        result = isotopes.annotate(
+            peaks, library_masses, envelopes, charges=charges, adducts=adducts, ppm=ppm, isotope_errors=isotope_errors
+        )
+    elif gu_tolerance is not None:
+        index = gu_index.get_index(field)
+        library_masses, library_ids = index.mass, index.ids
+        result = index.annotate(peaks, charges=charges, adducts=adducts, ppm=ppm, delta_gu=gu_tolerance)
+    else:
+        library_masses, library_ids = mass_index.get_index(field).snapshot()
+        result = annotation.annotate(peaks, library_masses, charges=charges, adducts=adducts, ppm=ppm)
+    rows = annotation.iter_rows(
+        peaks, result, library_masses, library_ids,
+        include_unmatched=request.POST.get("matched_only") not in ("1", "true", "on"),
+    )
+    writer = csv.writer(_Echo())
+    response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type="text/csv")
+    response["Content-Disposition"] = 'attachment; filename="annotated_peaks.csv"'
+    return response
+
+
+# ---------------------------------------------------------------------------
+# Thumbnails
+# ---------------------------------------------------------------------------
+@cache_control(public=True, max_age=365 * 24 * 3600, immutable=True)
+@require_GET
+@condition(etag_func=lambda request, digest, size, fmt: f"{digest}-{size}.{fmt}")
+def thumbnail(request, digest, size, fmt):
+    """
+    A content-addressed thumbnail (see thumbnails.py).
+
+    GET /thumbnails/<sha256>-<size>.<webp|png>
+    The name fixes the bytes, so browsers and proxies may keep it forever
+    and revalidation always ends in a 304.
+    """
+    size = int(size)
+    name = thumbnails.thumbnail_name(digest, size, fmt)
+    if size not in thumbnails.SIZES or not default_storage.exists(name):
+        raise Http404("No such thumbnail.")
+    return FileResponse(default_storage.open(name, "rb"), content_type=thumbnails.FORMATS[fmt])
+
+
+# ---------------------------------------------------------------------------
+# SNFG drawings
+# ---------------------------------------------------------------------------
+def _glycan_wurcs(pk):
+    return Glycan.objects.filter(pk=pk).values_list("wurcs", flat=True).first() or ""
+
+
+def _snfg_etag(request, pk, fmt):
+    wurcs = _glycan_wurcs(pk)
+    return snfg.cache_key(wurcs, fmt) if wurcs and fmt in snfg.FORMATS else None
+
+
+@cache_control(public=True, max_age=24 * 3600)
+@require_GET
+@condition(etag_func=_snfg_etag)
+def glycan_snfg(request, pk, fmt):
+    """
+    SNFG drawing of a glycan, rendered from its WURCS (see snfg.py).
+
+    GET /api/glycans/<id>/snfg.<svg|png>
+    Drawings come from the render cache; the ETag is the cache key, so a
+    changed WURCS or renderer version gets a new one.
+    """
+    if fmt not in snfg.FORMATS:
+        return JsonResponse({"error": "Format must be svg or png."}, status=400)
+    wurcs = _glycan_wurcs(pk)
+    if not wurcs:
+        return JsonResponse({"error": "Glycan not found or has no WURCS."}, status=404)
+    try:
+        data = snfg.cached_render(wurcs, fmt)
+    except ValueError as exc:
+        return JsonResponse({"error": f"Cannot draw this WURCS: {exc}"}, status=404)
+    return HttpResponse(data, content_type=snfg.FORMATS[fmt])
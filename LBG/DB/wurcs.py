@@ -0,0 +1,281 @@
+"""
+WURCS 2.0 parser: turns a `Glycan.wurcs` string into a residue tree.
+
+    WURCS=2.0/3,5,4/[a2122h-1b_1-5_2*NCC/3=O][a1122h-1b_1-5][a1122h-1a_1-5]/1-1-2-3-3/a4-b1_b4-c1_c3-d1_c6-e1
+              |      |                                                       |         |
+              counts unique residues (UniqueRES)                             RES list  linkages (LIN)
+
+Each UniqueRES is a backbone code ("a2122h" = D-gluco hexopyranose),
+an anomeric descriptor ("-1b" = beta at C1), a ring closure ("_1-5") and
+substituents ("_2*NCC/3=O" = N-acetyl at C2). `identify()` maps these
+onto SNFG monosaccharide names (GlcNAc, Man, Fuc, Neu5Ac, ...). Any
+substituent not part of the name (sulfate, phosphate, methyl, ...) is kept
+as a modification such as "6S".
+
+Supported: the full residue and linkage syntax of typical N- and O-glycan
+entries, including unknown positions ("a?-b1"), alternative positions
+("a3|a6-b1", shown as unknown) and residues whose parent is one of several
+("f1-d2|d4|e2|e4}"; kept aside as `floating`). Repeating units ("~n")
+and cyclic structures are rejected with ValueError.
+"""
+
+import re
+from dataclasses import dataclass, field
+
+_WURCS = re.compile(r"^WURCS=2\.0/(\d+),(\d+),(\d+)/((?:\[[^\]]*\])+)/([0-9-]+)/?(.*)$")
+_UNIQUE_RES = re.compile(r"\[([^\]]*)\]")
+_RING = re.compile(r"^[\d?]+-[\d?]+$")
+_SUBSTITUENT = re.compile(r"^([\d?]+)\*(.+)$")
+_GLIP = re.compile(r"^([a-zA-Z]+)([\d?]+)")
+LABELS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"  # residue a, b, ... in LINs
+
+# Substituent MAP strings (the part after "*").
+N_ACETYL = "NCC/3=O"
+N_GLYCOLYL = "NCCO/3=O"
+AMINE = "N"
+MODIFICATIONS = {
+    "OSO/3=O/3=O": "S",  # sulfate
+    "OPO/3O/3=O": "P",  # phosphate
+    "OC": "Me",  # O-methyl
+    "OCC/3=O": "Ac",  # O-acetyl
+    N_ACETYL: "NAc",
+    N_GLYCOLYL: "NGc",
+    AMINE: "N",
+}
+
+# Backbone code (first letter normalised to "a") -> monosaccharide.
+BACKBONES = {
+    "a2122h": "Glc",
+    "a2112h": "Gal",
+    "a1122h": "Man",
+    "a1221m": "Fuc",
+    "a2211m": "Rha",
+    "a212h": "Xyl",
+    "a2122A": "GlcA",
+    "a2112A": "GalA",
+    "a1122A": "ManA",
+    "a2121A": "IdoA",
+    "Aad21122h": "Neu",
+}
+# (monosaccharide, position, MAP) -> derived monosaccharide.
+DERIVED = {
+    ("Glc", 2, N_ACETYL): "GlcNAc",
+    ("Gal", 2, N_ACETYL): "GalNAc",
+    ("Man", 2, N_ACETYL): "ManNAc",
+    ("Hex", 2, N_ACETYL): "HexNAc",
+    ("Glc", 2, AMINE): "GlcN",
+    ("Gal", 2, AMINE): "GalN",
+    ("Neu", 5, N_ACETYL): "Neu5Ac",
+    ("Neu", 5, N_GLYCOLYL): "Neu5Gc",
+}
+
+# Monosaccharide -> composition letter (models.COMPOSITION_LETTERS).
+COMPOSITION_LETTERS = {
+    "Glc": "H", "Gal": "H", "Man": "H", "Hex": "H",
+    "GlcNAc": "N", "GalNAc": "N", "ManNAc": "N", "HexNAc": "N",
+    "Fuc": "F", "dHex": "F",
+    "Neu5Ac": "S", "Neu5Gc": "G",
+}
+
+
+@dataclass(eq=False)
+class Residue:
+    """One monosaccharide in the tree."""
+
+    index: int  # 0-based position in the RES list ("a" = 0)
+    name: str  # SNFG name, e.g. "GlcNAc"; "?" if unknown
+    anomer: str = "?"  # "a", "b" or "?"
+    anomeric_position: int | None = None
+    modifications: tuple = ()  # e.g. ("6S",)
+    reduced: bool = False  # open-chain alditol at the reducing end
+    children: list = field(default_factory=list)  # Links, parent side is this residue
+    parent: "Link | None" = None
+
+    @property
+    def label(self):
+        return LABELS[self.index]
+
+
+@dataclass(eq=False)
+class Link:
+    parent: Residue
+    child: Residue
+    parent_position: int | None  # None = unknown
+    child_position: int | None
+
+
+@dataclass(eq=False)
+class Structure:
+    residues: list
+    root: Residue
+    floating: list  # residues whose attachment point is undefined
+
+    def walk(self, floating=False):
+        """
+        Residues of the tree in depth-first order from the root; with
+        `floating`, each floating subtree follows in the same order.
+        """
+        stack = [*reversed(self.floating), self.root] if floating else [self.root]
+        while stack:
+            residue = stack.pop()
+            yield residue
+            stack.extend(link.child for link in reversed(residue.children))
+
+    def composition(self):
+        """`{letter: count}` using the composition letters (sulfate -> T, phosphate -> P)."""
+        counts = {}
+        for residue in self.residues:
+            letter = COMPOSITION_LETTERS.get(residue.name)
+            if letter:
+                counts[letter] = counts.get(letter, 0) + 1
+            for modification in residue.modifications:
+                letter = {"S": "T", "P": "P"}.get(modification.lstrip("0123456789?"))
+                if letter:
+                    counts[letter] = counts.get(letter, 0) + 1
+        return counts
+
+
+def _position(text):
+    return None if "?" in text else int(text)
+
+
+def identify(unique_res):
+    """
+    `(name, anomer, anomeric_position, modifications, reduced)` for one
+    UniqueRES body such as "a2122h-1b_1-5_2*NCC/3=O".
+    """
+    head, *parts = unique_res.split("_")
+    backbone, _, anomeric = head.partition("-")
+    if not backbone:
+        raise ValueError(f"Empty residue: [{unique_res}]")
+    reduced = backbone[0] == "o"
+    if backbone[0] in "ou":  # alditol / open-chain aldehyde: same monosaccharide
+        backbone = "a" + backbone[1:]
+
+    anomer, anomeric_position = "?", None
+    if anomeric:
+        match = re.match(r"^([\d?]+)([abx]?)$", anomeric)
+        if not match:
+            raise ValueError(f"Bad anomeric descriptor in [{unique_res}]")
+        anomeric_position = _position(match[1])
+        anomer = {"a": "a", "b": "b"}.get(match[2], "?")
+
+    substituents = []
+    for part in parts:
+        if _RING.match(part):
+            continue
+        match = _SUBSTITUENT.match(part)
+        if not match:
+            raise ValueError(f"Unsupported residue descriptor {part!r} in [{unique_res}]")
+        substituents.append((_position(match[1]), match[2]))
+
+    name = BACKBONES.get(backbone)
+    if name is None:
+        if re.match(r"^a[0-9x]{4}h$", backbone):
+            name = "Hex"
+        elif re.match(r"^a[0-9x]{4}m$", backbone):
+            name = "dHex"
+        else:
+            name = "?"
+    modifications = []
+    for position, substituent in substituents:
+        derived = DERIVED.get((name, position, substituent))
+        if derived and name in ("Glc", "Gal", "Man", "Hex", "Neu"):
+            name = derived
+            continue
+        short = MODIFICATIONS.get(substituent, "?")
+        modifications.append(f"{'?' if position is None else position}{short}")
+    if name == "Neu":
+        name = "Kdn"
+    return name, anomer, anomeric_position, tuple(modifications), reduced
+
+
+def _side(text):
+    """
+    `(residue letter, position)` for one side of a LIN, or `(None, letters)`
+    when its alternatives span several residues ("d2|d4|e2|e4").
+    """
+    alternatives = []
+    for alternative in text.split("|"):
+        match = _GLIP.match(alternative)
+        if not match:
+            raise ValueError(f"Bad linkage position: {text!r}")
+        alternatives.append((match[1], _position(match[2])))
+    letters = {letter for letter, _ in alternatives}
+    if len(letters) > 1:
+        return None, letters
+    letter, position = alternatives[0]
+    return letter, position if len(alternatives) == 1 else None
+
+
+def _index(letter):
+    if len(letter) != 1 or letter not in LABELS:
+        raise ValueError(f"Unsupported residue label: {letter!r}")
+    return LABELS.index(letter)
+
+
+def parse(text):
+    """Parse a WURCS 2.0 string into a Structure. Raises ValueError."""
+    match = _WURCS.match(text.strip())
+    if not match:
+        raise ValueError("Not a WURCS=2.0 string.")
+    n_unique, n_res, n_lin = (int(match[i]) for i in (1, 2, 3))
+    uniques = _UNIQUE_RES.findall(match[4])
+    sequence = [int(i) for i in match[5].split("-") if i]
+    if len(uniques) != n_unique or len(sequence) != n_res:
+        raise ValueError("Residue counts don't match the WURCS header.")
+
+    residues = []
+    for index, unique in enumerate(sequence):
+        if not 1 <= unique <= n_unique:
+            raise ValueError(f"RES list refers to unknown residue {unique}.")
+        name, anomer, anomeric_position, modifications, reduced = identify(uniques[unique - 1])
+        residues.append(Residue(index, name, anomer, anomeric_position, modifications, reduced))
+    if not residues:
+        raise ValueError("WURCS has no residues.")
+
+    lins = [lin for lin in match[6].split("_") if lin]
+    if len(lins) != n_lin:
+        raise ValueError("Linkage count doesn't match the WURCS header.")
+    floating = set()
+    for lin in lins:
+        if "~" in lin:
+            raise ValueError("Repeating units are not supported.")
+        lin = lin.split("*", 1)[0].replace("{", "").replace("}", "")  # drop bridge MAPs and fuzzy marks
+        left, _, right = lin.partition("-")
+        if not right:
+            raise ValueError(f"Bad linkage: {lin!r}")
+        (a, a_pos), (b, b_pos) = _side(left), _side(right)
+        if a is None or b is None:
+            # One side lists several possible parents: the other residue is
+            # "floating" (attached somewhere undefined).
+            if a is None and b is None:
+                raise ValueError(f"Unsupported linkage: {lin!r}")
+            floating.add(_index(a or b))
+            continue
+        if max(_index(a), _index(b)) >= len(residues):
+            raise ValueError(f"Linkage refers to a missing residue: {lin!r}")
+        first, second = residues[_index(a)], residues[_index(b)]
+        # The child is the residue linked through its anomeric carbon (the later
+        # one when unclear: WURCS numbers residues from the reducing end).
+        if second.anomeric_position == b_pos and second.parent is None and second.index != 0:
+            parent, child, p_pos, c_pos = first, second, a_pos, b_pos
+        elif first.anomeric_position == a_pos and first.parent is None and first.index != 0:
+            parent, child, p_pos, c_pos = second, first, b_pos, a_pos
+        elif first.index < second.index:
+            parent, child, p_pos, c_pos = first, second, a_pos, b_pos
+        else:
+            parent, child, p_pos, c_pos = second, first, b_pos, a_pos
+        if child.parent is not None or child is parent:
+            raise ValueError("Cyclic structures are not supported.")
+        link = Link(parent, child, p_pos, c_pos)
+        parent.children.append(link)
+        child.parent = link
+
+    for residue in residues:
+        residue.children.sort(key=lambda link: (link.parent_position or 0), reverse=True)
+    roots = [r for r in residues if r.parent is None and r.index not in floating]
+    if not roots:
+        raise ValueError("Cyclic structures are not supported.")
+    root = roots[0]
+    return Structure(residues, root, [r for r in residues if r.parent is None and r is not root])
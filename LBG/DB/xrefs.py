@@ -0,0 +1,257 @@
+"""
+Cross-references to GlyTouCan, GlyCosmos and GlyConnect from local dumps.
+
+`import_dump(registry, path)` loads one registry's dump file into the
+`RegistryEntry` mirror, replacing what was there. Dumps are CSV or TSV
+files (optionally .gz / .zst compressed) with a header row. Columns are
+matched by name, ignoring case, spaces and dashes:
+
+    accession      accession, accession_number, id, structure_id
+    glytoucan_id   glytoucan_id, glytoucan_ac, glytoucan   (GlyTouCan: the accession)
+    wurcs          wurcs, sequence
+    composition    composition   ("H5N4F1S2" or "Hex:5 HexNAc:4 dHex:1 NeuAc:2")
+
+Rows are normalised in Python, COPY'd into a staging table and swapped in
+with one DELETE + INSERT, so readers see either the old or the new mirror.
+When a dump has no composition, it is derived from the WURCS (wurcs.py).
+
+`sync()` then fills in blank Glycan fields with a few set-based
+`UPDATE ... FROM` joins against the mirror (see STEPS), in order:
+GlyTouCan IDs by WURCS, WURCS by GlyTouCan ID, GlyCosmos and GlyConnect IDs
+by GlyTouCan ID, and missing compositions. A key that maps to more than one
+value is ambiguous and skipped, and filled-in fields are never overwritten.
+Everything runs offline against the mirrored files.
+"""
+
+import csv
+import io
+import re
+
+from django.db import connection, transaction
+
+from . import composition_query, glycan_search, motif_index, table_versions, wurcs
+from .bulk_load import open_compressed
+from .models import COMPOSITION_LETTERS, Glycan, RegistryEntry, composition_ids, format_composition
+
+COLUMNS = {
+    "accession": ("accession", "accession_number", "id", "structure_id"),
+    "glytoucan_id": ("glytoucan_id", "glytoucan_ac", "glytoucan"),
+    "wurcs": ("wurcs", "sequence"),
+    "composition": ("composition",),
+}
+
+# Monosaccharide names in registry compositions -> COMPOSITION_LETTERS.
+COMPOSITION_NAMES = {
+    "hex": "H",
+    "hexnac": "N",
+    "dhex": "F",
+    "fuc": "F",
+    "neuac": "S",
+    "neu5ac": "S",
+    "neugc": "G",
+    "neu5gc": "G",
+    "phosphate": "P",
+    "phos": "P",
+    "sulfate": "T",
+    "sulphate": "T",
+    "sulf": "T",
+}
+_LETTER_COMPOSITION = re.compile(r"^(?:[A-Z]\d+)+$")
+_NAMED_COUNT = re.compile(r"([A-Za-z0-9]+)\s*[:(]?\s*(\d+)\)?")
+
+
+def _normalise_header(name):
+    return re.sub(r"[\s-]+", "_", name.strip().lower())
+
+
+def normalise_composition(text):
+    """A registry composition as a composition string ("H5N4F1S2"), or "" if it uses unknown residues."""
+    text = text.strip()
+    if not text:
+        return ""
+    counts = dict.fromkeys(COMPOSITION_LETTERS, 0)
+    if _LETTER_COMPOSITION.match(text):
+        pairs = re.findall(r"([A-Z])(\d+)", text)
+    else:
+        pairs = [(COMPOSITION_NAMES.get(name.lower()), count) for name, count in _NAMED_COUNT.findall(text)]
+    for letter, count in pairs:
+        if letter not in counts:
+            return ""
+        counts[letter] += int(count)
+    return format_composition(counts[letter] for letter in COMPOSITION_LETTERS)
+
+
+def wurcs_composition(text):
+    """Composition string of a WURCS structure, or "" if it can't be parsed."""
+    try:
+        counts = wurcs.parse(text).composition()
+    except ValueError:
+        return ""
+    return format_composition(counts.get(letter, 0) for letter in COMPOSITION_LETTERS)
+
+
+def read_dump(registry, stream):
+    """
+    Yield `(accession, glytoucan_id, wurcs, composition_string)` for every
+    row of a dump opened as text. Raises ValueError without an accession column.
+    """
+    first = stream.readline()
+    # Judge the delimiter by the header only: WURCS values contain commas.
+    delimiter = "\t" if "\t" in first else "," if "," in first or ";" not in first else ";"
+    header = [_normalise_header(name) for name in next(csv.reader([first], delimiter=delimiter), [])]
+    reader = csv.reader(stream, delimiter=delimiter)
+    positions = {}
+    for column, aliases in COLUMNS.items():
+        for alias in aliases:
+            if alias in header:
+                positions[column] = header.index(alias)
+                break
+    if "accession" not in positions:
+        raise ValueError(f"No accession column in the {registry} dump (looked for {', '.join(COLUMNS['accession'])}).")
+
+    def value(row, column):
+        position = positions.get(column)
+        return row[position].strip() if position is not None and position < len(row) else ""
+
+    for row in reader:
+        accession = value(row, "accession")
+        if not accession:
+            continue
+        glytoucan_id = accession if registry == RegistryEntry.GLYTOUCAN else value(row, "glytoucan_id")
+        structure = value(row, "wurcs")
+        if not structure.startswith("WURCS="):
+            structure = ""
+        if "composition" in positions:
+            composition = normalise_composition(value(row, "composition"))
+        else:
+            composition = wurcs_composition(structure) if structure else ""
+        yield accession, glytoucan_id, structure, composition
+
+
+def import_dump(registry, path):
+    """Replace the mirror of `registry` with the dump at `path`. Returns the row count."""
+    if registry not in dict(RegistryEntry.REGISTRIES):
+        raise ValueError(f"Unknown registry: {registry!r}")
+    q = connection.ops.quote_name
+    table = q(RegistryEntry._meta.db_table)
+    columns = ("accession", "glytoucan_id", "wurcs", "composition_string")
+    with open_compressed(path) as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as stream:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMPORARY TABLE xref_staging "
+                "(accession text, glytoucan_id text, wurcs text, composition_string text) ON COMMIT DROP"
+            )
+            with cursor.copy(f"COPY xref_staging ({', '.join(columns)}) FROM STDIN") as copy:
+                for row in read_dump(registry, stream):
+                    copy.write_row(row)
+            cursor.execute(f"DELETE FROM {table} WHERE registry = %s", [registry])
+            # A dump may list an accession twice; keep one row.
+            cursor.execute(
+                f"INSERT INTO {table} (registry, {', '.join(q(c) for c in columns)}) "
+                f"SELECT DISTINCT ON (accession) %s, {', '.join(columns)} FROM xref_staging ORDER BY accession",
+                [registry],
+            )
+            rows = cursor.rowcount
+            cursor.execute("DROP TABLE xref_staging")  # ON COMMIT only fires at the outermost commit
+            table_versions.bump(RegistryEntry._meta.db_table)
+    return rows
+
+
+def lookup(accessions, registry=RegistryEntry.GLYTOUCAN):
+    """`{accession: {"glytoucan_id", "wurcs", "composition"}}` for many accessions in one query."""
+    return {
+        entry["accession"]: {
+            "glytoucan_id": entry["glytoucan_id"],
+            "wurcs": entry["wurcs"],
+            "composition": entry["composition_string"],
+        }
+        for entry in RegistryEntry.objects.filter(registry=registry, accession__in=list(accessions)).values(
+            "accession", "glytoucan_id", "wurcs", "composition_string"
+        )
+    }
+
+
+# ---------------------------------------------------------------------------
+# Filling in Glycan fields
+# ---------------------------------------------------------------------------
+# (Glycan column to fill, mirror column with the value, join key, registries
+# to read or None for all). Keys are "glytoucan_id" or "wurcs".
+STEPS = (
+    ("glytoucan_id", "glytoucan_id", "wurcs", None),
+    ("wurcs", "wurcs", "glytoucan_id", None),
+    ("glycosmos_id", "accession", "glytoucan_id", (RegistryEntry.GLYCOSMOS,)),
+    ("glyconnect_id", "accession", "glytoucan_id", (RegistryEntry.GLYCONNECT,)),
+)
+
+
+def _fill(cursor, target, value, key, registries):
+    """One set-based UPDATE for a STEPS entry. Returns the updated glycan ids."""
+    q = connection.ops.quote_name
+    glycans = q(Glycan._meta.db_table)
+    mirror = q(RegistryEntry._meta.db_table)
+    where, params = f"{q(value)} <> '' AND {q(key)} <> ''", []
+    if registries:
+        where += " AND registry = ANY(%s)"
+        params.append(list(registries))
+    join = f"g.{q(key)} = m.key"
+    if key == "wurcs":
+        join = f"md5(g.{q(key)}) = md5(m.key) AND {join}"  # can use the glycan_wurcs_md5 index
+    cursor.execute(
+        f"UPDATE {glycans} g SET {q(target)} = m.value "
+        f"FROM (SELECT {q(key)} AS key, min({q(value)}) AS value "
+        f"      FROM {mirror} WHERE {where} GROUP BY {q(key)} "
+        f"      HAVING count(DISTINCT {q(value)}) = 1) m "
+        f"WHERE g.{q(target)} = '' AND {join} RETURNING g.id",
+        params,
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _fill_compositions(cursor):
+    """Link glycans without a composition to the one the mirror has for their GlyTouCan ID."""
+    q = connection.ops.quote_name
+    glycans = q(Glycan._meta.db_table)
+    mirror = q(RegistryEntry._meta.db_table)
+    cursor.execute(
+        f"SELECT g.id, min(m.composition_string) FROM {glycans} g JOIN {mirror} m ON m.glytoucan_id = g.glytoucan_id "
+        f"WHERE g.monosaccharide_comp_id IS NULL AND g.glytoucan_id <> '' AND m.composition_string <> '' "
+        f"GROUP BY g.id HAVING count(DISTINCT m.composition_string) = 1"
+    )
+    pairs = cursor.fetchall()
+    if not pairs:
+        return []
+    counts = {}
+    for composition in {composition for _, composition in pairs}:
+        bounds = composition_query.parse(composition)
+        counts[composition] = tuple(bounds[letter][0] for letter in COMPOSITION_LETTERS)
+    ids = composition_ids(counts.values())
+    cursor.execute(
+        f"UPDATE {glycans} g SET monosaccharide_comp_id = u.comp FROM unnest(%s::text[], %s::bigint[]) AS u(id, comp) "
+        f"WHERE g.id = u.id",
+        [[glycan_id for glycan_id, _ in pairs], [ids[counts[composition]] for _, composition in pairs]],
+    )
+    return [glycan_id for glycan_id, _ in pairs]
+
+
+def sync(dry_run=False):
+    """
+    Fill blank Glycan cross-reference fields from the mirror. Returns
+    `{field: glycans filled}`; with `dry_run` the changes are rolled back.
+    """
+    filled, changed = {}, set()
+    with transaction.atomic(), connection.cursor() as cursor:
+        for target, value, key, registries in STEPS:
+            ids = _fill(cursor, target, value, key, registries)
+            filled[target] = len(ids)
+            changed.update(ids)
+        ids = _fill_compositions(cursor)
+        filled["composition"] = len(ids)
+        changed.update(ids)
+        if dry_run:
+            transaction.set_rollback(True)
+        elif changed:
+            table_versions.bump(Glycan._meta.db_table)
+            glycan_search.refresh(sorted(changed))
+    if changed and not dry_run:
+        motif_index.backfill()  # fingerprints for the WURCS filled in
+    return filled
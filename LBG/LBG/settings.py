@@ -38,6 +38,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "DB",
 ]
 
@@ -129,6 +130,12 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, "static")]
 
 ALLOWED_UPLOAD_TYPES = ["image/png", "image/jpeg", "image/gif", "image/svg+xml"]
 
+# Derived data that can be rebuilt at any time (precomputed lookup tables,
+# render caches, ...). Safe to delete.
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+# Upper bound for the on-disk SNFG render cache (CACHE_DIR/snfg), in bytes.
+SNFG_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
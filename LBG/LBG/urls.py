@@ -16,10 +16,18 @@ Including another URLconf
 """
 
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from DB import views as db_views
+
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("api/", include("DB.urls")),
+    re_path(
+        r"^thumbnails/(?P<digest>[0-9a-f]{64})-(?P<size>[0-9]+)\.(?P<fmt>webp|png)$",
+        db_views.thumbnail,
+        name="thumbnail",
+    ),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)